@@ -0,0 +1,129 @@
+"""
+Cold-start benchmark.
+
+Imports song.py in a fresh interpreter under `python -X importtime`
+(what every Render restart pays before the bot can answer) and reports
+the wall time, song's own cumulative import time and which packages it
+went to. Modules that should only load on first use (AI SDKs, PIL,
+requests, Flask) are flagged if they show up.
+
+    python -m bench.coldstart
+    python -m bench.coldstart --runs 5 --top 15
+    python -m bench.coldstart --budget-ms 1500   # exit 1 when over budget (CI)
+
+Needs the bot's own dependencies installed; nothing connects anywhere,
+the clients are only constructed.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# must not be imported by `import song`: loaded on first use, or not at all
+LAZY = ("groq", "google.genai", "google.generativeai", "PIL", "requests", "flask")
+
+
+def parse_importtime(stderr: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(own), int(cumulative), depth))
+    return rows
+
+
+def run_once(module: str, workdir: str) -> tuple:
+    env = dict(os.environ)
+    env.update({
+        "API_ID": env.get("API_ID", "1"),
+        "API_HASH": env.get("API_HASH", "bench"),
+        "USERBOT_SESSION": env.get("USERBOT_SESSION", "bench"),
+        "DOWNLOAD_DIR": os.path.join(workdir, "downloads"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")])),
+    })
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode:
+        tail = "\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:"))[-2000:]
+        raise SystemExit(f"`import {module}` failed:\n{tail}")
+    return wall, parse_importtime(proc.stderr)
+
+
+def report(rows: list, module: str, top: int) -> dict:
+    by_package = {}
+    for name, own, _, _ in rows:
+        root = name.split(".")[0]
+        by_package[root] = by_package.get(root, 0) + own
+    cumulative = next((c for name, _, c, d in rows if name == module and d == 0), 0)
+    loaded = {name for name, *_ in rows}
+    return {
+        "import_ms": round(cumulative / 1000, 1),
+        "modules": len(rows),
+        "packages_ms": {k: round(v / 1000, 1) for k, v in
+                        sorted(by_package.items(), key=lambda kv: -kv[1])[:top]},
+        "eager_lazy": sorted(m for m in LAZY if m in loaded),
+    }
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="coldstart-")
+    walls, imports, last = [], [], None
+    for _ in range(args.runs):
+        wall, rows = run_once(args.module, workdir)
+        walls.append(wall)
+        last = report(rows, args.module, args.top)
+        imports.append(last["import_ms"])
+
+    result = {
+        "runs": args.runs,
+        "wall_ms": round(statistics.median(walls) * 1000, 1),
+        "import_ms": round(statistics.median(imports), 1),
+        "modules": last["modules"],
+        "packages_ms": last["packages_ms"],
+        "eager_lazy": last["eager_lazy"],
+    }
+    over = args.budget_ms and result["import_ms"] > args.budget_ms
+
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        print(f"import {args.module}: {result['import_ms']}ms (process {result['wall_ms']}ms, "
+              f"{result['modules']} modules, median of {args.runs})")
+        print("\nself time per package:")
+        for name, ms in result["packages_ms"].items():
+            print(f"  {name:<24} {ms:>8}ms")
+        if result["eager_lazy"]:
+            print(f"\n⚠️ imported at startup but meant to be lazy: {', '.join(result['eager_lazy'])}")
+        if over:
+            print(f"\n❌ over budget: {result['import_ms']}ms > {args.budget_ms}ms")
+
+    if over or result["eager_lazy"]:
+        sys.exit(1)
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--module", default="song")
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--top", type=int, default=12, help="packages to list")
+    p.add_argument("--budget-ms", type=float, default=0, help="fail when import takes longer (0 = off)")
+    p.add_argument("--json", action="store_true")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
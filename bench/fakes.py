@@ -0,0 +1,149 @@
+"""
+In-process stand-ins for Pyrogram's Client/Message and PyTgCalls.
+
+They accept the calls the handlers make, sleep `latency` seconds like a
+Telegram round trip would, and count what happened.
+"""
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+_ids = itertools.count(1000)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, first_name: str = "Bench", username: str = None):
+        self.id = user_id
+        self.first_name = first_name
+        self.username = username
+        self.is_bot = False
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+        self.type = "supergroup"
+
+
+class FakeMessage:
+    def __init__(self, client, chat_id: int, user: FakeUser, text: str = "", reply_to=None):
+        self._client = client
+        self.id = next(_ids)
+        self.chat = FakeChat(chat_id)
+        self.from_user = user
+        self.text = text
+        self.caption = None
+        self.entities = None
+        self.caption_entities = None
+        self.reply_to_message = reply_to
+        self.mentioned = False
+        self.command = text[1:].split() if text.startswith("/") else None
+        self.answered = asyncio.Event()     # set on the first reply to this message
+
+    async def _sent(self, kind, text=""):
+        await self._client.api(kind)
+        self.answered.set()
+        return FakeMessage(self._client, self.chat.id, self._client.me, text)
+
+    async def reply_text(self, text, *args, **kwargs):
+        return await self._sent("send_message", text)
+
+    reply = reply_text
+
+    async def reply_photo(self, *args, **kwargs):
+        return await self._sent("send_photo")
+
+    async def reply_sticker(self, *args, **kwargs):
+        return await self._sent("send_sticker")
+
+    async def edit_text(self, *args, **kwargs):
+        await self._client.api("edit_message")
+        return self
+
+    async def edit_caption(self, *args, **kwargs):
+        await self._client.api("edit_message")
+        return self
+
+    async def delete(self):
+        await self._client.api("delete_message")
+
+    def stop_propagation(self):
+        pass
+
+
+class FakeClient:
+    """Pyrogram Client stand-in: every API method costs `latency` seconds."""
+
+    def __init__(self, latency: float = 0.05, me_id: int = 1):
+        self.latency = latency
+        self.me = FakeUser(me_id, "Waguri", "BestFreakingBot")
+        self.calls = {}
+
+    async def api(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(self.latency)
+
+    def message(self, chat_id: int, user: FakeUser, text: str, reply_to=None) -> FakeMessage:
+        return FakeMessage(self, chat_id, user, text, reply_to)
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        await self.api("send_message")
+        return FakeMessage(self, chat_id, self.me, text)
+
+    async def send_photo(self, chat_id, *args, **kwargs):
+        await self.api("send_photo")
+        return FakeMessage(self, chat_id, self.me)
+
+    async def send_audio(self, chat_id, *args, **kwargs):
+        await self.api("send_audio")
+        return FakeMessage(self, chat_id, self.me)
+
+    async def send_video(self, chat_id, *args, **kwargs):
+        await self.api("send_video")
+        return FakeMessage(self, chat_id, self.me)
+
+    async def send_document(self, chat_id, *args, **kwargs):
+        await self.api("send_document")
+        return FakeMessage(self, chat_id, self.me)
+
+    async def get_users(self, user_id):
+        await self.api("get_users")
+        return FakeUser(user_id)
+
+    async def get_chat_members(self, chat_id, *args, **kwargs):
+        await self.api("get_chat_members")
+        yield type("Member", (), {"user": self.me})()
+
+
+class FakeCalls:
+    """PyTgCalls stand-in: joining/switching a stream costs `latency` seconds."""
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+        self.active = {}            # chat_id -> call (what get_call returns)
+        self.plays = 0
+
+    async def play(self, chat_id, stream=None):
+        self.plays += 1
+        await asyncio.sleep(self.latency)
+        # /seek re-reads the playing file from call.input.filename
+        filename = getattr(stream, "path", None) or getattr(stream, "media_path", None) or "bench.mp3"
+        self.active[chat_id] = SimpleNamespace(chat_id=chat_id, input=SimpleNamespace(filename=filename))
+
+    async def change_stream(self, chat_id, stream=None):
+        await self.play(chat_id, stream)
+
+    async def pause(self, chat_id):
+        await asyncio.sleep(self.latency / 4)
+
+    async def resume(self, chat_id):
+        await asyncio.sleep(self.latency / 4)
+
+    async def leave_call(self, chat_id):
+        self.active.pop(chat_id, None)
+
+    stop_stream = leave_call
+
+    def get_call(self, chat_id):
+        return self.active.get(chat_id)
+
@@ -0,0 +1,224 @@
+"""
+Multi-chat load generator.
+
+Simulates N chats that keep a song playing and fire /play, /skip, /seek,
+/end and AI mentions at random (Poisson) intervals against the same fakes
+and HTTP stand-in as bench.run. Runs one step per chat count and, per
+step, records command latency, event-loop lag, task count, RSS growth
+and the size of the per-chat dicts, so the point where handle_next /
+the timer wheel / progress edits start falling behind shows up as a knee.
+
+    python -m bench.load --chats 10,50,200,500 --duration 30
+    python -m bench.load --chats 100 --rates play=2,skip=1,seek=0.5,end=0.2,ai=3 --track-seconds 15
+
+Rates are per chat per minute. "ai" latency is the time to the first
+text of the (coalesced) reply; triggers merged into a newer one's reply
+are counted as ai_merged.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import time
+
+from bench.fakes import FakeUser
+from bench.run import add_common_args, boot, percentile, settle
+from core.loopmon import LoopMonitor
+
+COMMANDS = ("play", "skip", "seek", "end", "ai")
+DEFAULT_RATES = "play=2,skip=1,seek=0.5,end=0.2,ai=2"
+
+# an AI trigger not answered by then was merged into a later burst
+AI_REPLY_TIMEOUT = 15
+
+# per-chat state in song.py worth watching for leaks
+CHAT_DICTS = ("current_song", "music_queue", "timers", "progress_timers", "WHEEL", "chat_locks", "PLAYBACK",
+              "loop_counts")
+
+
+def rss_mb() -> float:
+    """Current resident set size (falls back to peak RSS off Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_rates(text: str) -> dict:
+    rates = dict.fromkeys(COMMANDS, 0.0)
+    for part in text.split(","):
+        name, _, value = part.partition("=")
+        if name not in rates:
+            raise SystemExit(f"unknown command {name!r} in --rates (choose from {', '.join(COMMANDS)})")
+        rates[name] = float(value)
+    return rates
+
+
+class ChatSim:
+    """One simulated group chat issuing commands against song.py."""
+
+    def __init__(self, song, client, chat_id: int, rates: dict, latencies: dict):
+        self.song = song
+        self.client = client
+        self.chat_id = chat_id
+        self.user = FakeUser(10_000 + abs(chat_id), f"user{abs(chat_id)}")
+        self.rates = rates
+        self.latencies = latencies
+        self.n = 0
+
+    async def issue(self, command: str):
+        song, client = self.song, self.client
+        self.n += 1
+        if command == "play":
+            msg = client.message(self.chat_id, self.user, f"/play load {self.chat_id} {self.n}")
+            call = song.play_command(client, msg)
+        elif command == "skip":
+            call = song.skip_command(client, client.message(self.chat_id, self.user, "/skip"))
+        elif command == "seek":
+            call = song.seek_cmd(client, client.message(self.chat_id, self.user, f"/seek {random.randint(5, 60)}"))
+        elif command == "end":
+            call = song.end_command(client, client.message(self.chat_id, self.user, "/end"))
+        else:
+            msg = client.message(self.chat_id, self.user, f"waguri what's playing? {self.n}")
+            call = self.ai_reply(song.TEXT_ROUTER.dispatch(client, msg), msg)
+
+        start = time.perf_counter()
+        try:
+            answered = await call
+        except Exception:
+            self.latencies.setdefault("errors", []).append(command)
+            return
+        if answered is False:
+            self.latencies.setdefault("ai_merged", []).append(command)
+            return
+        self.latencies.setdefault(command, []).append(time.perf_counter() - start)
+
+    @staticmethod
+    async def ai_reply(dispatch, msg) -> bool:
+        """
+        Dispatch only queues the trigger on the coalescer; wait for the first
+        text of the reply instead. False if the message was merged into a
+        burst answered in reply to a newer one.
+        """
+        await dispatch
+        try:
+            await asyncio.wait_for(msg.answered.wait(), AI_REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def run(self, until: float):
+        total = sum(self.rates.values()) / 60
+        names = [c for c in COMMANDS if self.rates[c]]
+        weights = [self.rates[c] for c in names]
+
+        await self.issue("play")
+        while total and time.monotonic() < until:
+            await asyncio.sleep(random.expovariate(total))
+            if time.monotonic() >= until:
+                break
+            # fire and forget: a slow command must not slow this chat's arrival rate
+            asyncio.ensure_future(self.issue(random.choices(names, weights)[0]))
+
+
+async def sample(song, monitor, stats, interval=1.0):
+    while True:
+        await asyncio.sleep(interval)
+        stats["tasks"].append(len(asyncio.all_tasks()))
+        stats["rss"].append(rss_mb())
+        stats["lag"].extend(monitor.lags)
+        monitor.lags.clear()
+
+
+async def step(song, client, chats: int, args, rates, monitor) -> dict:
+    gc.collect()
+    rss_before = rss_mb()
+    latencies = {}
+    stats = {"tasks": [], "rss": [], "lag": []}
+    sampler = asyncio.ensure_future(sample(song, monitor, stats))
+
+    until = time.monotonic() + args.duration
+    sims = [ChatSim(song, client, -(100_000 * (chats + 1)) - i, rates, latencies) for i in range(chats)]
+    await asyncio.gather(*(sim.run(until) for sim in sims))
+    # let commands still in flight finish before measuring state
+    await asyncio.sleep(args.drain)
+
+    sampler.cancel()
+    sizes = {name: len(getattr(song, name)) for name in CHAT_DICTS}
+    sizes["vc_active"] = len(song.vc_active)
+    await settle(song)
+
+    commands = {}
+    for name, data in latencies.items():
+        if name in ("errors", "ai_merged"):
+            continue
+        commands[name] = {
+            "n": len(data),
+            "p50_ms": round(percentile(data, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(data, 0.95) * 1000, 1),
+            "max_ms": round(max(data) * 1000, 1),
+        }
+
+    lag = stats["lag"]
+    return {
+        "chats": chats,
+        "commands": commands,
+        "errors": len(latencies.get("errors", [])),
+        "ai_merged": len(latencies.get("ai_merged", [])),
+        "loop_lag_ms": {
+            "p50": round((percentile(lag, 0.50) or 0) * 1000, 1),
+            "p95": round((percentile(lag, 0.95) or 0) * 1000, 1),
+            "max": round(max(lag, default=0) * 1000, 1),
+        },
+        "slow_callbacks": len(monitor.recent),
+        "tasks_max": max(stats["tasks"], default=0),
+        "rss_mb": {"before": round(rss_before, 1), "peak": round(max(stats["rss"], default=rss_before), 1),
+                   "after": round(rss_mb(), 1)},
+        "state_sizes": sizes,
+    }
+
+
+async def main(args):
+    rates = parse_rates(args.rates)
+    song, client, standin, _ = await boot(args, duration=args.track_seconds)
+    # the watchdog's slow-callback threshold is also what counts as "fell behind" here
+    monitor = LoopMonitor(interval=0.1, slow=args.slow_ms / 1000, log_every=3600)
+    monitor.start()
+
+    steps = []
+    for chats in args.chats:
+        monitor.recent.clear()
+        result = await step(song, client, chats, args, rates, monitor)
+        steps.append(result)
+        if not args.json:
+            cmds = "  ".join(f"{k} p95={v['p95_ms']}ms" for k, v in result["commands"].items())
+            print(
+                f"chats={chats:<5} lag p95={result['loop_lag_ms']['p95']}ms max={result['loop_lag_ms']['max']}ms  "
+                f"tasks≤{result['tasks_max']}  rss {result['rss_mb']['before']}→{result['rss_mb']['peak']}MB  "
+                f"errors={result['errors']} ai_merged={result['ai_merged']}\n    {cmds}\n    state {result['state_sizes']}"
+            )
+
+    monitor.stop()
+    await standin.stop()
+    if args.json:
+        print(json.dumps({"config": vars(args), "steps": steps}, indent=1))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--chats", type=lambda s: [int(x) for x in s.split(",")], default=[10, 50, 100])
+    p.add_argument("--duration", type=float, default=20, help="seconds per step")
+    p.add_argument("--drain", type=float, default=2, help="seconds to let in-flight commands finish")
+    p.add_argument("--rates", default=DEFAULT_RATES, help="per chat per minute, e.g. " + DEFAULT_RATES)
+    p.add_argument("--track-seconds", type=int, default=20, help="track length, so auto-next fires during the run")
+    p.add_argument("--slow-ms", type=float, default=50, help="loop callbacks slower than this are counted")
+    add_common_args(p)
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
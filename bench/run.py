@@ -0,0 +1,218 @@
+"""
+Offline end-to-end benchmark.
+
+Drives the real handlers in song.py (/play, handle_next, /song, /add)
+against fake Telegram/PyTgCalls objects and a local HTTP stand-in for
+YouTube and the media API, then prints latency percentiles, throughput
+and where the time went per pipeline stage.
+
+    python -m bench.run
+    python -m bench.run --requests 200 --concurrency 20 --http-latency 0.1 --bandwidth 2e6
+    python -m bench.run --scenarios play,handle_next --json > before.json
+
+Needs the bot's own dependencies installed (pyrogram, pytgcalls, aiohttp,
+...); no network access or credentials.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.fakes import FakeCalls, FakeClient, FakeUser
+from bench.standin import StandIn
+
+SCENARIOS = ("play", "handle_next", "song", "add")
+
+
+def percentile(data, p):
+    if not data:
+        return None
+    data = sorted(data)
+    return data[min(len(data) - 1, int(p * len(data)))]
+
+
+def summarize(name, latencies, errors, wall):
+    return {
+        "scenario": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": round((percentile(latencies, 0.50) or 0) * 1000, 1),
+        "p95_ms": round((percentile(latencies, 0.95) or 0) * 1000, 1),
+        "p99_ms": round((percentile(latencies, 0.99) or 0) * 1000, 1),
+        "max_ms": round(max(latencies, default=0) * 1000, 1),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0,
+    }
+
+
+async def drive(name, make_call, requests, concurrency):
+    """Run `requests` calls of make_call(i) with at most `concurrency` in flight."""
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                await make_call(i)
+            except Exception as e:
+                errors += 1
+                print(f"[{name}] request {i} failed: {e!r}", file=sys.stderr)
+                return
+            latencies.append(time.perf_counter() - start)
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(name, latencies, errors, time.perf_counter() - wall)
+
+
+async def settle(song):
+    """Drop the watchdogs/progress ticks a scenario left behind and reset playback state."""
+    for state in (song.WHEEL, song.timers, song.progress_timers, song.current_song, song.music_queue,
+                  song.PLAYBACK):
+        state.clear()
+    song.vc_active.clear()
+
+
+def stage_breakdown(song) -> dict:
+    totals = {}
+    for trace in song.TRACER.traces:
+        for name, _, duration, depth, _ in trace.spans:
+            if depth == 0:
+                t = totals.setdefault(name, [0, 0.0])
+                t[0] += 1
+                t[1] += duration
+    return {name: round(total / count * 1000, 1) for name, (count, total) in sorted(totals.items())}
+
+
+async def boot(args, **standin_options):
+    """
+    Start the HTTP stand-in, point song.py at it, import song and swap in
+    the fakes. Returns (song, client, standin, workdir).
+    """
+    standin = StandIn(
+        latency=args.http_latency, jitter=args.http_latency / 4, bandwidth=int(args.bandwidth),
+        audio_size=int(args.audio_size), video_size=int(args.audio_size) * 4, **standin_options
+    )
+    base = await standin.start()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    os.environ.update({
+        "API_ID": os.getenv("API_ID", "1"),
+        "API_HASH": os.getenv("API_HASH", "bench"),
+        "USERBOT_SESSION": os.getenv("USERBOT_SESSION", "bench"),
+        "YOUTUBE_API_KEY": "bench",
+        "API_BASE": base,
+        "YOUTUBE_URL": base,
+        "YOUTUBE_API_URL": f"{base}/youtube/v3",
+        "DOWNLOAD_DIR": os.path.join(workdir, "downloads"),
+        "AI_LOCAL_BACKENDS": "1",
+    })
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import song
+
+    client = FakeClient(latency=args.tg_latency)
+    song.bot = client
+    for assistant in song.ASSISTANTS:
+        assistant.calls = FakeCalls(latency=args.vc_latency)
+    song.WHEEL.start()
+    return song, client, standin, workdir
+
+
+def add_common_args(p):
+    p.add_argument("--http-latency", type=float, default=0.05, help="seconds per upstream HTTP request")
+    p.add_argument("--bandwidth", type=float, default=5e6, help="upstream bytes/s per download (0 = unlimited)")
+    p.add_argument("--audio-size", type=float, default=3e6, help="bytes per audio file (video is 4x)")
+    p.add_argument("--tg-latency", type=float, default=0.05, help="seconds per Telegram API call")
+    p.add_argument("--vc-latency", type=float, default=0.2, help="seconds to start a voice chat stream")
+    p.add_argument("--json", action="store_true")
+
+
+async def main(args):
+    song, client, standin, workdir = await boot(args)
+
+    user = FakeUser(4242)
+    results = []
+    # unique queries -> every request downloads; --warm reuses a small set
+    query = (lambda i: f"bench song {i % 5}") if args.warm else (lambda i: f"bench song {i}")
+
+    for scenario in args.scenarios:
+        if scenario == "play":
+            async def call(i):
+                await song.play_command(client, client.message(-1000 - i, user, f"/play {query(i)}"))
+
+        elif scenario == "handle_next":
+            path = os.path.join(workdir, "next.mp3")
+            with open(path, "wb") as f:
+                f.write(b"\0" * 1024)
+            for i in range(args.requests):
+                chat_id = -2000 - i
+                song.current_song[chat_id] = {"title": "now", "url": path, "vid": "x" * 11, "user": user,
+                                              "duration": 180, "start_time": time.time()}
+                song.music_queue[chat_id] = [{"title": f"next {i}", "url": path, "vid": "y" * 11,
+                                              "user": user, "duration": 180}]
+                song.vc_active.add(chat_id)
+                song.PLAYBACK.playing(chat_id, song.PLAYBACK.load(chat_id))
+
+            async def call(i):
+                await song.handle_next(-2000 - i)
+
+        elif scenario == "song":
+            async def call(i):
+                await song.song_command(client, client.message(-3000 - i, user, f"/song {query(i)}"))
+
+        elif scenario == "add":
+            lines = "\n".join(f"bench track {n}" for n in range(args.add_lines))
+
+            async def call(i):
+                uid = 5000 + i
+                song.get_user_playlists(uid)["bench"] = []
+                await song.add_to_playlist(client, client.message(-4000, FakeUser(uid), f"/add bench\n{lines}"))
+
+        else:
+            raise SystemExit(f"unknown scenario {scenario!r} (choose from {', '.join(SCENARIOS)})")
+
+        results.append(await drive(scenario, call, args.requests, args.concurrency))
+        await settle(song)
+
+    report = {
+        "config": {k: v for k, v in vars(args).items()},
+        "results": results,
+        "stages_mean_ms": stage_breakdown(song),
+        "upstream_requests": standin.requests,
+        "telegram_calls": client.calls,
+    }
+    await standin.stop()
+
+    if args.json:
+        print(json.dumps(report, indent=1))
+        return
+
+    print(f"{'scenario':<12} {'reqs':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'req/s':>7}")
+    for r in results:
+        print(f"{r['scenario']:<12} {r['requests']:>5} {r['errors']:>4} {r['p50_ms']:>6}ms {r['p95_ms']:>6}ms "
+              f"{r['p99_ms']:>6}ms {r['max_ms']:>6}ms {r['throughput_rps']:>7}")
+    print("\nmean time per stage:")
+    for name, ms in report["stages_mean_ms"].items():
+        print(f"  {name:<18} {ms:>8}ms")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS))
+    p.add_argument("--requests", type=int, default=50)
+    p.add_argument("--concurrency", type=int, default=10)
+    p.add_argument("--add-lines", type=int, default=5, help="songs per /add")
+    p.add_argument("--warm", action="store_true", help="reuse 5 queries so downloads hit the file cache")
+    add_common_args(p)
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,117 @@
+"""
+Local stand-in for the HTTP upstreams the bot talks to:
+
+    GET /results?search_query=...    YouTube results page (HTML with watch?v= ids)
+    GET /youtube/v3/videos?id=...    YouTube Data API videos.list
+    GET /download?url=...&type=...   media API: hands out a download token
+    GET /stream/<vid>?type=...       media API: the file itself
+    GET /thumb/<vid>.jpg             thumbnail
+
+Every request waits `latency` seconds (± `jitter`) before answering and
+file bodies are paced to `bandwidth` bytes/s, so runs on a laptop look
+like the real thing without touching the network.
+"""
+import asyncio
+import hashlib
+import random
+
+from aiohttp import web
+
+
+def video_id(query: str) -> str:
+    """Stable fake 11-char YouTube id per query."""
+    digest = hashlib.sha1(query.encode()).hexdigest()
+    return ("v" + digest)[:11]
+
+
+class StandIn:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, bandwidth: int = 5_000_000,
+                 audio_size: int = 3_000_000, video_size: int = 12_000_000, duration: int = 200,
+                 chunk: int = 64 * 1024):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.audio_size = audio_size
+        self.video_size = video_size
+        self.duration = duration
+        self.chunk = chunk
+        self.requests = {}
+        self.base = None
+        self._runner = None
+
+    async def _wait(self, route):
+        self.requests[route] = self.requests.get(route, 0) + 1
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    # ---------- routes ----------
+
+    async def results(self, request):
+        await self._wait("results")
+        vid = video_id(request.query.get("search_query", ""))
+        body = f'<html><body><a href="/watch?v={vid}">{vid}</a></body></html>'
+        return web.Response(text=body, content_type="text/html")
+
+    async def videos(self, request):
+        await self._wait("videos")
+        vid = request.query.get("id", "")
+        m, s = divmod(self.duration, 60)
+        return web.json_response({"items": [{
+            "id": vid,
+            "snippet": {
+                "title": f"Bench song {vid}",
+                "channelTitle": "Bench Channel",
+                "thumbnails": {"high": {"url": f"{self.base}/thumb/{vid}.jpg"}},
+            },
+            "contentDetails": {"duration": f"PT{m}M{s}S"},
+            "statistics": {"viewCount": "123456"},
+        }]})
+
+    async def download(self, request):
+        await self._wait("download")
+        return web.json_response({"download_token": "bench"})
+
+    async def stream(self, request):
+        await self._wait("stream")
+        size = self.video_size if request.query.get("type") == "video" else self.audio_size
+        return await self._send_bytes(request, size)
+
+    async def thumb(self, request):
+        await self._wait("thumb")
+        return await self._send_bytes(request, 20_000, content_type="image/jpeg")
+
+    async def _send_bytes(self, request, size, content_type="application/octet-stream"):
+        resp = web.StreamResponse(headers={"Content-Type": content_type, "Content-Length": str(size)})
+        await resp.prepare(request)
+        block = b"\0" * self.chunk
+        sent = 0
+        while sent < size:
+            n = min(self.chunk, size - sent)
+            await resp.write(block[:n])
+            sent += n
+            if self.bandwidth:
+                await asyncio.sleep(n / self.bandwidth)
+        await resp.write_eof()
+        return resp
+
+    # ---------- lifecycle ----------
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/results", self.results)
+        app.router.add_get("/youtube/v3/videos", self.videos)
+        app.router.add_get("/download", self.download)
+        app.router.add_get("/stream/{vid}", self.stream)
+        app.router.add_get("/thumb/{name}", self.thumb)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://{host}:{port}"
+        return self.base
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
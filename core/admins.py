@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+
+from pyrogram import filters
+from pyrogram.enums import ChatMembersFilter
+
+log = logging.getLogger("music_bot")
+
+
+class AdminCache:
+    """
+    Per-chat set of administrator ids, fetched in one call from the chat's
+    administrator list and reused for `ttl` seconds. Concurrent lookups for
+    the same chat share a single fetch; invalidate() drops a chat early
+    (on chat-member updates).
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self._admins = {}     # chat_id -> (fetched_at, frozenset of user ids)
+        self._fetching = {}   # chat_id -> Task
+        self.hits = 0
+        self.fetches = 0
+
+    async def _fetch(self, client, chat_id):
+        self.fetches += 1
+        ids = set()
+        async for member in client.get_chat_members(chat_id, filter=ChatMembersFilter.ADMINISTRATORS):
+            if member.user:
+                ids.add(member.user.id)
+        admins = frozenset(ids)
+        self._admins[chat_id] = (time.monotonic(), admins)
+        return admins
+
+    async def admins(self, client, chat_id) -> frozenset:
+        entry = self._admins.get(chat_id)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+
+        task = self._fetching.get(chat_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(client, chat_id))
+            self._fetching[chat_id] = task
+            task.add_done_callback(lambda _: self._fetching.pop(chat_id, None))
+        return await asyncio.shield(task)
+
+    async def is_admin(self, client, chat_id, user_id) -> bool:
+        try:
+            return user_id in await self.admins(client, chat_id)
+        except Exception as e:
+            log.warning(f"Admin list for {chat_id} unavailable: {e}")
+            return False
+
+    def invalidate(self, chat_id):
+        self._admins.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        return {"chats": len(self._admins), "hits": self.hits, "fetches": self.fetches}
+
+
+def admin_filter(cache: AdminCache):
+    """Pyrogram filter: passes when the sender is an admin of the chat."""
+
+    async def func(flt, client, message):
+        if not message.from_user or not message.chat:
+            return False
+        return await cache.is_admin(client, message.chat.id, message.from_user.id)
+
+    return filters.create(func, "AdminFilter")
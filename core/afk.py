@@ -0,0 +1,122 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+
+class AfkStore:
+    """
+    AFK statuses: user_id -> {"time", "reason", "media", "media_type", "chats", "username"}.
+
+    - dict-style reads (`in`, get, pop, iteration) are O(1) and check expiry
+      lazily, so they are fine on the every-message path
+    - `chats` is the set of chats the user went AFK in; in_chat() scopes
+      announcements to those
+    - entries older than `ttl` are treated as gone and purged by sweep()
+    - with `path` set, save()/load() keep statuses across restarts; writes
+      only mark the store dirty, the caller flushes in batches
+    - `username` is kept so @mentions of a user still AFK after a restart
+      can be resolved before they speak again (see usernames())
+    """
+
+    def __init__(self, ttl: timedelta = timedelta(days=7), path: str = None):
+        self.ttl = ttl
+        self.path = path
+        self._users = {}
+        self.dirty = False
+
+    # ---------- reads ----------
+
+    def _expired(self, data) -> bool:
+        return datetime.utcnow() - data["time"] > self.ttl
+
+    def get(self, user_id, default=None):
+        data = self._users.get(user_id)
+        if data is None:
+            return default
+        if self._expired(data):
+            self.pop(user_id)
+            return default
+        return data
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __len__(self):
+        return len(self._users)
+
+    def __bool__(self):
+        return bool(self._users)
+
+    def __iter__(self):
+        return iter(list(self._users))
+
+    def in_chat(self, user_id, chat_id):
+        """The user's AFK data if they are AFK in this chat, else None."""
+        data = self.get(user_id)
+        if data and chat_id in data["chats"]:
+            return data
+        return None
+
+    def usernames(self):
+        """(username, user_id) for every AFK user whose username is known."""
+        for uid in self:
+            data = self.get(uid)
+            if data and data.get("username"):
+                yield data["username"], uid
+
+    # ---------- writes ----------
+
+    def set(self, user_id, chat_id, reason: str = "None", media=None, media_type=None, username=None):
+        existing = self.get(user_id)
+        chats = existing["chats"] if existing else set()
+        chats.add(chat_id)
+        self._users[user_id] = {
+            "time": datetime.utcnow(),
+            "reason": reason,
+            "media": media,
+            "media_type": media_type,
+            "chats": chats,
+            "username": username,
+        }
+        self.dirty = True
+
+    def pop(self, user_id, default=None):
+        data = self._users.pop(user_id, None)
+        if data is None:
+            return default
+        self.dirty = True
+        return data
+
+    def sweep(self) -> int:
+        """Drop expired entries. Returns how many."""
+        expired = [uid for uid, data in self._users.items() if self._expired(data)]
+        for uid in expired:
+            self.pop(uid)
+        return len(expired)
+
+    # ---------- persistence ----------
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        data = {
+            str(uid): {**d, "time": d["time"].isoformat(), "chats": sorted(d["chats"])}
+            for uid, d in self._users.items()
+        }
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for uid, d in data.items():
+            d["time"] = datetime.fromisoformat(d["time"])
+            d["chats"] = set(d.get("chats", ()))
+            self._users[int(uid)] = d
+        self.dirty = False
+        self.sweep()
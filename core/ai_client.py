@@ -1,53 +1,107 @@
-from google import genai
-from google.genai.types import Tool, GenerateContentConfig
+import asyncio
+import logging
 import os
+import random
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from core.ai_router import AIRouter, Backend, LocalBackend, NoBackendError
+from core.conversation import ConversationStore, estimate_tokens
+from core.metrics import METRICS
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 MODEL = "gemini-2.5-flash"
+GROQ_MODEL = "llama-3.1-8b-instant"
+
+# per-call timeout (seconds), calls allowed in flight at once, and how many
+# may wait for a slot before new ones are refused
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "20"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "32"))
+
+# explicit Gemini context cache for the system prompt (seconds to live)
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", "3600"))
+# the API refuses to cache anything shorter (tokens; 1024 for 2.5 Flash)
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "1024"))
+# background compaction of old turns into a running summary
+AI_COMPACT_INTERVAL = int(os.getenv("AI_COMPACT_INTERVAL", "20"))
+SUMMARY_MAX_CHARS = 600
+# summaries always go to this one backend, outside the router
+AI_SUMMARY_BACKEND = os.getenv("AI_SUMMARY_BACKEND", "groq")
+
+# fire a second backend when the first is slower than its usual p95
+AI_HEDGE = os.getenv("AI_HEDGE", "1") != "0"
+# AI_LOCAL_BACKENDS=1 swaps Groq/Gemini for offline stand-ins (tests, benchmarks)
+AI_LOCAL_BACKENDS = os.getenv("AI_LOCAL_BACKENDS", "0") == "1"
+
+log = logging.getLogger("music_bot")
+
+AI_SECONDS = METRICS.histogram(
+    "bot_ai_reply_seconds", "Time to a complete AI reply", ["mode"]
+)
+AI_CACHE = METRICS.counter("bot_ai_cache_total", "AI response cache lookups", ["result"])
+METRICS.gauge("bot_ai_queue_waiting", "AI calls waiting for a slot", fn=lambda: _waiting)
+
+# per-chat AI memory, bounded by tokens; AI_HISTORY_FILE enables persistence
+chat_history = ConversationStore(
+    max_chat_tokens=int(os.getenv("AI_CHAT_TOKENS", "1500")),
+    max_total_tokens=int(os.getenv("AI_TOTAL_TOKENS", "500000")),
+    path=os.getenv("AI_HISTORY_FILE") or None,
+)
 
-chat_history = {}
-MAX_HISTORY = 10
+# response cache for short, repetitive prompts ("hi", "gm", "waguri")
+CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "900"))
+CACHE_MAX_KEYS = int(os.getenv("AI_CACHE_MAX_KEYS", "512"))
+CACHE_POOL_SIZE = int(os.getenv("AI_CACHE_POOL_SIZE", "5"))
+CACHE_MAX_WORDS = 4
 
 
 SYSTEM_PROMPT = (
     "- Identity:\n"
     "  - Name: Waguri\n"
-    "  - Personality: sarcastic, savage\n"
+    "  - Personality: sarcastic, witty, mildly savage\n"
     "  - Tone: human, street-smart, confident\n"
-    "  - Little polite, never apologetic, never formal\n\n"
+    "  - Slightly rude, never formal, never soft\n\n"
 
-    "- Reply Style:"
-    "  - Short replies only (1–4 lines max)\n"
-    " - Always give latest replies not outdated\n"
-    "  - Punchy, cocky, disrespectfully funny\n"
-    "  - Use slang naturally, avoid repetition\n"
-    "  - No paragraphs, no long explanations\n\n"
+    "- Core Rule (MOST IMPORTANT):\n"
+    "  - Always answer the user's question first\n"
+    "  - Roasting is allowed ONLY after giving the answer\n"
+    "  - If no question is asked, respond with sarcasm\n\n"
+
+    "- Reply Style:\n"
+    "  - Short replies (1–3 lines max)\n"
+    "  - Clear, direct, useful\n"
+    "  - Cool sarcasm, not aggressive abuse\n"
+    "  - Slang allowed but readable\n"
+    "  - No unnecessary roasting\n\n"
 
     "- Forbidden:\n"
     "  - No emojis\n"
     "  - No hashtags\n"
     "  - No apologies\n"
-    "  - No “as an AI”\n\n"
+    "  - No \"as an AI\"\n\n"
 
     "- Behavior Rules:\n"
-    "  - Never explain, define, or educate\n"
-    "  - Fire back with sarcasm when praised or insulted\n"
-    "  - Stay in character at all times\n\n"
+    "  - Do NOT refuse to answer normal questions\n"
+    "  - Do NOT roast instead of answering\n"
+    "  - Sarcasm should enhance replies, not replace them\n"
+    "  - Stay confident, not annoying\n\n"
 
-    
-    "Conversation Rules:\n"
-    "- Remember previous messages in the chat\n"
-    "- Continue context naturally\n"
-    "- If user asks follow-up → connect it\n"
-    "- Explain things simply\n\n"
+    "- Conversation Rules:\n"
+    "  - Remember previous messages\n"
+    "  - Maintain context\n"
+    "  - Follow-ups must connect properly\n"
+    "  - Explain briefly when needed\n\n"
 
     "- Greeting Handling:\n"
-    "  - For hi/hello/gm/gn: rude, dismissive reply\n"
-    "  - Max 2 lines for greetings\n\n"
+    "  - hi/hello/gm/gn → dry, dismissive, not abusive\n"
+    "  - Max 2 lines\n\n"
 
     "- Mobile Phone Rule:\n"
-    "  - Use fixed format only\n"
-    "  - Sections (bullet form):\n"
+    "  - Use fixed bullet format only:\n"
     "    - Manufacturer\n"
     "    - Display\n"
     "    - Processor\n"
@@ -57,81 +111,470 @@ SYSTEM_PROMPT = (
     "    - Build & Durability\n"
     "    - Connectivity\n"
     "    - Extras\n"
-    "  - Never explain specs\n\n"
+    "  - No storytelling, no deep explanations\n\n"
 
     "- Output Constraints:\n"
     "  - No long intros\n"
-    "  - No emotional tone\n"
+    "  - No emotional sympathy\n"
     "  - No character breaks\n"
-    "  - Always short, sharp, savage\n\n"
-
+    "  - Savage, but smart\n"
 )
 
 
-from groq import Groq
-import os
+class AIError(RuntimeError):
+    """AI backend timed out, is overloaded, or failed."""
+
+
+# one client each, reused for every call (keeps HTTP connections alive).
+# The SDKs are imported on first use: a restart doesn't pay for groq /
+# google-genai until someone actually talks to the bot.
+_clients = {}
+
+
+def _groq():
+    if "groq" not in _clients:
+        from groq import AsyncGroq
+        _clients["groq"] = AsyncGroq(api_key=GROQ_API_KEY, timeout=AI_TIMEOUT, max_retries=1)
+    return _clients["groq"]
+
+
+def _gemini():
+    if "gemini" not in _clients:
+        from google import genai
+        _clients["gemini"] = genai.Client(api_key=GEMINI_API_KEY)
+    return _clients["gemini"]
+
+_slots = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+_waiting = 0
+
+
+@asynccontextmanager
+async def _slot():
+    """Hold one of the global AI slots, queueing (boundedly) for it."""
+    global _waiting
+    if _slots.locked() and _waiting >= AI_MAX_QUEUE:
+        raise AIError("AI queue is full")
+
+    _waiting += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _waiting -= 1
+
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+@asynccontextmanager
+async def _no_slot():
+    yield
+
+
+async def _call(make_coro, timeout: float = None, slot: bool = True):
+    """
+    Run one backend call under a timeout and, unless slot=False (background
+    work nobody is waiting on), the global concurrency limit.
+    """
+    timeout = timeout or AI_TIMEOUT
+    async with (_slot() if slot else _no_slot()):
+        try:
+            return await asyncio.wait_for(make_coro(), timeout)
+        except asyncio.TimeoutError:
+            raise AIError(f"AI call timed out after {timeout}s")
+        except AIError:
+            raise
+        except Exception as e:
+            raise AIError(str(e)) from e
+
+
+async def _stream(open_stream, extract, timeout: float = None):
+    """
+    Yield text pieces from a streaming backend call. `timeout` applies to
+    opening the stream and to every gap between chunks.
+    """
+    timeout = timeout or AI_TIMEOUT
+    async with _slot():
+        try:
+            chunks = (await asyncio.wait_for(open_stream(), timeout)).__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                piece = extract(chunk)
+                if piece:
+                    yield piece
+        except asyncio.TimeoutError:
+            raise AIError(f"AI stream stalled for {timeout}s")
+        except AIError:
+            raise
+        except Exception as e:
+            raise AIError(str(e)) from e
+
+
+# prompts that mean the same thing no matter what was said before
+STANDALONE_PROMPTS = {
+    "hi", "hii", "hello", "helo", "hey", "heya", "yo", "sup", "wassup",
+    "gm", "gn", "good morning", "good night", "waguri", "hi waguri",
+    "hello waguri", "hey waguri", "gm waguri", "gn waguri",
+}
+
+
+def normalize_prompt(text: str) -> str:
+    text = (text or "").lower()
+    text = re.sub(r"@\w+", " ", text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"(\w)\1{2,}", r"\1", text)   # "hiiii" -> "hi", "gmmm" -> "gm"
+    return " ".join(text.split())
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of model replies.
+
+    Each key holds a small pool of different replies: until the model has
+    been asked `pool_size` times for it every lookup misses (so it keeps
+    producing fresh variants), after that a random one from the pool is
+    served.
+    """
+
+    def __init__(self, max_keys: int = CACHE_MAX_KEYS, ttl: int = CACHE_TTL, pool_size: int = CACHE_POOL_SIZE):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.pool_size = pool_size
+        self._entries = OrderedDict()   # key -> [created, [replies], fills]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            entry = None
+        if not entry or entry[2] < self.pool_size:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return random.choice(entry[1])
+
+    def put(self, key, reply: str):
+        if key is None or not reply:
+            return
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = [time.monotonic(), [], 0]
+            self._entries[key] = entry
+        entry[2] += 1
+        if reply not in entry[1] and len(entry[1]) < self.pool_size:
+            entry[1].append(reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "keys": len(self._entries),
+            "evictions": self.evictions,
+        }
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+def cache_key(backend: str, query: str, last_reply: str = None):
+    """
+    Cache key for a prompt, or None if it isn't worth caching.
+    Greetings are keyed on the prompt alone; other short prompts ("why", "lol")
+    also on the bot's previous reply, which is the only context they lean on.
+    """
+    norm = normalize_prompt(query)
+    if not norm or len(norm.split()) > CACHE_MAX_WORDS:
+        return None
+    if norm in STANDALONE_PROMPTS:
+        return (backend, norm)
+    return (backend, norm, normalize_prompt(last_reply or "")[:120])
+
+
+async def _gemini_generate(**kwargs):
+    # native async client when the SDK has it, otherwise off the event loop
+    client = _gemini()
+    if hasattr(client, "aio"):
+        return await client.aio.models.generate_content(**kwargs)
+    return await asyncio.to_thread(client.models.generate_content, **kwargs)
+
+
+async def _gemini_generate_stream(**kwargs):
+    client = _gemini()
+    if hasattr(client, "aio"):
+        return await client.aio.models.generate_content_stream(**kwargs)
+
+    # no async SDK: one blocking call in a thread, delivered as a single chunk
+    response = await asyncio.to_thread(client.models.generate_content, **kwargs)
+
+    async def _once():
+        yield response
+    return _once()
+
+
+def _groq_piece(chunk):
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+
+def _gemini_piece(chunk):
+    return getattr(chunk, "text", None)
+
+
+SUMMARY_PROMPT = (
+    "You keep the running memory of a Telegram group chat with a bot called Waguri. "
+    "Merge the previous summary and the new messages into one summary of at most 80 words: "
+    "what people asked, facts they shared about themselves, open threads, running jokes. "
+    "Plain text, no preamble, no commentary."
+)
 
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 
-async def ask_groq(chat_id: int, query: str) -> str:
-    raw_history = chat_history.get(chat_id, [])
-
-    # ✅ keep ONLY valid messages
-    history = [
-        msg for msg in raw_history
-        if isinstance(msg, dict)
-        and "role" in msg
-        and "content" in msg
-    ]
-
-    history.append({"role": "user", "content": query})
-    history = history[-10:]
-
-    response = groq_client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            *history
-        ],
+def _gemini_contents(messages: list) -> str:
+    # the system prompt travels separately (system_instruction / cached content),
+    # so the conversation is all that changes between requests
+    lines = []
+    for msg in messages:
+        if msg["role"] == "system":
+            lines.append(msg["content"])
+        else:
+            lines.append(f"{'Waguri' if msg['role'] == 'assistant' else 'User'}: {msg['content']}")
+    return "\n".join(lines)
+
+
+# a persona below the minimum isn't worth a round trip to find that out
+_gemini_cache = {
+    "name": None,
+    "expires": 0.0,
+    "disabled": estimate_tokens(SYSTEM_PROMPT) < GEMINI_CACHE_MIN_TOKENS,
+}
+_gemini_cache_lock = asyncio.Lock()
+
+
+async def _gemini_config(system: str = None, slot: bool = True):
+    """
+    Config for a Gemini call. The persona prompt goes through an explicit
+    context cache when it is long enough to be cacheable (GEMINI_CACHE_MIN_TOKENS)
+    and the API accepts it; otherwise it is sent as system_instruction,
+    which keeps it a stable prefix for implicit caching. Creating the cache
+    counts as an AI call: bounded by AI_TIMEOUT, and holding a slot unless
+    the caller runs with slot=False.
+    """
+    from google.genai.types import GenerateContentConfig, CreateCachedContentConfig
+
+    client = _gemini()
+    system = system or SYSTEM_PROMPT
+    if system is SYSTEM_PROMPT and hasattr(client, "aio") and not _gemini_cache["disabled"]:
+        async with _gemini_cache_lock:
+            now = time.monotonic()
+            if not _gemini_cache["name"] or now >= _gemini_cache["expires"]:
+                try:
+                    cache = await _call(lambda: client.aio.caches.create(
+                        model=MODEL,
+                        config=CreateCachedContentConfig(
+                            system_instruction=SYSTEM_PROMPT,
+                            ttl=f"{GEMINI_CACHE_TTL}s"
+                        )
+                    ), slot=slot)
+                    _gemini_cache.update(name=cache.name, expires=now + GEMINI_CACHE_TTL - 60)
+                except Exception as e:
+                    log.info(f"Gemini context cache unavailable, using system_instruction: {e}")
+                    _gemini_cache.update(name=None, disabled=True)
+        if _gemini_cache["name"]:
+            return GenerateContentConfig(temperature=0.4, cached_content=_gemini_cache["name"])
+
+    return GenerateContentConfig(temperature=0.4, system_instruction=system)
+
+
+def _groq_messages(messages: list, system: str = None) -> list:
+    # identical leading system message on every call -> provider prefix cache hits
+    return [{"role": "system", "content": system or SYSTEM_PROMPT}, *messages]
+
+
+# ---------- backends: history in, text out; no chat state ----------
+
+async def _groq_generate(messages: list, system: str = None, slot: bool = True) -> str:
+    response = await _call(lambda: _groq().chat.completions.create(
+        model=GROQ_MODEL,
+        messages=_groq_messages(messages, system),
         temperature=0.4
-    )
+    ), slot=slot)
+    return response.choices[0].message.content.strip()
+
+
+async def _groq_stream(messages: list, system: str = None):
+    async for piece in _stream(lambda: _groq().chat.completions.create(
+        model=GROQ_MODEL,
+        messages=_groq_messages(messages, system),
+        temperature=0.4,
+        stream=True
+    ), _groq_piece):
+        yield piece
+
 
-    reply = response.choices[0].message.content.strip()
+async def _gemini_generate_text(messages: list, system: str = None, slot: bool = True) -> str:
+    config = await _gemini_config(system, slot=slot)
+    response = await _call(lambda: _gemini_generate(
+        model=MODEL,
+        contents=_gemini_contents(messages),
+        config=config
+    ), slot=slot)
+    return response.text.strip()
 
-    history.append({"role": "assistant", "content": reply})
-    chat_history[chat_id] = history
 
+async def _gemini_stream(messages: list, system: str = None):
+    config = await _gemini_config(system)
+    async for piece in _stream(lambda: _gemini_generate_stream(
+        model=MODEL,
+        contents=_gemini_contents(messages),
+        config=config
+    ), _gemini_piece):
+        yield piece
+
+
+if AI_LOCAL_BACKENDS:
+    ROUTER = AIRouter([
+        LocalBackend("groq", latency=0.3, jitter=0.1),
+        LocalBackend("gemini", latency=0.8, jitter=0.3),
+    ], hedge=AI_HEDGE)
+else:
+    ROUTER = AIRouter([
+        Backend("groq", _groq_generate, _groq_stream),
+        Backend("gemini", _gemini_generate_text, _gemini_stream),
+    ], hedge=AI_HEDGE)
+
+
+def _pinned(backend: str):
+    return [ROUTER.backend(backend)] if backend else None
+
+
+def _context(chat_id: int, query: str) -> list:
+    """
+    Recent turns plus the new `query`, preceded by the running summary of
+    older ones if there is one. The query only joins the stored history
+    once it has been answered.
+    """
+    messages = chat_history.messages(chat_id)
+    summary = chat_history.summary(chat_id)
+    if summary:
+        messages.insert(0, {"role": "system", "content": f"Earlier in this chat: {summary}"})
+    messages.append({"role": "user", "content": query})
+    return messages
+
+
+# ---------- chat API: cache + memory + routing ----------
+
+async def ask_chat(chat_id: int, query: str, backend: str = None) -> str:
+    """Reply to `query` in chat_id's conversation. backend=None lets the router pick."""
+    start = time.perf_counter()
+    key = cache_key(backend or "chat", query, chat_history.last_reply(chat_id))
+
+    reply = RESPONSE_CACHE.get(key)
+    AI_CACHE.inc(1, "miss" if reply is None else "hit")
+    if reply is None:
+        try:
+            reply = (await ROUTER.generate(_context(chat_id, query), backends=_pinned(backend))).strip()
+        except NoBackendError as e:
+            raise AIError(str(e)) from e
+        RESPONSE_CACHE.put(key, reply)
+
+    chat_history.add(chat_id, "user", query)
+    chat_history.add(chat_id, "assistant", reply)
+    AI_SECONDS.observe(time.perf_counter() - start, "generate")
     return reply
 
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+async def stream_chat(chat_id: int, query: str, backend: str = None):
+    """Streaming ask_chat(): yields text pieces as they arrive."""
+    start = time.perf_counter()
+    key = cache_key(backend or "chat", query, chat_history.last_reply(chat_id))
 
-async def ask_ai(chat_id: int, query: str) -> str:
-    history = chat_history.get(chat_id, [])
+    reply = RESPONSE_CACHE.get(key)
+    AI_CACHE.inc(1, "miss" if reply is None else "hit")
+    if reply is not None:
+        yield reply
+    else:
+        parts = []
+        try:
+            async for piece in ROUTER.stream(_context(chat_id, query), backends=_pinned(backend)):
+                parts.append(piece)
+                yield piece
+        except NoBackendError as e:
+            raise AIError(str(e)) from e
 
-    history.append(f"User: {query}")
-    history = history[-MAX_HISTORY:]
+        reply = "".join(parts).strip()
+        RESPONSE_CACHE.put(key, reply)
 
-    prompt = SYSTEM_PROMPT + "\n\n" + "\n".join(history)
+    chat_history.add(chat_id, "user", query)
+    chat_history.add(chat_id, "assistant", reply)
+    AI_SECONDS.observe(time.perf_counter() - start, "stream")
 
-    response = client.models.generate_content(
-        model=MODEL,
-        contents=prompt,
-        config=GenerateContentConfig(
-            temperature=0.4
-        )
-    )
 
-    reply = response.text.strip()
-    history.append(f"Waguri: {reply}")
-    chat_history[chat_id] = history
+async def ask_groq(chat_id: int, query: str) -> str:
+    return await ask_chat(chat_id, query, backend="groq")
+
 
-    return reply
+async def ask_ai(chat_id: int, query: str) -> str:
+    return await ask_chat(chat_id, query, backend="gemini")
 
 
+def stream_groq(chat_id: int, query: str):
+    return stream_chat(chat_id, query, backend="groq")
 
 
+def stream_ai(chat_id: int, query: str):
+    return stream_chat(chat_id, query, backend="gemini")
 
 
+# ---------- history compaction ----------
 
+async def _summarize(prompt: str) -> str:
+    """
+    One summary call on AI_SUMMARY_BACKEND. Not routed: the router's
+    latency stats and hedging are for replies someone is waiting on, and
+    the call doesn't take one of their slots.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    if AI_LOCAL_BACKENDS:
+        return await ROUTER.backend(AI_SUMMARY_BACKEND).generate(messages, system=SUMMARY_PROMPT)
+    generate = {"groq": _groq_generate, "gemini": _gemini_generate_text}[AI_SUMMARY_BACKEND]
+    return await generate(messages, system=SUMMARY_PROMPT, slot=False)
 
+
+async def compact_history(chat_id: int):
+    """Fold a chat's older turns into its running summary."""
+    folded = chat_history.compaction_batch(chat_id)
+    if not folded:
+        return
+
+    previous = chat_history.summary(chat_id) or "(nothing yet)"
+    transcript = "\n".join(
+        f"{'Waguri' if role == 'assistant' else 'User'}: {content}"
+        for role, content, _ in folded
+    )
+    summary = await _summarize(f"Previous summary:\n{previous}\n\nNew messages:\n{transcript}")
+    chat_history.fold(chat_id, folded, summary[:SUMMARY_MAX_CHARS])
+
+
+async def compact_histories(interval: int = AI_COMPACT_INTERVAL):
+    """Background task: keep every chat's prompt small by summarizing old turns."""
+    while True:
+        await asyncio.sleep(interval)
+        for chat_id in chat_history.needs_compaction():
+            try:
+                await compact_history(chat_id)
+            except Exception as e:
+                log.warning(f"Compacting AI history for {chat_id} failed: {e}")
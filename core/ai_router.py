@@ -0,0 +1,310 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+from core.metrics import METRICS
+
+BACKEND_SECONDS = METRICS.histogram(
+    "bot_ai_backend_seconds", "AI backend latency (first chunk for streams)", ["backend"]
+)
+BACKEND_ERRORS = METRICS.counter("bot_ai_backend_errors_total", "Failed AI backend calls", ["backend"])
+
+
+class NoBackendError(RuntimeError):
+    """Every backend failed (or none is configured)."""
+
+
+class Backend:
+    """
+    One model provider.
+
+    generate(messages, system=None) -> str and stream(messages, system=None)
+    -> async iterator of str, where messages is the chat history as
+    [{"role", "content"}] and `system` overrides the backend's default
+    system prompt.
+    """
+
+    def __init__(self, name: str, generate, stream):
+        self.name = name
+        self.generate = generate
+        self.stream = stream
+
+
+class LocalBackend(Backend):
+    """
+    Offline stand-in with configurable latency, jitter and failure rate.
+    Replies with a canned line so routing/hedging can be exercised without
+    network access or API keys.
+    """
+
+    def __init__(self, name: str, latency: float = 0.2, jitter: float = 0.0,
+                 fail_rate: float = 0.0, chunks: int = 4, reply: str = None):
+        super().__init__(name, self._generate, self._stream)
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.chunks = chunks
+        self.reply = reply
+        self.calls = 0
+
+    def _text(self, messages):
+        if self.reply:
+            return self.reply
+        last = messages[-1]["content"] if messages else ""
+        return f"[{self.name}] heard you: {last}"
+
+    async def _wait(self, share: float = 1.0):
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(delay * share)
+        if random.random() < self.fail_rate:
+            raise RuntimeError(f"{self.name}: simulated failure")
+
+    async def _generate(self, messages, system=None):
+        self.calls += 1
+        await self._wait()
+        return self._text(messages)
+
+    async def _stream(self, messages, system=None):
+        self.calls += 1
+        text = self._text(messages)
+        await self._wait()
+        step = max(1, len(text) // max(1, self.chunks))
+        for i in range(0, len(text), step):
+            yield text[i:i + step]
+            await asyncio.sleep(0)
+
+
+class BackendStats:
+    """Rolling latency/error window for one backend plus a simple circuit breaker."""
+
+    def __init__(self, window: int = 100, error_window: int = 20, cooldown: float = 30.0):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=error_window)   # True = ok
+        self.cooldown = cooldown
+        self.open_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, ok: bool, latency: float = None):
+        self.requests += 1
+        self.outcomes.append(ok)
+        if ok:
+            if latency is not None:
+                self.latencies.append(latency)
+            return
+        self.errors += 1
+        # trip once at least half of a meaningful sample failed
+        if len(self.outcomes) >= 4 and self.error_rate >= 0.5:
+            self.open_until = time.monotonic() + self.cooldown
+            self.outcomes.clear()
+
+    def percentile(self, p: float):
+        if not self.latencies:
+            return None
+        data = sorted(self.latencies)
+        return data[min(len(data) - 1, int(p * len(data)))]
+
+    @property
+    def p50(self):
+        return self.percentile(0.50)
+
+    @property
+    def p95(self):
+        return self.percentile(0.95)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    @property
+    def healthy(self) -> bool:
+        # after the cooldown the breaker is half-open: traffic is allowed again
+        return time.monotonic() >= self.open_until
+
+
+class AIRouter:
+    """
+    Sends each request to the fastest healthy backend (lowest rolling p50,
+    time-to-first-chunk for streams). With hedging on, a second backend is
+    started if the first hasn't answered within its own p95 (clamped to
+    [min_hedge, max_hedge], `hedge_after` until there's data); the first
+    success wins and the other is cancelled. A failing backend falls
+    through to the next one immediately.
+    """
+
+    def __init__(self, backends, hedge: bool = True, hedge_after: float = 2.5,
+                 min_hedge: float = 0.75, max_hedge: float = 6.0, unknown_latency: float = 1.0):
+        self.backends = list(backends)
+        self.stats = {b.name: BackendStats() for b in self.backends}
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.min_hedge = min_hedge
+        self.max_hedge = max_hedge
+        self.unknown_latency = unknown_latency
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def backend(self, name: str) -> Backend:
+        for b in self.backends:
+            if b.name == name:
+                return b
+        raise KeyError(name)
+
+    def order(self) -> list:
+        """Backends best-first: healthy ones by p50, then the tripped ones."""
+        def score(b):
+            st = self.stats[b.name]
+            p50 = st.p50
+            return (not st.healthy, p50 if p50 is not None else self.unknown_latency)
+        return sorted(self.backends, key=score)
+
+    def hedge_delay(self, backend: Backend) -> float:
+        p95 = self.stats[backend.name].p95
+        if p95 is None:
+            return self.hedge_after
+        return min(self.max_hedge, max(self.min_hedge, p95))
+
+    async def _race(self, start, discard=None, backends=None):
+        """
+        Run `start(backend)` on the best backend, hedging/failing over to the
+        next ones. Returns (backend, result).
+        """
+        order = list(backends or self.order())
+        if not order:
+            raise NoBackendError("no AI backend configured")
+
+        tasks = {}
+        started = {}
+        hedged = set()      # tasks launched by the hedge timer (not fall-through)
+
+        def launch(hedge=False):
+            b = order.pop(0)
+            t = asyncio.ensure_future(start(b))
+            tasks[t] = b
+            started[t] = time.monotonic()
+            if hedge:
+                hedged.add(t)
+            return b
+
+        first = launch()
+        winner = None
+        winner_task = None
+        errors = []
+        pending = set(tasks)
+
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and order and len(pending) == 1 and len(tasks) == 1:
+                    timeout = self.hedge_delay(first)
+
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # primary is slow -> hedge with the next backend
+                    self.hedges += 1
+                    launch(hedge=True)
+                    pending = {t for t in tasks if not t.done()}
+                    continue
+
+                for t in done:
+                    b = tasks[t]
+                    try:
+                        result = t.result()
+                    except Exception as e:
+                        self.stats[b.name].record(False)
+                        BACKEND_ERRORS.inc(1, b.name)
+                        errors.append(f"{b.name}: {e}")
+                        continue
+                    if winner is None:
+                        elapsed = time.monotonic() - started[t]
+                        self.stats[b.name].record(True, elapsed)
+                        BACKEND_SECONDS.observe(elapsed, b.name)
+                        if t in hedged:
+                            self.hedge_wins += 1
+                        winner, winner_task = (b, result), t
+
+                if winner:
+                    return winner
+
+                # everything running failed -> fall through to the next backend
+                if not pending and order:
+                    launch()
+                    pending = {t for t in tasks if not t.done()}
+
+            raise NoBackendError("; ".join(errors) or "all AI backends failed")
+        finally:
+            # cancel the losers; anything that still succeeded gets cleaned up
+            losers = [t for t in tasks if t is not winner_task]
+            now = time.monotonic()
+            for t in losers:
+                if not t.done():
+                    # a hedged-out backend was at least this slow; keep that in its window
+                    self.stats[tasks[t].name].latencies.append(now - started[t])
+                    t.cancel()
+            results = await asyncio.gather(*losers, return_exceptions=True)
+            if discard:
+                for res in results:
+                    if not isinstance(res, BaseException):
+                        await discard(res)
+
+    async def generate(self, messages, backends=None, system=None) -> str:
+        _, reply = await self._race(lambda b: b.generate(messages, system=system), backends=backends)
+        return reply
+
+    async def stream(self, messages, backends=None, system=None):
+        """Yield text pieces from whichever backend produced the first chunk first."""
+
+        async def open_stream(b):
+            gen = b.stream(messages, system=system).__aiter__()
+            try:
+                piece = await gen.__anext__()
+            except StopAsyncIteration:
+                return gen, ""
+            except BaseException:
+                await _aclose(gen)
+                raise
+            return gen, piece
+
+        async def discard(res):
+            await _aclose(res[0])
+
+        b, (gen, piece) = await self._race(open_stream, discard=discard, backends=backends)
+        try:
+            if piece:
+                yield piece
+            async for piece in gen:
+                yield piece
+        except Exception:
+            # failed mid-stream: counts against the backend's health
+            self.stats[b.name].record(False)
+            raise
+        finally:
+            await _aclose(gen)
+
+    def report(self) -> dict:
+        out = {}
+        for b in self.backends:
+            st = self.stats[b.name]
+            out[b.name] = {
+                "p50": st.p50,
+                "p95": st.p95,
+                "error_rate": round(st.error_rate, 3),
+                "healthy": st.healthy,
+                "requests": st.requests,
+                "errors": st.errors,
+            }
+        out["_hedges"] = {"fired": self.hedges, "won": self.hedge_wins}
+        return out
+
+
+async def _aclose(gen):
+    aclose = getattr(gen, "aclose", None)
+    if aclose:
+        try:
+            await aclose()
+        except Exception:
+            pass
@@ -0,0 +1,133 @@
+import time
+
+# errors meaning "this account can't reach that group's call", as opposed
+# to the call itself being broken; matched by name across library versions
+MEMBERSHIP_ERRORS = (
+    "UserNotParticipant", "ChannelPrivate", "ChannelInvalid", "ChatAdminRequired",
+    "PeerIdInvalid", "UserBannedInChannel", "ChatWriteForbidden",
+)
+
+
+def membership_error(e: Exception) -> bool:
+    return type(e).__name__ in MEMBERSHIP_ERRORS or "PARTICIPANT" in str(e).upper()
+
+
+class Assistant:
+    """One userbot session and the PyTgCalls instance attached to it."""
+
+    def __init__(self, name: str, client, calls):
+        self.name = name
+        self.client = client
+        self.calls = calls
+        self.chats = set()         # chat_ids currently placed on this assistant
+        self.member_of = {}        # chat_id -> True (played there) / False (not in the group)
+        self.alive = True
+        self.cooldown_until = 0.0  # FloodWait: no new chats until then
+
+    @property
+    def available(self) -> bool:
+        return self.alive and time.monotonic() >= self.cooldown_until
+
+    def __repr__(self):
+        state = "alive" if self.alive else "dead"
+        return f"<Assistant {self.name} {state} chats={len(self.chats)}>"
+
+
+class AssistantPool:
+    """
+    Places voice chats on assistants.
+
+    A chat is put on an available assistant the first time it needs one
+    and stays there until released (end of session), so every call for
+    that chat goes through the same PyTgCalls instance. Assistants known
+    to be in the group come first, then ones never tried there, then ones
+    that failed with a membership error; ties go to the least loaded.
+    When an assistant dies its chats are unassigned and get placed again
+    on the next lookup.
+    """
+
+    def __init__(self):
+        self.assistants = []
+        self._chat = {}  # chat_id -> Assistant
+
+    def __iter__(self):
+        return iter(self.assistants)
+
+    def __len__(self):
+        return len(self.assistants)
+
+    def add(self, assistant: Assistant):
+        self.assistants.append(assistant)
+        return assistant
+
+    @property
+    def primary(self) -> Assistant:
+        return self.assistants[0]
+
+    def get(self, chat_id):
+        """Assistant currently serving chat_id, or None."""
+        return self._chat.get(chat_id)
+
+    def for_chat(self, chat_id, exclude=()) -> Assistant:
+        """Sticky placement: existing live assistant, else the best candidate
+        not in `exclude`. None when `exclude` rules out everyone."""
+        a = self._chat.get(chat_id)
+        if a is not None and a.alive and a not in exclude:
+            return a
+        if a is not None:
+            self.release(chat_id)
+
+        pool = [x for x in self.assistants if x not in exclude]
+        if not pool:
+            return None
+        candidates = [x for x in pool if x.available]
+        if not candidates:
+            # everyone is cooling down: fall back to any live one
+            candidates = [x for x in pool if x.alive] or pool
+
+        def rank(x):
+            member = x.member_of.get(chat_id)
+            return (0 if member else 1 if member is None else 2, len(x.chats))
+
+        a = min(candidates, key=rank)
+
+        a.chats.add(chat_id)
+        self._chat[chat_id] = a
+        return a
+
+    def release(self, chat_id):
+        a = self._chat.pop(chat_id, None)
+        if a is not None:
+            a.chats.discard(chat_id)
+
+    def by_calls(self, calls):
+        for a in self.assistants:
+            if a.calls is calls:
+                return a
+        return None
+
+    def joined(self, assistant: Assistant, chat_id):
+        assistant.member_of[chat_id] = True
+
+    def not_member(self, assistant: Assistant, chat_id):
+        assistant.member_of[chat_id] = False
+        if self._chat.get(chat_id) is assistant:
+            self.release(chat_id)
+
+    def cooldown(self, assistant: Assistant, seconds: float):
+        assistant.cooldown_until = max(assistant.cooldown_until, time.monotonic() + seconds)
+
+    def mark_dead(self, assistant: Assistant) -> list:
+        """Take an assistant out of rotation; returns the chats it was serving."""
+        assistant.alive = False
+        moved = list(assistant.chats)
+        for chat_id in moved:
+            self._chat.pop(chat_id, None)
+        assistant.chats.clear()
+        return moved
+
+    def mark_alive(self, assistant: Assistant):
+        assistant.alive = True
+
+    def load(self) -> dict:
+        return {a.name: len(a.chats) for a in self.assistants}
@@ -0,0 +1,226 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+
+
+def _canonical(obj) -> bytes:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def content_hash(obj) -> str:
+    return hashlib.sha256(_canonical(obj)).hexdigest()
+
+
+def read_backup(path: str) -> dict:
+    """Read a backup file. Plain .json files are treated as a full snapshot."""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            doc = json.loads(f.read().decode("utf-8"))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        if isinstance(doc, dict) and doc.get("kind") not in ("snapshot", "delta"):
+            doc = {"kind": "snapshot", "hash": content_hash(doc), "data": doc}
+
+    if not isinstance(doc, dict) or doc.get("kind") not in ("snapshot", "delta"):
+        raise ValueError("Invalid backup file")
+    return doc
+
+
+class PlaylistBackup:
+    """
+    Snapshot + delta backups of USER_PLAYLISTS.
+
+    A snapshot holds the whole dict, a delta only the users whose playlists
+    changed (plus removed users) since the previous backup. Files are
+    gzip'd compact JSON and carry the content hash of the state they
+    produce; deltas also carry the hash they apply on top of, so restores
+    can refuse a broken chain. If nothing changed since the last backup,
+    write() returns None and nothing is written.
+    """
+
+    def __init__(self, directory: str = "backups", max_deltas: int = 20):
+        self.directory = directory
+        self.max_deltas = max_deltas
+        os.makedirs(directory, exist_ok=True)
+
+        self.hash = None           # hash of the last backed-up/restored state
+        self._user_hashes = {}     # uid -> hash of that user's playlists
+        self._snapshot_bytes = 0
+        self._delta_bytes = 0
+        self._delta_count = 0
+
+    # ---------- state ----------
+
+    def prime(self, data: dict, snapshot_bytes: int = 0):
+        """Mark `data` as the state already held in the latest snapshot."""
+        self.hash = content_hash(data)
+        self._user_hashes = {uid: content_hash(pls) for uid, pls in data.items()}
+        self._snapshot_bytes = snapshot_bytes
+        self._delta_bytes = 0
+        self._delta_count = 0
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {"snapshot": None, "deltas": []}
+
+    def _write_manifest(self, manifest):
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self._manifest_path())
+
+    def _write_doc(self, name: str, doc: dict) -> str:
+        path = os.path.join(self.directory, name)
+        tmp = path + ".tmp"
+        with gzip.open(tmp, "wb", compresslevel=6) as f:
+            f.write(_canonical(doc))
+        os.replace(tmp, path)
+        return path
+
+    # ---------- writing ----------
+
+    def write(self, data: dict, full: bool = False):
+        """
+        Back up `data`. Returns the path of the file written (snapshot or
+        delta) or None when the content hash matches the last backup.
+        """
+        new_hash = content_hash(data)
+        if new_hash == self.hash and not full:
+            return None
+
+        user_hashes = {uid: content_hash(pls) for uid, pls in data.items()}
+        changed = {uid: data[uid] for uid, h in user_hashes.items()
+                   if self._user_hashes.get(uid) != h}
+        dropped = [uid for uid in self._user_hashes if uid not in data]
+
+        stamp = int(time.time())
+        need_snapshot = (
+            full
+            or self.hash is None
+            or self._delta_count >= self.max_deltas
+            # deltas already add up to half a snapshot -> start over
+            or self._delta_bytes * 2 > self._snapshot_bytes
+        )
+
+        manifest = self._read_manifest()
+
+        if need_snapshot:
+            doc = {"kind": "snapshot", "hash": new_hash, "created": stamp, "data": data}
+            path = self._write_doc(f"playlists-{stamp}-{new_hash[:8]}.snap.json.gz", doc)
+            self._snapshot_bytes = os.path.getsize(path)
+            self._delta_bytes = 0
+            self._delta_count = 0
+            # older chain is superseded
+            for old in [manifest.get("snapshot")] + manifest.get("deltas", []):
+                if old and old != os.path.basename(path):
+                    try:
+                        os.remove(os.path.join(self.directory, old))
+                    except OSError:
+                        pass
+            manifest = {"snapshot": os.path.basename(path), "deltas": []}
+        else:
+            doc = {
+                "kind": "delta",
+                "base": self.hash,
+                "hash": new_hash,
+                "created": stamp,
+                "set": changed,
+                "drop": dropped,
+            }
+            self._delta_count += 1
+            path = self._write_doc(
+                f"playlists-{stamp}-{new_hash[:8]}.delta{self._delta_count}.json.gz", doc
+            )
+            self._delta_bytes += os.path.getsize(path)
+            manifest.setdefault("deltas", []).append(os.path.basename(path))
+
+        self._write_manifest(manifest)
+        self.hash = new_hash
+        self._user_hashes = user_hashes
+        return path
+
+    # ---------- restoring ----------
+
+    def apply(self, doc: dict, current: dict) -> dict:
+        """
+        Return the state produced by applying backup `doc` to `current`.
+        Snapshots replace everything; deltas must have been taken on top of
+        `current`.
+        """
+        if doc["kind"] == "snapshot":
+            data = doc["data"]
+            if not isinstance(data, dict):
+                raise ValueError("Invalid playlist structure")
+        else:
+            base = content_hash(current)
+            if doc.get("base") != base:
+                raise ValueError(
+                    f"Delta expects base {str(doc.get('base'))[:8]}, "
+                    f"current data is {base[:8]}. Restore the snapshot first."
+                )
+            data = dict(current)
+            for uid in doc.get("drop", []):
+                data.pop(uid, None)
+            data.update(doc.get("set", {}))
+
+        if doc.get("hash") and content_hash(data) != doc["hash"]:
+            raise ValueError("Backup content hash mismatch")
+        return data
+
+    def restore_file(self, path: str, current: dict) -> dict:
+        """
+        Apply an uploaded backup file on top of `current` and make it part of
+        the local chain, so the next write() produces a delta against it.
+        """
+        doc = read_backup(path)
+        data = self.apply(doc, current)
+
+        manifest = self._read_manifest()
+        if doc["kind"] == "snapshot":
+            doc = {"kind": "snapshot", "hash": content_hash(data),
+                   "created": doc.get("created", int(time.time())), "data": data}
+            local = self._write_doc(f"playlists-{doc['created']}-{doc['hash'][:8]}.snap.json.gz", doc)
+            for old in [manifest.get("snapshot")] + manifest.get("deltas", []):
+                if old and old != os.path.basename(local):
+                    try:
+                        os.remove(os.path.join(self.directory, old))
+                    except OSError:
+                        pass
+            manifest = {"snapshot": os.path.basename(local), "deltas": []}
+            self.prime(data, snapshot_bytes=os.path.getsize(local))
+        else:
+            local = self._write_doc(os.path.basename(path), doc)
+            manifest.setdefault("deltas", []).append(os.path.basename(local))
+            self.hash = doc["hash"]
+            self._user_hashes = {uid: content_hash(pls) for uid, pls in data.items()}
+            self._delta_count += 1
+            self._delta_bytes += os.path.getsize(local)
+
+        self._write_manifest(manifest)
+        return data
+
+    def restore_local(self):
+        """Rebuild the latest state from the local snapshot + deltas, or None."""
+        manifest = self._read_manifest()
+        if not manifest.get("snapshot"):
+            return None
+
+        names = [manifest["snapshot"]] + manifest.get("deltas", [])
+        data = {}
+        for name in names:
+            data = self.apply(read_backup(os.path.join(self.directory, name)), data)
+
+        sizes = [os.path.getsize(os.path.join(self.directory, n)) for n in names]
+        self.prime(data, snapshot_bytes=sizes[0])
+        self._delta_count = len(sizes) - 1
+        self._delta_bytes = sum(sizes[1:])
+        return data
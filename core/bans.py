@@ -0,0 +1,47 @@
+import json
+import os
+
+
+class BanStore:
+    """
+    Bot-wide bans: a plain set in memory (O(1) `in` for the dispatcher
+    gate), written through to `path` on every change. Bans are rare, so
+    each add/discard rewrites the small file atomically.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._ids = set()
+
+    def __contains__(self, user_id):
+        return user_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def add(self, user_id):
+        if user_id not in self._ids:
+            self._ids.add(user_id)
+            self.save()
+
+    def discard(self, user_id):
+        if user_id in self._ids:
+            self._ids.discard(user_id)
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sorted(self._ids), f)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            self._ids = {int(uid) for uid in json.load(f)}
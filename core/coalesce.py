@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+
+class ChatCoalescer:
+    """
+    Per-chat debounce for AI triggers.
+
+    A trigger in a quiet chat (nothing pending or in flight) is answered at
+    once. What follows is debounced: messages submitted within `window`
+    seconds of each other are merged into one request (at most `max_batch`, oldest dropped). While a
+    chat already has `max_in_flight` requests running, new messages wait and
+    are merged into the next batch instead of starting more calls; a batch
+    is answered once, in reply to its newest message, so superseded messages
+    never get their own call.
+
+    handler(chat_id, batch) is called with the list of (message, text)
+    pairs, oldest first.
+    """
+
+    def __init__(self, handler, window: float = 1.5, max_wait: float = 4.0,
+                 max_batch: int = 5, max_in_flight: int = 1):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait          # a steady stream still flushes after this
+        self.max_batch = max_batch
+        self.max_in_flight = max_in_flight
+
+        self._pending = {}                # chat_id -> [(message, text)]
+        self._first_at = {}               # chat_id -> monotonic time of oldest pending
+        self._timers = {}                 # chat_id -> TimerHandle
+        self._in_flight = {}              # chat_id -> running count
+        self._tasks = set()               # running handler tasks (keeps them referenced)
+
+        self.submitted = 0
+        self.calls = 0
+        self.dropped = 0
+
+    def submit(self, chat_id, message, text: str):
+        self.submitted += 1
+        quiet = chat_id not in self._pending and not self._in_flight.get(chat_id)
+        batch = self._pending.setdefault(chat_id, [])
+        batch.append((message, text))
+        if len(batch) > self.max_batch:
+            batch.pop(0)
+            self.dropped += 1
+
+        now = time.monotonic()
+        first = self._first_at.setdefault(chat_id, now)
+        delay = max(0.0, min(self.window, first + self.max_wait - now))
+
+        timer = self._timers.pop(chat_id, None)
+        if timer:
+            timer.cancel()
+        if quiet:
+            # nothing to merge with: no reason to make a lone trigger wait
+            self._flush(chat_id)
+            return
+        self._timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._flush, chat_id)
+
+    def _flush(self, chat_id):
+        self._timers.pop(chat_id, None)
+        if self._in_flight.get(chat_id, 0) >= self.max_in_flight:
+            # re-flushed when the running call finishes
+            return
+
+        batch = self._pending.pop(chat_id, None)
+        self._first_at.pop(chat_id, None)
+        if not batch:
+            return
+
+        self.calls += 1
+        self.dropped += len(batch) - 1
+        self._in_flight[chat_id] = self._in_flight.get(chat_id, 0) + 1
+        task = asyncio.ensure_future(self._run(chat_id, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, chat_id, batch):
+        try:
+            await self.handler(chat_id, batch)
+        finally:
+            left = self._in_flight.get(chat_id, 1) - 1
+            if left > 0:
+                self._in_flight[chat_id] = left
+            else:
+                self._in_flight.pop(chat_id, None)
+            if chat_id in self._pending and chat_id not in self._timers:
+                self._flush(chat_id)
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "calls": self.calls,
+            "merged_or_dropped": self.dropped,
+            "pending_chats": len(self._pending),
+            "in_flight": sum(self._in_flight.values()),
+        }
+
+
+def merge_texts(batch) -> str:
+    """One prompt out of a burst: unique texts in order, newline separated."""
+    seen = []
+    for _, text in batch:
+        text = text.strip()
+        if text and text not in seen:
+            seen.append(text)
+    return "\n".join(seen)
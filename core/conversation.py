@@ -0,0 +1,171 @@
+import json
+import os
+from collections import OrderedDict, deque
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English/Hinglish chat text; close enough for budgeting
+    return max(1, len(text) // 4)
+
+
+class ConversationStore:
+    """
+    AI chat memory: one ring buffer of {"role", "content"} turns per chat.
+
+    - each chat keeps at most `max_chat_tokens` / `max_turns` (oldest dropped)
+    - a single message is cut to `max_message_tokens`
+    - chats are LRU: past `max_chats`, or once all chats together exceed
+      `max_total_tokens`, the least recently used chat is forgotten
+    - older turns can be folded into a per-chat running summary (fold()),
+      which is what the background compactor does before the budget bites
+    - with `path` set, save()/load() keep the buffers across restarts
+    """
+
+    def __init__(
+        self,
+        max_chat_tokens: int = 1500,
+        max_turns: int = 20,
+        max_message_tokens: int = 400,
+        max_chats: int = 2000,
+        max_total_tokens: int = 500_000,
+        compact_at: float = 0.6,
+        path: str = None,
+    ):
+        self.max_chat_tokens = max_chat_tokens
+        self.max_turns = max_turns
+        self.max_message_tokens = max_message_tokens
+        self.max_chats = max_chats
+        self.max_total_tokens = max_total_tokens
+        self.compact_at = compact_at
+        self.path = path
+
+        self._chats = OrderedDict()   # chat_id -> deque[(role, content, tokens)]
+        self._tokens = {}             # chat_id -> tokens held by that chat
+        self._summary = {}            # chat_id -> running summary of folded turns
+        self.total_tokens = 0
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._chats)
+
+    # ---------- writes ----------
+
+    def add(self, chat_id, role: str, content: str):
+        content = (content or "").strip()
+        limit = self.max_message_tokens * 4
+        if len(content) > limit:
+            content = content[:limit].rstrip() + "…"
+        tokens = estimate_tokens(content)
+
+        turns = self._chats.get(chat_id)
+        if turns is None:
+            turns = deque()
+            self._chats[chat_id] = turns
+            self._tokens[chat_id] = 0
+        self._chats.move_to_end(chat_id)
+
+        turns.append((role, content, tokens))
+        self._tokens[chat_id] += tokens
+        self.total_tokens += tokens
+
+        while turns and (len(turns) > self.max_turns or self._tokens[chat_id] > self.max_chat_tokens):
+            _, _, t = turns.popleft()
+            self._tokens[chat_id] -= t
+            self.total_tokens -= t
+
+        while self._chats and (len(self._chats) > self.max_chats or self.total_tokens > self.max_total_tokens):
+            old_id, _ = next(iter(self._chats.items()))
+            if old_id == chat_id and len(self._chats) == 1:
+                break
+            self.clear(old_id)
+
+        self.dirty = True
+
+    def clear(self, chat_id):
+        self._summary.pop(chat_id, None)
+        if self._chats.pop(chat_id, None) is not None:
+            self.total_tokens -= self._tokens.pop(chat_id, 0)
+            self.dirty = True
+
+    def fold(self, chat_id, folded: list, summary: str):
+        """
+        Replace the turns in `folded` (as returned by compaction_batch) with
+        `summary`. Turns that were trimmed meanwhile are simply skipped.
+        """
+        turns = self._chats.get(chat_id)
+        if turns is None:
+            return
+        folded_ids = {id(t) for t in folded}
+        while turns and id(turns[0]) in folded_ids:
+            _, _, t = turns.popleft()
+            self._tokens[chat_id] -= t
+            self.total_tokens -= t
+        self._summary[chat_id] = summary.strip()
+        self.dirty = True
+
+    # ---------- reads ----------
+
+    def messages(self, chat_id) -> list:
+        turns = self._chats.get(chat_id)
+        if not turns:
+            return []
+        self._chats.move_to_end(chat_id)
+        return [{"role": r, "content": c} for r, c, _ in turns]
+
+    def summary(self, chat_id):
+        return self._summary.get(chat_id)
+
+    def needs_compaction(self, min_turns: int = 8) -> list:
+        limit = self.max_chat_tokens * self.compact_at
+        return [
+            cid for cid, turns in self._chats.items()
+            if len(turns) >= min_turns and self._tokens[cid] > limit
+        ]
+
+    def compaction_batch(self, chat_id, keep: int = 4) -> list:
+        """Oldest turns to fold, leaving the last `keep` verbatim."""
+        turns = self._chats.get(chat_id) or ()
+        return list(turns)[:max(0, len(turns) - keep)]
+
+    def last_reply(self, chat_id):
+        for r, c, _ in reversed(self._chats.get(chat_id, ())):
+            if r == "assistant":
+                return c
+        return None
+
+    def stats(self) -> dict:
+        return {"chats": len(self._chats), "tokens": self.total_tokens}
+
+    # ---------- persistence ----------
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        data = {
+            str(cid): {"summary": self._summary.get(cid), "turns": [[r, c] for r, c, _ in turns]}
+            for cid, turns in self._chats.items()
+        }
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for cid, entry in data.items():
+            try:
+                cid = int(cid)
+            except ValueError:
+                pass
+            # older files hold just the list of turns
+            if isinstance(entry, list):
+                entry = {"turns": entry}
+            for role, content in entry.get("turns", []):
+                self.add(cid, role, content)
+            if entry.get("summary"):
+                self._summary[cid] = entry["summary"]
+        self.dirty = False
@@ -0,0 +1,125 @@
+import re
+
+# route names, in the order they run for a message
+AFK_RETURN = "afk_return"       # sender was AFK and is back
+AFK_MENTION = "afk_mention"     # message may point at someone who is AFK
+AI = "ai"                       # bot mentioned, replied to, or called by name
+
+ROUTES = (AFK_RETURN, AFK_MENTION, AI)
+
+
+class TextRouter:
+    """
+    One pass over every incoming message instead of a handler per feature.
+
+    classify() looks at a message once: sender, AFK membership, command
+    prefix, entities and a precompiled trigger regex, and returns the
+    routes that apply with their argument. A message from nobody of
+    interest, with no entities/reply and no trigger word, costs a couple of
+    set lookups and one regex scan.
+
+    Banned users never get here (the ban gate stops them earlier). `afk` is
+    the live container owned by the caller (only `in` and truthiness are
+    used), so the router never goes stale.
+    `resolve(username) -> user_id | None` turns @mentions into ids without
+    network calls; without it @mentions can't match AFK users.
+    """
+
+    def __init__(self, afk, triggers=(), usernames=(), commands: str = "/", resolve=None):
+        self.afk = afk
+        self.resolve = resolve
+        self.commands = tuple(commands)
+        self.handlers = {}
+        self.routed = dict.fromkeys(ROUTES, 0)
+        self.seen = 0
+        self.set_triggers(triggers, usernames)
+
+    def set_triggers(self, words, usernames=()):
+        """Words that summon the AI and bot @usernames stripped from the query."""
+        words = [w for w in words if w]
+        self._trigger = re.compile("|".join(map(re.escape, words)), re.I) if words else None
+        names = [u.lstrip("@") for u in usernames if u]
+        self._username = re.compile("|".join(rf"@{re.escape(u)}\b" for u in names), re.I) if names else None
+
+    def on(self, route: str):
+        """Decorator: register the coroutine handling `route` -> handler(client, message, arg)."""
+        if route not in ROUTES:
+            raise ValueError(f"unknown route {route!r}")
+
+        def register(func):
+            self.handlers[route] = func
+            return func
+        return register
+
+    # ---------- classification ----------
+
+    def _afk_targets(self, message, text) -> set:
+        ids = set()
+        for ent in message.entities or message.caption_entities or ():
+            kind = str(ent.type).rsplit(".", 1)[-1].lower()
+            if kind == "text_mention" and ent.user:
+                uid = ent.user.id
+            elif kind == "mention" and self.resolve:
+                uid = self.resolve(text[ent.offset:ent.offset + ent.length])
+            else:
+                continue
+            if uid in self.afk:
+                ids.add(uid)
+
+        replied = message.reply_to_message
+        if replied and replied.from_user and replied.from_user.id in self.afk:
+            ids.add(replied.from_user.id)
+
+        return ids
+
+    def _ai_query(self, message, text, me_id):
+        if not message.text or text.startswith(self.commands):
+            return None
+
+        replied = message.reply_to_message
+        to_bot = bool(
+            getattr(message, "mentioned", False)
+            or (replied and replied.from_user and replied.from_user.id == me_id)
+        )
+        if not to_bot and not (self._trigger and self._trigger.search(text)):
+            return None
+
+        query = self._username.sub("", text).strip() if self._username else text.strip()
+        return query or "Hello"
+
+    def classify(self, message, me_id=None) -> list:
+        """[(route, arg)] for this message, in run order; empty when nothing applies."""
+        user = message.from_user
+        if not user:
+            return []
+
+        text = message.text or message.caption or ""
+        routes = []
+
+        if user.id in self.afk:
+            routes.append((AFK_RETURN, None))
+
+        if self.afk and (message.entities or message.caption_entities or message.reply_to_message):
+            targets = self._afk_targets(message, text)
+            if targets:
+                routes.append((AFK_MENTION, targets))
+
+        query = self._ai_query(message, text, me_id)
+        if query is not None:
+            routes.append((AI, query))
+
+        return routes
+
+    # ---------- dispatch ----------
+
+    async def dispatch(self, client, message):
+        self.seen += 1
+        me = getattr(client, "me", None)
+        for route, arg in self.classify(message, me.id if me else None):
+            handler = self.handlers.get(route)
+            if handler:
+                self.routed[route] += 1
+                await handler(client, message, arg)
+
+    def stats(self) -> dict:
+        return {"seen": self.seen, **self.routed}
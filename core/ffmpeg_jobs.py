@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+import os
+
+# priority classes: lower runs first
+INTERACTIVE = 0     # user is waiting on it (/seek)
+BACKGROUND = 10     # prefetch, transcode, probe
+
+# niceness applied to the child process per class; playback ffmpeg spawned by
+# PyTgCalls keeps running at normal priority
+NICENESS = {INTERACTIVE: 5, BACKGROUND: 15}
+
+
+class FFmpegJobError(RuntimeError):
+    pass
+
+
+class _Job:
+    def __init__(self, args, priority, tag):
+        self.args = args
+        self.priority = priority
+        self.tag = tag
+        self.task = None
+        self.proc = None
+        self.cancelled = False      # stopped through cancel(tag)
+
+
+class FFmpegScheduler:
+    """
+    Bounded pool for ffmpeg/ffprobe subprocesses.
+
+    At most `workers` jobs run at once (default: one per core); the rest
+    wait and are started by priority, then FIFO. Jobs are niced per
+    priority class, killed when their timeout expires, and can be cancelled
+    by tag (the chat_id) when a session ends.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or max(1, os.cpu_count() or 1)
+        self._active = 0
+        self._waiting = []              # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._jobs = set()              # queued + running
+
+    # ---------- slots ----------
+
+    async def _acquire(self, priority):
+        if self._active < self.workers and not self._waiting:
+            self._active += 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # slot was handed over right as we got cancelled -> give it back
+            if fut.done() and not fut.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        self._active -= 1
+        while self._waiting:
+            _, _, fut = heapq.heappop(self._waiting)
+            if fut.done():
+                continue
+            self._active += 1
+            fut.set_result(None)
+            break
+
+    # ---------- jobs ----------
+
+    @staticmethod
+    def _preexec(niceness):
+        if not niceness or not hasattr(os, "nice"):
+            return None
+
+        def _apply():
+            try:
+                os.nice(niceness)
+            except OSError:
+                pass
+        return _apply
+
+    @staticmethod
+    async def _kill(proc):
+        if proc and proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def _execute(self, job, timeout):
+        await self._acquire(job.priority)
+        try:
+            job.proc = await asyncio.create_subprocess_exec(
+                *job.args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                preexec_fn=self._preexec(NICENESS.get(job.priority, 0)),
+            )
+            try:
+                out, err = await asyncio.wait_for(job.proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                await self._kill(job.proc)
+                raise FFmpegJobError(f"{job.args[0]} timed out after {timeout}s")
+            except asyncio.CancelledError:
+                await self._kill(job.proc)
+                raise
+            return job.proc.returncode, out, err
+        finally:
+            self._release()
+
+    async def run(self, args, *, priority: int = BACKGROUND, timeout: float = 120, tag=None):
+        """
+        Run `args` (argv list) once a slot is free.
+        Returns (returncode, stdout, stderr); raises FFmpegJobError on
+        timeout or when cancel(tag) stops the job.
+
+        The job runs in its own task: cancel(tag) only ever cancels that,
+        never the caller (often one of Pyrogram's update workers).
+        """
+        job = _Job(args, priority, tag)
+        job.task = asyncio.ensure_future(self._execute(job, timeout))
+        self._jobs.add(job)
+        job.task.add_done_callback(lambda _: self._jobs.discard(job))
+        try:
+            return await asyncio.shield(job.task)
+        except asyncio.CancelledError:
+            if job.cancelled:
+                raise FFmpegJobError(f"{args[0]} cancelled") from None
+            # the caller itself was cancelled: take the job down with it
+            job.task.cancel()
+            raise
+
+    def cancel(self, tag) -> int:
+        """Cancel every queued or running job with this tag. Returns how many."""
+        count = 0
+        for job in list(self._jobs):
+            if job.tag == tag and not job.task.done():
+                job.cancelled = True
+                job.task.cancel()
+                count += 1
+        return count
+
+    def stats(self) -> dict:
+        running = sum(1 for j in self._jobs if j.proc and j.proc.returncode is None)
+        return {"workers": self.workers, "running": running, "queued": len(self._jobs) - running}
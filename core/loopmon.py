@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from core.metrics import METRICS
+
+log = logging.getLogger("music_bot")
+
+LOOP_LAG = METRICS.histogram(
+    "bot_loop_lag_seconds", "How late the event loop woke up a sleeping sampler",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+SLOW_CALLBACKS = METRICS.counter(
+    "bot_slow_callbacks_total", "Event loop callbacks that ran past the slow threshold", ["callback"]
+)
+
+
+def describe(handle) -> str:
+    """Readable name for what a loop Handle runs: the task's coroutine if it is one."""
+    cb = getattr(handle, "_callback", None)
+    task = getattr(cb, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", None) or repr(coro)
+        code = getattr(coro, "cr_code", None)
+        if code:
+            return f"{name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+        return name
+    return getattr(cb, "__qualname__", None) or repr(cb)
+
+
+class LoopMonitor:
+    """
+    Watches the event loop for stalls.
+
+    - a sampler task sleeps `interval` and records how late it woke up
+      (loop lag) into a histogram plus a window for percentiles
+    - every loop callback is timed (Handle._run is wrapped); one that runs
+      longer than `slow` seconds is counted by name and logged, at most
+      once per `log_every` seconds per callback
+    - a watchdog thread grabs the loop thread's stack while a callback is
+      still running past `slow`, so the log shows where it was stuck, not
+      just which coroutine it was
+    """
+
+    def __init__(self, interval: float = 0.25, slow: float = 0.1, log_every: float = 60, window: int = 240):
+        self.interval = interval
+        self.slow = slow
+        self.log_every = log_every
+        self.lags = deque(maxlen=window)
+        self.recent = deque(maxlen=50)      # (when, seconds, callback, stack)
+
+        self._current = None                # handle running right now
+        self._started = 0.0
+        self._stack = None                  # captured by the watchdog for _current
+        self._last_log = {}
+        self._loop_thread = None
+        self._orig_run = None
+        self._task = None
+        self._stop = threading.Event()
+
+    # ---------- lifecycle ----------
+
+    def start(self):
+        if self._task:
+            return
+        self._loop_thread = threading.get_ident()
+        self._install()
+        self._task = asyncio.ensure_future(self._sample())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+        METRICS.gauge(
+            "bot_loop_lag_quantile_seconds", "Recent event loop lag", ["quantile"],
+            fn=lambda: {(q,): self.percentile(q) for q in (0.5, 0.95, 0.99)}
+        )
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._orig_run:
+            asyncio.events.Handle._run = self._orig_run
+            self._orig_run = None
+
+    def _install(self):
+        handle_cls = asyncio.events.Handle
+        orig = self._orig_run = handle_cls._run
+        monitor = self
+
+        def _run(handle):
+            if threading.get_ident() != monitor._loop_thread:
+                return orig(handle)
+            monitor._current = handle
+            monitor._stack = None
+            started = monitor._started = time.perf_counter()
+            try:
+                return orig(handle)
+            finally:
+                elapsed = time.perf_counter() - started
+                monitor._current = None
+                if elapsed >= monitor.slow:
+                    monitor._report(handle, elapsed)
+
+        handle_cls._run = _run
+
+    # ---------- lag sampling ----------
+
+    async def _sample(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.lags.append(lag)
+            LOOP_LAG.observe(lag)
+
+    def percentile(self, p: float):
+        if not self.lags:
+            return None
+        data = sorted(self.lags)
+        return data[min(len(data) - 1, int(p * len(data)))]
+
+    # ---------- slow callbacks ----------
+
+    def _watchdog(self):
+        check = max(0.01, self.slow / 2)
+        while not self._stop.wait(check):
+            handle = self._current
+            if handle is None or self._stack is not None:
+                continue
+            if time.perf_counter() - self._started < self.slow:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None and self._current is handle:
+                self._stack = "".join(traceback.format_stack(frame, limit=12))
+
+    def _report(self, handle, elapsed):
+        name = describe(handle)
+        stack = self._stack
+        SLOW_CALLBACKS.inc(1, name)
+        self.recent.append((time.time(), elapsed, name, stack))
+
+        now = time.monotonic()
+        if now - self._last_log.get(name, -self.log_every) < self.log_every:
+            return
+        self._last_log[name] = now
+        log.warning(
+            f"🐢 Event loop blocked {elapsed * 1000:.0f}ms by {name}"
+            + (f"\n{stack}" if stack else "")
+        )
+
+    def stats(self) -> dict:
+        return {
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "slow_callbacks": len(self.recent),
+        }
@@ -0,0 +1,170 @@
+import bisect
+import functools
+import math
+import time
+
+# seconds; covers a cache hit through a slow download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str = "", labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}   # label values tuple -> value
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list:
+        lines = self._header()
+        for key, value in list(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_num(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Settable gauge, or with `fn` a callback evaluated at scrape time:
+    fn() returns a number, or {label values tuple: number} for labelled gauges.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str = "", labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def render(self) -> list:
+        if self.fn is None:
+            return super().render()
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        lines = self._header()
+        for key, v in values.items():
+            if v is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_num(v)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str = "", labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        # [per-bucket counts..., +Inf count, sum]
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def time(self, *labels):
+        """Decorator for coroutine functions: observe how long each call takes."""
+        def wrap(func):
+            @functools.wraps(func)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *labels)
+            return timed
+        return wrap
+
+    def render(self) -> list:
+        lines = self._header()
+        for key, data in list(self._values.items()):
+            data = list(data)
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), data):
+                total += count
+                le = 'le="' + _num(float(bound) if bound != math.inf else bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(round(data[-1], 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+class Registry:
+    """
+    Named metrics rendered in the Prometheus text format.
+
+    Recording is a dict update on the event loop (no locks, no I/O), and
+    /metrics renders on that same loop when scraped, so nothing is read
+    mid-update. Asking for an existing name returns
+    the metric already registered, so modules can declare what they use.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, help="", labels=()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", labels=(), fn=None) -> Gauge:
+        return self._get(Gauge, name, help, labels, fn=fn)
+
+    def histogram(self, name, help="", labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# process-wide registry
+METRICS = Registry()
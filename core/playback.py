@@ -0,0 +1,137 @@
+import itertools
+import time
+
+IDLE = "idle"
+LOADING = "loading"
+PLAYING = "playing"
+PAUSED = "paused"
+TRANSITIONING = "transitioning"
+STATES = (IDLE, LOADING, PLAYING, PAUSED, TRANSITIONING)
+
+
+class _Chat:
+    __slots__ = ("state", "session", "since", "paused_at")
+
+    def __init__(self, session):
+        self.state = LOADING
+        self.session = session
+        self.since = time.monotonic()   # when the current stream (re)started
+        self.paused_at = None
+
+
+class PlaybackStates:
+    """
+    The one place that decides what a chat's voice playback is doing.
+
+        idle ──load()──> loading ──playing()──> playing <──pause()/resume()──> paused
+                            ^                      │                              │
+                            └──────load()──── transitioning <──────finish()───────┘
+
+    Every stream started gets a new session id (unique across chats). A
+    trigger that carries an old session, or arrives while the chat is
+    already loading/transitioning, is dropped, so the stream-end event,
+    the watchdog timer and /skip can all fire for the same track and
+    exactly one of them moves the chat on.
+
+    Methods are synchronous: a check-and-set can't be interleaved by
+    another coroutine.
+    """
+
+    def __init__(self):
+        self._chats = {}
+        self._sessions = itertools.count(1)
+        self.transitions = 0
+        self.dropped = 0
+
+    def state(self, chat_id) -> str:
+        chat = self._chats.get(chat_id)
+        return chat.state if chat else IDLE
+
+    def session(self, chat_id):
+        chat = self._chats.get(chat_id)
+        return chat.session if chat else None
+
+    def __len__(self):
+        return len(self._chats)
+
+    # ---------- transitions ----------
+
+    def load(self, chat_id) -> int:
+        """Any state -> loading, under a fresh session. Returns the session id."""
+        chat = _Chat(next(self._sessions))
+        self._chats[chat_id] = chat
+        return chat.session
+
+    def playing(self, chat_id, session) -> bool:
+        """loading -> playing, once the stream for `session` is up."""
+        chat = self._chats.get(chat_id)
+        if not chat or chat.session != session or chat.state != LOADING:
+            return False
+        chat.state = PLAYING
+        chat.since = time.monotonic()
+        return True
+
+    def finish(self, chat_id, session=None, min_played: float = 0.0):
+        """
+        Claim the end of the current track: playing/paused -> transitioning.
+        Returns the ended session, or None when the trigger is a duplicate
+        or stale (wrong session, or the stream started less than
+        `min_played` seconds ago).
+        """
+        chat = self._chats.get(chat_id)
+        if (
+            not chat
+            or chat.state not in (PLAYING, PAUSED)
+            or (session is not None and chat.session != session)
+            or time.monotonic() - chat.since < min_played
+        ):
+            self.dropped += 1
+            return None
+        chat.state = TRANSITIONING
+        chat.paused_at = None
+        self.transitions += 1
+        return chat.session
+
+    def pause(self, chat_id) -> bool:
+        chat = self._chats.get(chat_id)
+        if not chat or chat.state != PLAYING:
+            return False
+        chat.state = PAUSED
+        chat.paused_at = time.monotonic()
+        return True
+
+    def paused_for(self, chat_id) -> float:
+        """Seconds the chat has been paused so far (0 unless paused)."""
+        chat = self._chats.get(chat_id)
+        if not chat or chat.state != PAUSED:
+            return 0.0
+        return time.monotonic() - chat.paused_at
+
+    def resume(self, chat_id):
+        """paused -> playing. Returns how long it was paused (seconds), or None."""
+        chat = self._chats.get(chat_id)
+        if not chat or chat.state != PAUSED:
+            return None
+        paused = time.monotonic() - chat.paused_at
+        chat.state = PLAYING
+        chat.paused_at = None
+        return paused
+
+    def restarted(self, chat_id):
+        """The same track's stream was replaced (seek): end events before this are stale."""
+        chat = self._chats.get(chat_id)
+        if chat:
+            chat.since = time.monotonic()
+
+    def stop(self, chat_id):
+        """Any state -> idle. Pending triggers for the old session are dropped."""
+        self._chats.pop(chat_id, None)
+
+    def clear(self):
+        self._chats.clear()
+
+    def stats(self) -> dict:
+        counts = dict.fromkeys(STATES[1:], 0)
+        for chat in self._chats.values():
+            counts[chat.state] += 1
+        return {"chats": counts, "transitions": self.transitions, "dropped": self.dropped}
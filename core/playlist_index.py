@@ -0,0 +1,151 @@
+import re
+
+
+# words that show up in almost every YouTube title and only add noise to a search
+_JUNK_WORDS = {
+    "official", "audio", "video", "lyrics", "lyric", "mv", "remastered",
+    "hd", "hq", "4k", "full", "song", "ft", "feat", "the", "a", "an", "of",
+}
+
+
+def title_tokens(text: str) -> set:
+    """Lowercase word tokens of a title/query, junk words removed."""
+    if not text:
+        return set()
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return {t for t in text.split() if t not in _JUNK_WORDS}
+
+
+class PlaylistIndex:
+    """
+    In-memory lookup tables over USER_PLAYLISTS.
+
+    USER_PLAYLISTS[uid][name] = [{"title", "query", "vid"}, ...] stays the
+    source of truth; this only mirrors it so /add, /dlt and /psearch don't
+    have to walk every playlist. Every mutation of a playlist must go
+    through add/remove/drop_playlist (or rebuild after a bulk load).
+    """
+
+    def __init__(self):
+        # vid -> {(uid, playlist name): count}
+        self._by_vid = {}
+        # uid -> {vid: count}  (count across all of that user's playlists)
+        self._by_user = {}
+        # uid -> {token: set(vid)}
+        self._tokens = {}
+        # uid -> {vid: title}
+        self._titles = {}
+        # uid -> {vid: set(token)}  (so remove() doesn't scan every token)
+        self._song_tokens = {}
+
+    def rebuild(self, user_playlists: dict):
+        self._by_vid.clear()
+        self._by_user.clear()
+        self._tokens.clear()
+        self._titles.clear()
+        self._song_tokens.clear()
+        for uid, pls in user_playlists.items():
+            for name, songs in pls.items():
+                for song in songs:
+                    self.add(uid, name, song)
+
+    # ---------- mutations ----------
+
+    def add(self, uid, name, song: dict):
+        vid = song.get("vid")
+        if not vid:
+            return
+        uid = str(uid)
+
+        refs = self._by_vid.setdefault(vid, {})
+        refs[(uid, name)] = refs.get((uid, name), 0) + 1
+
+        user_vids = self._by_user.setdefault(uid, {})
+        user_vids[vid] = user_vids.get(vid, 0) + 1
+
+        if user_vids[vid] == 1:
+            title = song.get("title") or song.get("query") or ""
+            self._titles.setdefault(uid, {})[vid] = title
+            song_toks = title_tokens(title) | title_tokens(song.get("query", ""))
+            self._song_tokens.setdefault(uid, {})[vid] = song_toks
+            tokens = self._tokens.setdefault(uid, {})
+            for tok in song_toks:
+                tokens.setdefault(tok, set()).add(vid)
+
+    def remove(self, uid, name, song: dict):
+        vid = song.get("vid")
+        if not vid:
+            return
+        uid = str(uid)
+
+        refs = self._by_vid.get(vid)
+        if not refs or (uid, name) not in refs:
+            return
+        refs[(uid, name)] -= 1
+        if refs[(uid, name)] <= 0:
+            del refs[(uid, name)]
+        if not refs:
+            del self._by_vid[vid]
+
+        user_vids = self._by_user.get(uid, {})
+        user_vids[vid] = user_vids.get(vid, 1) - 1
+        if user_vids[vid] > 0:
+            return
+
+        # last copy of this song for the user -> forget its tokens
+        del user_vids[vid]
+        self._titles.get(uid, {}).pop(vid, None)
+        tokens = self._tokens.get(uid, {})
+        for tok in self._song_tokens.get(uid, {}).pop(vid, ()):
+            vids = tokens.get(tok)
+            if vids is not None:
+                vids.discard(vid)
+                if not vids:
+                    del tokens[tok]
+
+    def drop_playlist(self, uid, name, songs: list):
+        for song in songs:
+            self.remove(uid, name, song)
+
+    # ---------- queries ----------
+
+    def contains(self, uid, name, vid) -> bool:
+        return (str(uid), name) in self._by_vid.get(vid, {})
+
+    def playlists_with(self, uid, vid) -> list:
+        uid = str(uid)
+        return sorted(n for (u, n) in self._by_vid.get(vid, {}) if u == uid)
+
+    def user_song_count(self, uid) -> int:
+        return len(self._by_user.get(str(uid), {}))
+
+    def search(self, uid, query: str, limit: int = 10) -> list:
+        """
+        Return [(vid, title)] of the user's songs whose title/query contains
+        every word of `query`. The last word also matches as a prefix so
+        half-typed searches still work.
+        """
+        uid = str(uid)
+        tokens = self._tokens.get(uid)
+        words = [w for w in re.sub(r"[^\w\s]", " ", (query or "").lower()).split()
+                 if w not in _JUNK_WORDS]
+        if not tokens or not words:
+            return []
+
+        *full, last = words
+        result = None
+        for w in full:
+            vids = tokens.get(w, set())
+            result = set(vids) if result is None else result & vids
+            if not result:
+                return []
+
+        prefix_hits = set(tokens.get(last, set()))
+        if len(last) >= 2:
+            for tok, vids in tokens.items():
+                if tok.startswith(last):
+                    prefix_hits |= vids
+        result = prefix_hits if result is None else result & prefix_hits
+
+        titles = self._titles.get(uid, {})
+        return sorted(((v, titles.get(v, "")) for v in result), key=lambda x: x[1].lower())[:limit]
@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+
+
+class ProfileCache:
+    """
+    TTL cache of Telegram user objects plus a username -> user id index.
+
+    observe() is fed every user the bot sees in incoming messages, so the
+    index and the cached profiles stay fresh without extra API calls; get()
+    only goes to Telegram on a miss or after `ttl` seconds. At most
+    `max_users` profiles are kept (least recently seen dropped first);
+    ids found in `keep` (e.g. the AFK users) are never dropped.
+    """
+
+    def __init__(self, ttl: float = 600, max_users: int = 5000, keep=()):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.keep = keep
+        self._users = OrderedDict()   # user_id -> (fetched_at, user)
+        self._ids = {}                # lowercase username -> user_id
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def observe(self, user):
+        if not user or not getattr(user, "id", None):
+            return
+        old = self._users.pop(user.id, None)
+        if old:
+            self._unindex(old[1])
+        self._users[user.id] = (time.monotonic(), user)
+        if user.username:
+            self._ids[user.username.lower()] = user.id
+
+        skipped = 0
+        while len(self._users) > self.max_users and skipped < len(self._users):
+            oldest = next(iter(self._users))
+            if oldest in self.keep:
+                self._users.move_to_end(oldest)
+                skipped += 1
+                continue
+            _, dropped = self._users.pop(oldest)
+            self._unindex(dropped)
+
+    def _unindex(self, user):
+        name = (user.username or "").lower()
+        if name and self._ids.get(name) == user.id:
+            del self._ids[name]
+
+    def remember(self, username: str, user_id):
+        """Index a username known from elsewhere (e.g. saved AFK records) without a profile."""
+        if username:
+            self._ids.setdefault(username.lower(), user_id)
+
+    def forget(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if entry:
+            self._unindex(entry[1])
+
+    def resolve(self, username: str):
+        """User id for @username (with or without the @), or None."""
+        return self._ids.get(username.lstrip("@").lower())
+
+    def cached(self, user_id):
+        entry = self._users.get(user_id)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    async def get(self, client, user_id):
+        user = self.cached(user_id)
+        if user is not None:
+            self.hits += 1
+            self._users.move_to_end(user_id)
+            return user
+
+        self.misses += 1
+        user = await client.get_users(user_id)
+        self.observe(user)
+        return user
+
+    def stats(self) -> dict:
+        return {"users": len(self._users), "usernames": len(self._ids), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from pyrogram.errors import FloodWait
+
+from core.metrics import METRICS
+
+FLOOD_WAITS = METRICS.counter("bot_flood_waits_total", "FloodWait errors received", ["where"])
+
+
+async def stream_reply(message, pieces, min_interval: float = 1.5, min_new_chars: int = 24, cursor: str = " ▌"):
+    """
+    Reply to `message` with text coming from the async iterator `pieces`.
+
+    The first non-empty text is posted right away; after that the message is
+    edited at most every `min_interval` seconds and only once at least
+    `min_new_chars` new characters piled up, so a fast stream turns into a
+    handful of edits instead of one per token. A FloodWait on an
+    intermediate edit just pauses editing; the final edit always lands.
+    Returns the full text.
+    """
+    text = ""
+    shown = ""
+    sent = None
+    last_edit = 0.0
+    paused_until = 0.0
+
+    async for piece in pieces:
+        text += piece
+        if not text.strip():
+            continue
+
+        now = time.monotonic()
+        if sent is None:
+            sent = await message.reply_text(text + cursor)
+            shown, last_edit = text, now
+            continue
+
+        if now < paused_until or now - last_edit < min_interval or len(text) - len(shown) < min_new_chars:
+            continue
+
+        try:
+            await sent.edit_text(text + cursor)
+            shown, last_edit = text, now
+        except FloodWait as e:
+            FLOOD_WAITS.inc(1, "ai_edit")
+            paused_until = now + e.value
+        except Exception:
+            pass
+
+    text = text.strip()
+    if not text:
+        return text
+
+    if sent is None:
+        await message.reply_text(text)
+        return text
+
+    for _ in range(2):
+        try:
+            await sent.edit_text(text)
+            break
+        except FloodWait as e:
+            FLOOD_WAITS.inc(1, "ai_edit")
+            await asyncio.sleep(e.value)
+        except Exception:
+            break
+
+    return text
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import math
+
+log = logging.getLogger("music_bot")
+
+
+class Timer:
+    """Handle returned by TimerWheel.call_later()/call_every(); cancel() is O(1)."""
+
+    __slots__ = ("when", "callback", "args", "key", "interval", "remaining", "cancelled", "_slot", "_wheel")
+
+    def __init__(self, wheel, when, callback, args, key, interval):
+        self._wheel = wheel
+        self.when = when            # absolute tick
+        self.callback = callback
+        self.args = args
+        self.key = key
+        self.interval = interval    # ticks, for repeating timers
+        self.remaining = None       # ticks left while its key is paused
+        self.cancelled = False
+        self._slot = None
+
+    def cancel(self):
+        self._wheel.cancel(self)
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel: one asyncio task drives every timer, however
+    many chats are playing.
+
+    `levels` wheels of 2**`bits` slots each; level L holds timers due
+    within 2**(bits*(L+1)) ticks and is cascaded down a level each time
+    the level below wraps. Slots are dicts, so insert and cancel are O(1);
+    a tick only touches the one slot that is due (plus a cascade every
+    2**bits ticks).
+
+    Timers can carry a `key` (a chat id). pause(key) takes that key's
+    timers off the wheel with their remaining ticks and resume(key) puts
+    them back, so track-end watchdogs and progress ticks stand still
+    while a call is paused; cancel_key(key) drops them all.
+
+    Callbacks may be plain functions or coroutine functions (run as a task).
+    """
+
+    def __init__(self, tick: float = 1.0, bits: int = 6, levels: int = 4):
+        self.tick = tick
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self._wheels = [[{} for _ in range(1 << bits)] for _ in range(levels)]
+        self._overflow = {}
+        self._keys = {}         # key -> {timer: None}
+        self._paused = set()
+        self._now = 0           # ticks processed
+        self._started = None    # loop.time() at tick 0
+        self._task = None
+        self.fired = 0
+        self.behind = 0         # ticks caught up in one go, last time
+
+    def __len__(self):
+        return sum(len(timers) for timers in self._keys.values())
+
+    # ---------- scheduling ----------
+
+    def _ticks(self, seconds: float) -> int:
+        return max(1, math.ceil(seconds / self.tick))
+
+    def _place(self, t: Timer):
+        t.when = max(t.when, self._now)
+        delta = t.when - self._now
+        slot = self._overflow
+        for level, wheel in enumerate(self._wheels):
+            if delta < 1 << (self.bits * (level + 1)):
+                slot = wheel[(t.when >> (self.bits * level)) & self.mask]
+                break
+        slot[t] = None
+        t._slot = slot
+
+    def _add(self, delay: float, callback, args, key, interval):
+        t = Timer(self, self._now + self._ticks(delay), callback, args, key, interval)
+        self._keys.setdefault(key, {})[t] = None
+        if key is not None and key in self._paused:
+            t.remaining = t.when - self._now
+        else:
+            self._place(t)
+        return t
+
+    def call_later(self, delay: float, callback, *args, key=None) -> Timer:
+        """Run callback(*args) once, `delay` seconds (rounded up to a tick) from now."""
+        return self._add(delay, callback, args, key, None)
+
+    def call_every(self, interval: float, callback, *args, key=None, first: float = None) -> Timer:
+        """Run callback(*args) every `interval` seconds (first after `first`, default `interval`)."""
+        return self._add(interval if first is None else first, callback, args, key, self._ticks(interval))
+
+    def cancel(self, t: Timer):
+        if t.cancelled:
+            return
+        t.cancelled = True
+        if t._slot is not None:
+            t._slot.pop(t, None)
+            t._slot = None
+        timers = self._keys.get(t.key)
+        if timers is not None:
+            timers.pop(t, None)
+            if not timers:
+                del self._keys[t.key]
+
+    def cancel_key(self, key) -> int:
+        timers = list(self._keys.get(key, ()))
+        for t in timers:
+            self.cancel(t)
+        self._paused.discard(key)
+        return len(timers)
+
+    def pause(self, key):
+        """Freeze every timer of `key` (and any added while paused) until resume(key)."""
+        if key in self._paused:
+            return
+        self._paused.add(key)
+        for t in self._keys.get(key, ()):
+            if t._slot is not None:
+                t._slot.pop(t, None)
+                t._slot = None
+                t.remaining = t.when - self._now
+
+    def resume(self, key):
+        if key not in self._paused:
+            return
+        self._paused.discard(key)
+        for t in self._keys.get(key, ()):
+            if t._slot is None and not t.cancelled:
+                t.when = self._now + t.remaining
+                t.remaining = None
+                self._place(t)
+
+    def clear(self):
+        for wheel in self._wheels:
+            for slot in wheel:
+                slot.clear()
+        self._overflow.clear()
+        for timers in self._keys.values():
+            for t in timers:
+                t.cancelled = True
+                t._slot = None
+        self._keys.clear()
+        self._paused.clear()
+
+    # ---------- driving ----------
+
+    def _cascade(self, level: int) -> int:
+        wheel = self._wheels[level] if level < len(self._wheels) else None
+        if wheel is None:
+            slot, index = self._overflow, 0
+        else:
+            index = (self._now >> (self.bits * level)) & self.mask
+            slot = wheel[index]
+        timers = list(slot)
+        slot.clear()
+        for t in timers:
+            self._place(t)
+        return index
+
+    def _advance(self):
+        self._now += 1
+        level = 1
+        while (self._now >> (self.bits * (level - 1))) & self.mask == 0 and level <= len(self._wheels):
+            if self._cascade(level):
+                break
+            level += 1
+
+        slot = self._wheels[0][self._now & self.mask]
+        due = list(slot)
+        slot.clear()
+        for t in due:
+            t._slot = None
+        for t in due:
+            # an earlier callback this tick may have cancelled or paused it
+            if t.cancelled:
+                continue
+            if t.key in self._paused:
+                t.remaining = 1
+                continue
+            if t.interval:
+                t.when = self._now + t.interval
+                self._place(t)
+            else:
+                self.cancel(t)
+            self._fire(t)
+
+    def _fire(self, t: Timer):
+        self.fired += 1
+        try:
+            result = t.callback(*t.args)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result).add_done_callback(self._report)
+        except Exception as e:
+            log.error(f"Timer callback {getattr(t.callback, '__name__', t.callback)} failed: {e}")
+
+    @staticmethod
+    def _report(task):
+        if not task.cancelled() and task.exception():
+            log.error(f"Timer callback failed: {task.exception()!r}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            target = int((loop.time() - self._started) / self.tick)
+            self.behind = target - self._now
+            while self._now < target:
+                self._advance()
+            await asyncio.sleep(self._started + (self._now + 1) * self.tick - loop.time())
+
+    def start(self):
+        if self._task is None:
+            self._started = asyncio.get_running_loop().time() - self._now * self.tick
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "timers": len(self),
+            "keys": len(self._keys),
+            "paused": len(self._paused),
+            "fired": self.fired,
+            "behind_ticks": self.behind,
+        }
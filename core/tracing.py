@@ -0,0 +1,175 @@
+import contextvars
+import functools
+import itertools
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+_trace = contextvars.ContextVar("trace", default=None)
+_depth = contextvars.ContextVar("trace_depth", default=0)
+
+
+class Trace:
+    """One request (e.g. a /play) and the timed spans that happened inside it."""
+
+    def __init__(self, trace_id: int, name: str, attrs: dict):
+        self.id = trace_id
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.spans = []           # [name, offset, duration, depth, error]
+        self.duration = None
+        self.error = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "started": self.started,
+            "duration": self.duration,
+            "error": self.error,
+            "spans": [
+                {"name": n, "offset": round(o, 4), "duration": round(d, 4), "depth": depth, "error": err}
+                for n, o, d, depth, err in self.spans
+            ],
+        }
+
+
+def _current():
+    # tasks spawned from a traced handler inherit its context; once that trace
+    # has finished, their work is not part of it any more
+    trace = _trace.get()
+    if trace is not None and trace.duration is None:
+        return trace
+    return None
+
+
+def _attrs(args) -> dict:
+    # handlers get (client, message); pipeline helpers get chat_id first
+    for arg in args:
+        chat = getattr(arg, "chat", None)
+        if chat is not None:
+            user = getattr(arg, "from_user", None)
+            return {
+                "chat": chat.id,
+                "user": user.id if user else None,
+                "text": (getattr(arg, "text", None) or "")[:80],
+            }
+        if isinstance(arg, int):
+            return {"chat": arg}
+    return {}
+
+
+class Tracer:
+    """
+    Lightweight span tracing kept in a ring buffer of the last `size` traces.
+
+    traced(name) makes a coroutine function the root of a trace (or a span
+    if a trace is already running); span(name) / stage(name) time a piece
+    of work inside whatever trace is current. The current trace rides on
+    a contextvar, so helpers awaited from a traced handler are picked up
+    without passing anything around. Stage durations also go to
+    `histogram` (labelled by stage) whether or not a trace is running.
+    """
+
+    def __init__(self, size: int = 200, histogram=None):
+        self.traces = deque(maxlen=size)
+        self.histogram = histogram
+        self._ids = itertools.count(1)
+
+    @contextmanager
+    def span(self, name: str):
+        trace = _current()
+        depth = _depth.get() if trace else 0
+        token = _depth.set(depth + 1)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _depth.reset(token)
+            elapsed = time.perf_counter() - start
+            if self.histogram is not None:
+                self.histogram.observe(elapsed, name)
+            if trace is not None and trace.duration is None:
+                trace.spans.append([name, start - trace._t0, elapsed, depth, error])
+
+    def stage(self, name: str):
+        """Decorator: run a coroutine function inside span(name)."""
+        def wrap(func):
+            @functools.wraps(func)
+            async def staged(*args, **kwargs):
+                with self.span(name):
+                    return await func(*args, **kwargs)
+            return staged
+        return wrap
+
+    async def timed(self, name: str, awaitable):
+        """`await tracer.timed("reply_photo", message.reply_photo(...))` -> span around one await."""
+        with self.span(name):
+            return await awaitable
+
+    def traced(self, name: str):
+        """Decorator: each call of the coroutine function is recorded as a trace."""
+        def wrap(func):
+            @functools.wraps(func)
+            async def run(*args, **kwargs):
+                if _current() is not None:
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+
+                trace = Trace(next(self._ids), name, _attrs(args))
+                token = _trace.set(trace)
+                depth = _depth.set(0)
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException as e:
+                    trace.error = f"{type(e).__name__}: {e}"[:200]
+                    raise
+                finally:
+                    _depth.reset(depth)
+                    _trace.reset(token)
+                    trace.duration = time.perf_counter() - trace._t0
+                    self.traces.append(trace)
+            return run
+        return wrap
+
+    # ---------- queries ----------
+
+    def recent(self, n: int = 5) -> list:
+        return list(self.traces)[-n:][::-1]
+
+    def slowest(self, n: int = 5) -> list:
+        return sorted(self.traces, key=lambda t: t.duration or 0, reverse=True)[:n]
+
+    def get(self, trace_id: int):
+        for t in self.traces:
+            if t.id == trace_id:
+                return t
+        return None
+
+    def export(self, traces=None) -> str:
+        traces = self.traces if traces is None else traces
+        return json.dumps([t.to_dict() for t in traces], ensure_ascii=False, indent=1)
+
+
+def format_trace(trace: Trace) -> str:
+    """Plain-text waterfall of one trace."""
+    lines = [
+        f"#{trace.id} {trace.name} {trace.duration * 1000:.0f}ms"
+        + (f" ❌ {trace.error}" if trace.error else "")
+    ]
+    if trace.attrs:
+        lines.append(" ".join(f"{k}={v}" for k, v in trace.attrs.items() if v not in (None, "")))
+    for name, offset, duration, depth, error in sorted(trace.spans, key=lambda s: s[1]):
+        lines.append(
+            f"{'  ' * depth}+{offset * 1000:.0f}ms {name} {duration * 1000:.0f}ms"
+            + (f" ({error})" if error else "")
+        )
+    return "\n".join(lines)
@@ -0,0 +1,101 @@
+import hmac
+import json
+import logging
+
+from aiohttp import web
+
+log = logging.getLogger("music_bot")
+
+
+class WebServer:
+    """
+    Keepalive / ops HTTP server running on the bot's own event loop.
+
+        GET /           "deployed" (what the hosting health check hits)
+        GET /health     the loop is alive and answering
+        GET /ready      200 once every readiness check passes, else 503
+        GET /metrics    Prometheus text format from `metrics`
+        GET /admin/<x>  JSON from endpoints added with admin(); needs
+                        `admin_token` as a Bearer token or ?token=
+
+    `ready()` returns {check name: bool}. Without an admin token the admin
+    endpoints are not served at all.
+    """
+
+    def __init__(self, port: int, ready=None, metrics=None, admin_token: str = None, host: str = "0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.ready = ready
+        self.metrics = metrics
+        self.admin_token = admin_token
+        self._admin = {}
+        self._runner = None
+
+    def admin(self, name: str):
+        """Decorator: expose fn() (sync or async, returning something JSON-able) at /admin/<name>."""
+        def register(fn):
+            self._admin[name] = fn
+            return fn
+        return register
+
+    # ---------- handlers ----------
+
+    async def _root(self, request):
+        return web.Response(text="deployed")
+
+    async def _health(self, request):
+        return web.Response(text="ok")
+
+    async def _ready(self, request):
+        try:
+            checks = self.ready() if self.ready else {}
+        except Exception as e:
+            checks = {"error": str(e)}
+        ok = bool(checks) and all(v is True for v in checks.values())
+        return web.json_response(checks, status=200 if ok else 503)
+
+    async def _metrics(self, request):
+        # the Prometheus text exposition format, as scrapers negotiate it
+        return web.Response(body=self.metrics.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    def _authorized(self, request) -> bool:
+        given = request.query.get("token", "")
+        auth = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            given = auth[7:]
+        return bool(given) and hmac.compare_digest(given, self.admin_token)
+
+    async def _admin_endpoint(self, request):
+        if not self._authorized(request):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        fn = self._admin.get(request.match_info["name"])
+        if fn is None:
+            return web.json_response({"error": "not found", "endpoints": sorted(self._admin)}, status=404)
+        result = fn()
+        if hasattr(result, "__await__"):
+            result = await result
+        return web.Response(text=json.dumps(result, default=str, ensure_ascii=False),
+                            content_type="application/json")
+
+    # ---------- lifecycle ----------
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self._root)
+        app.router.add_get("/health", self._health)
+        app.router.add_get("/ready", self._ready)
+        if self.metrics is not None:
+            app.router.add_get("/metrics", self._metrics)
+        if self.admin_token:
+            app.router.add_get("/admin/{name}", self._admin_endpoint)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info(f"🌐 Web server listening on :{self.port}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
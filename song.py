@@ -3,10 +3,8 @@
 import os
 import tempfile
 import asyncio
-import threading
 import logging
 import aiohttp
-from flask import Flask
 from pyrogram.enums import ParseMode
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 import time
@@ -17,8 +15,6 @@ from pytgcalls.types import MediaStream
 import re
 from functools import partial
 import html
-from PIL import Image
-from io import BytesIO
 
 # --- Compatibility handling for PyTgCalls versions ---
 try:
@@ -28,12 +24,7 @@ except ImportError:
     StreamType = None
     Update = None
 from pyrogram.enums import ChatAction
-import requests
-
-import google.generativeai as genai
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-genai.configure(api_key=GEMINI_API_KEY)
-gemini = genai.GenerativeModel("gemini-2.5-flash")
+from pyrogram.errors import FloodWait
 
 
 
@@ -49,8 +40,11 @@ log = logging.getLogger("music_bot")
 # -------------------------
 # Environment / required
 # -------------------------
-API_BASE = "https://shrutibots.site"
-DOWNLOAD_DIR = "downloads"
+# upstreams are overridable so bench/ can point them at a local stand-in
+API_BASE = os.getenv("API_BASE", "https://shrutibots.site")
+YOUTUBE_URL = os.getenv("YOUTUBE_URL", "https://www.youtube.com")
+YOUTUBE_API_URL = os.getenv("YOUTUBE_API_URL", "https://www.googleapis.com/youtube/v3")
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "downloads")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 API_ID = int(os.getenv("API_ID", "0"))
 API_HASH = os.getenv("API_HASH")
@@ -82,6 +76,20 @@ userbot = Client("userbot_account", session_string=USERBOT_SESSION, api_id=API_I
 call_py = PyTgCalls(userbot)
 handler_client = bot if bot else userbot
 
+# -------------------------
+# Assistant pool: every userbot session gets its own PyTgCalls
+# -------------------------
+from core.assistants import Assistant, AssistantPool, membership_error
+
+# extra assistant accounts (session strings, space or comma separated)
+ASSISTANT_SESSIONS = [s for s in re.split(r"[\s,]+", os.getenv("ASSISTANT_SESSIONS", "")) if s]
+
+ASSISTANTS = AssistantPool()
+ASSISTANTS.add(Assistant("assistant1", userbot, call_py))
+for _i, _session in enumerate(ASSISTANT_SESSIONS, start=2):
+    _ub = Client(f"userbot_account_{_i}", session_string=_session, api_id=API_ID, api_hash=API_HASH)
+    ASSISTANTS.add(Assistant(f"assistant{_i}", _ub, PyTgCalls(_ub)))
+
 
 
 
@@ -104,9 +112,19 @@ USER_PLAYLISTS = {}
 # keep legacy name `playlists` as an alias so older code continues to work
 playlists = USER_PLAYLISTS
 
+from core.playlist_index import PlaylistIndex
+
+# by-vid / by-title-token / by-user lookups over USER_PLAYLISTS
+PLAYLIST_INDEX = PlaylistIndex()
+
 
 BACKUP_CHAT_ID = 8353079084  # 🔴 YOUR Telegram ID
-PLAYLIST_BACKUP_FILE = "playlists_backup.json"
+PLAYLIST_BACKUP_DIR = "backups"
+
+from core.backup import PlaylistBackup
+
+# gzip'd snapshot + delta chain, skips the write when nothing changed
+PLAYLIST_BACKUP = PlaylistBackup(PLAYLIST_BACKUP_DIR)
 
 import uuid
 
@@ -116,14 +134,139 @@ def clean_text(s: str) -> str:
     return s.encode("utf-8", "ignore").decode("utf-8", "ignore")
 
 
+from core.metrics import METRICS
+from core.tracing import Tracer, format_trace
+
+# 📊 metrics (scraped from /metrics on the web server); recording is a dict update
+STAGE_SECONDS = METRICS.histogram("bot_stage_seconds", "Latency of pipeline stages", ["stage"])
+DOWNLOAD_BYTES = METRICS.counter("bot_download_bytes_total", "Bytes downloaded from the media API", ["kind"])
+FLOOD_WAITS = METRICS.counter("bot_flood_waits_total", "FloodWait errors received", ["where"])
+
+# 🔍 per-request traces for the play pipeline (/trace); stages also feed STAGE_SECONDS
+TRACER = Tracer(size=200, histogram=STAGE_SECONDS)
+METRICS.gauge("bot_active_calls", "Chats with the bot in voice chat", fn=lambda: len(vc_active))
+METRICS.gauge(
+    "bot_queue_depth", "Queued songs per chat", ["chat"],
+    fn=lambda: {(cid,): len(q) for cid, q in list(music_queue.items()) if q}
+)
+METRICS.gauge(
+    "bot_assistant_chats", "Chats served per assistant", ["assistant"],
+    fn=lambda: {(a.name,): len(a.chats) for a in ASSISTANTS.assistants}
+)
+METRICS.gauge(
+    "bot_ffmpeg_jobs", "ffmpeg jobs by state", ["state"],
+    fn=lambda: {(k,): v for k, v in FFMPEG_JOBS.stats().items() if k != "workers"}
+)
+
+
 async def is_vc_active(chat_id: int) -> bool:
+    assistant = ASSISTANTS.get(chat_id)
+    if assistant is None:
+        return False
     try:
-        call = call_py.get_call(chat_id)
+        call = assistant.calls.get_call(chat_id)
         return call is not None
     except Exception:
         return False
 
 
+def vc_calls(chat_id: int):
+    """PyTgCalls serving chat_id (primary assistant if the chat has none yet)."""
+    assistant = ASSISTANTS.get(chat_id)
+    return (assistant or ASSISTANTS.primary).calls
+
+
+@TRACER.stage("vc_play")
+async def vc_play(chat_id: int, stream):
+    """Start a stream on the chat's assistant, placing the chat if needed.
+    On FloodWait (assistant cooled down) or when the assistant isn't in the
+    group, the chat moves on to the next assistant; the last error is raised
+    once every assistant has been tried."""
+    tried = []
+    while True:
+        assistant = ASSISTANTS.for_chat(chat_id, exclude=tried)
+        try:
+            await assistant.calls.play(chat_id, stream)
+            ASSISTANTS.joined(assistant, chat_id)
+            return
+        except FloodWait as e:
+            FLOOD_WAITS.inc(1, "vc_play")
+            log.warning(f"[{assistant.name}] FloodWait {e.value}s, moving chat {chat_id}")
+            ASSISTANTS.cooldown(assistant, e.value)
+            ASSISTANTS.release(chat_id)
+            if len(tried) + 1 >= len(ASSISTANTS):
+                raise
+        except Exception as e:
+            if not membership_error(e):
+                raise
+            log.warning(f"[{assistant.name}] can't join chat {chat_id}: {e}")
+            ASSISTANTS.not_member(assistant, chat_id)
+            if len(tried) + 1 >= len(ASSISTANTS):
+                raise
+        tried.append(assistant)
+
+
+async def failover_assistant(assistant):
+    """Move every chat of a dead assistant to a live one, resuming where it was."""
+    moved = ASSISTANTS.mark_dead(assistant)
+    log.warning(f"[{assistant.name}] down, failing over {len(moved)} chat(s)")
+
+    for chat_id in moved:
+        song = current_song.get(chat_id)
+        if not song:
+            continue
+        # a paused chat resumes from where it was paused, and stays paused
+        paused = PLAYBACK.state(chat_id) == PAUSED
+        elapsed = time.time() - song.get("start_time", time.time()) - PLAYBACK.paused_for(chat_id)
+        elapsed = max(0, int(elapsed))
+        try:
+            if song.get("is_video"):
+                stream = MediaStream(song["url"], ffmpeg_parameters=f"-ss {elapsed}")
+            else:
+                stream = MediaStream(
+                    song["url"],
+                    video_flags=MediaStream.Flags.IGNORE,
+                    ffmpeg_parameters=f"-ss {elapsed}"
+                )
+            PLAYBACK.restarted(chat_id)
+            await vc_play(chat_id, stream)
+        except Exception as e:
+            log.error(f"Failover of chat {chat_id} failed: {e}")
+            await cleanup_chat(chat_id)
+            continue
+
+        if paused:
+            try:
+                await vc_calls(chat_id).pause(chat_id)
+            except Exception as e:
+                # it is playing now: make PLAYBACK and the chat's timers agree
+                log.warning(f"Could not re-pause chat {chat_id} after failover: {e}")
+                resumed(chat_id)
+
+
+# consecutive disconnected checks before failing over; a reconnect in
+# progress reads as disconnected for a moment
+FAILOVER_AFTER = 3
+
+
+async def assistant_watchdog(interval: int = 30):
+    misses = {}
+    while True:
+        await asyncio.sleep(interval)
+        for assistant in ASSISTANTS:
+            connected = bool(getattr(assistant.client, "is_connected", False))
+            if connected:
+                misses.pop(assistant.name, None)
+            else:
+                misses[assistant.name] = misses.get(assistant.name, 0) + 1
+
+            if assistant.alive and misses.get(assistant.name, 0) >= FAILOVER_AFTER:
+                await failover_assistant(assistant)
+            elif not assistant.alive and connected:
+                ASSISTANTS.mark_alive(assistant)
+                log.info(f"[{assistant.name}] back online.")
+
+
 
 
 
@@ -163,7 +306,18 @@ def normalize_lyrics_query(q: str) -> str:
 
 def load_playlists():
     global USER_PLAYLISTS, playlists
-    if PLAYLIST_FILE.exists():
+
+    # prime the backup chain so the next backup is a delta against it
+    try:
+        backed_up = PLAYLIST_BACKUP.restore_local()
+    except Exception as e:
+        log.warning(f"Local playlist backup chain unusable: {e}")
+        backed_up = None
+
+    if not PLAYLIST_FILE.exists() and backed_up is not None:
+        USER_PLAYLISTS.clear()
+        USER_PLAYLISTS.update(backed_up)
+    elif PLAYLIST_FILE.exists():
         try:
             with open(PLAYLIST_FILE, "r", encoding="utf-8") as f:
                 data = json.load(f)
@@ -183,6 +337,8 @@ def load_playlists():
         USER_PLAYLISTS.clear()
         playlists.clear()
 
+    PLAYLIST_INDEX.rebuild(USER_PLAYLISTS)
+
 
 
 def save_playlists():
@@ -200,15 +356,53 @@ def get_user_playlists(user_id: int):
 def normalize_name(name: str) -> str:
     return name.strip().lower()
 
+from core.ffmpeg_jobs import FFmpegScheduler, INTERACTIVE
+from core.afk import AfkStore
+from core.bans import BanStore
+from core.admins import AdminCache, admin_filter
+from core.playback import PlaybackStates, LOADING, PAUSED, TRANSITIONING
+from core.timerwheel import TimerWheel
+
+# pool (sized to the cores) for ffmpeg we spawn ourselves. Its only caller so
+# far is restart_with_seek, which isn't wired to a command: live playback
+# transcoding is PyTgCalls' own and doesn't go through here
+FFMPEG_JOBS = FFmpegScheduler()
+
 loop_counts = {}
 current_song = {}
 music_queue = {}
 chat_locks = {}
-vc_session = {}  # chat_id -> unique session id
 vc_active = set()        # chats where bot is in VC
-timers = {}              # chat_id -> auto_next asyncio.Task
-BANNED_USERS = set()
-afk_users = {}
+timers = {}              # chat_id -> track-end watchdog (WHEEL timer)
+progress_timers = {}     # chat_id -> progress bar ticks (WHEEL timer)
+
+# 🔹 one scheduler for every per-chat timer; a chat's timers are keyed by
+# chat_id so pause/resume/cleanup act on all of them at once
+WHEEL = TimerWheel(tick=1.0)
+PROGRESS_EVERY = 15
+METRICS.gauge("bot_timers", "Timers pending on the timer wheel", fn=lambda: len(WHEEL))
+
+# 🔹 per-chat playback state; the only thing allowed to move a chat to its next track
+PLAYBACK = PlaybackStates()
+METRICS.gauge(
+    "bot_playback_chats", "Chats per playback state", ["state"],
+    fn=lambda: {(k,): v for k, v in PLAYBACK.stats()["chats"].items()}
+)
+METRICS.gauge(
+    "bot_playback_triggers", "Track-end triggers applied vs dropped as duplicate/stale", ["result"],
+    fn=lambda: {("applied",): PLAYBACK.transitions, ("dropped",): PLAYBACK.dropped}
+)
+
+# stream-end is the primary track-end signal; the timer is a watchdog that
+# only fires this long after a track should have ended (no grace without it)
+WATCHDOG_GRACE = 5 if HAS_STREAM_END else 0
+# stream-end for a stream younger than this is left over from the one it replaced
+STREAM_END_MIN_PLAYED = 2.0
+# bot-wide bans, persisted; enforced once by the ban gate (group -100)
+BANNED_USERS = BanStore(path=os.getenv("BANS_FILE", "banned_users.json"))
+
+# AFK statuses survive restarts and expire after a week
+afk_users = AfkStore(path=os.getenv("AFK_FILE", "afk_users.json"))
 
 
 async def download_thumbnail(url: str) -> str | None:
@@ -228,6 +422,7 @@ async def download_thumbnail(url: str) -> str | None:
     except:
         return None
 
+@TRACER.stage("youtube_details")
 async def get_youtube_details(video_id: str):
     """
     Returns:
@@ -236,7 +431,7 @@ async def get_youtube_details(video_id: str):
     if not YOUTUBE_API_KEY:
         return None, None, None, 0, f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
 
-    url = "https://www.googleapis.com/youtube/v3/videos"
+    url = f"{YOUTUBE_API_URL}/videos"
     params = {
         "part": "snippet,contentDetails,statistics",
         "id": video_id,
@@ -270,6 +465,25 @@ async def get_youtube_details(video_id: str):
 import json
 
 
+# 🔹 ban gate: runs before every other handler group and ends dispatch for banned users
+# (async so Pyrogram checks it on the loop instead of a thread-pool hop per update)
+async def _banned(flt, client, update):
+    return bool(update.from_user) and update.from_user.id in BANNED_USERS
+
+
+is_banned = filters.create(_banned, "BannedFilter")
+
+
+@handler_client.on_message(is_banned, group=-100)
+async def ban_gate(client, message):
+    message.stop_propagation()
+
+
+@handler_client.on_callback_query(is_banned, group=-100)
+async def ban_gate_callback(client, cq):
+    cq.stop_propagation()
+
+
 @handler_client.on_message(filters.command("bban"))
 async def bban(_, message):
     if message.from_user.id not in MODS:
@@ -295,24 +509,27 @@ async def unbban(_, message):
 
 
 
-def dump_playlists_to_file(path=PLAYLIST_BACKUP_FILE):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(USER_PLAYLISTS, f, indent=2, ensure_ascii=False)
+def backup_playlists(full: bool = False):
+    """Write a snapshot/delta backup. Returns its path, or None if nothing changed."""
+    return PLAYLIST_BACKUP.write(USER_PLAYLISTS, full=full)
 
 
 
 async def cleanup_chat(chat_id: int):
-    vc_session[chat_id] = vc_session.get(chat_id, 0) + 1
+    PLAYBACK.stop(chat_id)
     vc_active.discard(chat_id)
     current_song.pop(chat_id, None)
     music_queue.pop(chat_id, None)
 
-    task = timers.pop(chat_id, None)
-    if task:
-        task.cancel()
+    timers.pop(chat_id, None)
+    progress_timers.pop(chat_id, None)
+    WHEEL.cancel_key(chat_id)
 
+    assistant = ASSISTANTS.get(chat_id)
+    ASSISTANTS.release(chat_id)
     try:
-        await call_py.leave_call(chat_id)
+        if assistant:
+            await assistant.calls.leave_call(chat_id)
     except:
         pass
 
@@ -340,21 +557,6 @@ def add_to_queue(chat_id, song):
 
 
 
-# -------------------------
-# Flask app (keep alive for Render)
-# -------------------------
-app = Flask(__name__)
-
-@app.route("/")
-def root():
-    return "deployed"
-
-def run_flask():
-    port = int(os.getenv("PORT", 5000))
-    # threaded True so it doesn't block main loop
-    app.run(host="0.0.0.0", port=port, threaded=True)
-
-
 def format_time(seconds: float) -> str:
     secs = int(seconds)
     m, s = divmod(secs, 60)
@@ -366,6 +568,7 @@ def format_time(seconds: float) -> str:
 # -------------------------
 # Caption helpers
 # -------------------------
+@TRACER.stage("download_audio")
 async def api_download_audio(video_id: str) -> str:
     file_path = f"{DOWNLOAD_DIR}/{video_id}.mp3"
     if os.path.exists(file_path):
@@ -385,11 +588,13 @@ async def api_download_audio(video_id: str) -> str:
         async with session.get(stream_url) as r:
             with open(file_path, "wb") as f:
                 async for chunk in r.content.iter_chunked(65536):
+                    DOWNLOAD_BYTES.inc(len(chunk), "audio")
                     f.write(chunk)
 
     return file_path
 
 
+@TRACER.stage("download_video")
 async def api_download_video(video_id: str) -> str:
     file_path = f"{DOWNLOAD_DIR}/{video_id}.mp4"
     if os.path.exists(file_path):
@@ -409,6 +614,7 @@ async def api_download_video(video_id: str) -> str:
         async with session.get(stream_url) as r:
             with open(file_path, "wb") as f:
                 async for chunk in r.content.iter_chunked(131072):
+                    DOWNLOAD_BYTES.inc(len(chunk), "video")
                     f.write(chunk)
 
     return file_path
@@ -445,9 +651,10 @@ def parse_artist_and_title(query: str):
 
 
 
+@TRACER.stage("youtube_search")
 async def html_youtube_first(query: str):
     import aiohttp, re
-    url = f"https://www.youtube.com/results?search_query={query.replace(' ', '+')}"
+    url = f"{YOUTUBE_URL}/results?search_query={query.replace(' ', '+')}"
     async with aiohttp.ClientSession() as s:
         async with s.get(url) as r:
             html = await r.text()
@@ -510,9 +717,6 @@ def bi(text: str) -> str:
 
 @handler_client.on_message(filters.command("addplaylist"))
 async def add_playlist(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     if len(message.command) < 2:
         return await message.reply_text(bi("Nah not like this qt, lemme show how its done\n/addplaylist (name)"), parse_mode=ParseMode.HTML)
 
@@ -536,9 +740,6 @@ async def add_playlist(client, message):
 
 @handler_client.on_message(filters.command("add"))
 async def add_to_playlist(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     if len(message.command) < 2:
         return await message.reply_text(bi("Not again, lemme show you how its done\n/add (playlist name)"), parse_mode=ParseMode.HTML)
 
@@ -559,6 +760,7 @@ async def add_to_playlist(client, message):
         return await message.reply_text(bi("Aah i cant see any song here to add either im dora the explorer or you are drunk"), parse_mode=ParseMode.HTML)
 
     added = 0
+    skipped = 0
 
     for query in queries:
         try:
@@ -566,14 +768,21 @@ async def add_to_playlist(client, message):
             if not vid:
                 continue
 
-            title, _, _ = await get_youtube_details(vid)
+            # dedup: same video already in this playlist
+            if PLAYLIST_INDEX.contains(user_id, name, vid):
+                skipped += 1
+                continue
+
+            title, *_ = await get_youtube_details(vid)
             title = title or query
 
-            user_pl[name].append({
+            song = {
                 "title": title,
                 "query": query,
                 "vid": vid
-            })
+            }
+            user_pl[name].append(song)
+            PLAYLIST_INDEX.add(user_id, name, song)
             added += 1
 
         except Exception:
@@ -581,8 +790,12 @@ async def add_to_playlist(client, message):
 
     save_playlists()
 
+    text = f"Yah yeah! added {added} song(s) to {name}"
+    if skipped:
+        text += f"\n{skipped} were already in there, not adding them twice"
+
     await message.reply_text(
-        bi(f"Yah yeah! added {added} song(s) to {name}"),
+        bi(text),
         parse_mode=ParseMode.HTML
     )
 
@@ -590,9 +803,6 @@ async def add_to_playlist(client, message):
 
 @handler_client.on_message(filters.command("playlist"))
 async def show_playlist(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     if len(message.command) < 2:
         return await message.reply_text(bi("Nah dude not again like this, lemme show how its done:\n/playlist(name)"), parse_mode=ParseMode.HTML)
 
@@ -613,9 +823,6 @@ async def show_playlist(client, message):
 
 @handler_client.on_message(filters.command("dlt"))
 async def delete_playlist_or_song(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     if len(message.command) < 2:
         return await message.reply_text(bi("Uk you have to be precise to use me haha, usage:\n/dlt (playlist name) (index)"), parse_mode=ParseMode.HTML)
     user_id = message.from_user.id
@@ -628,6 +835,7 @@ async def delete_playlist_or_song(client, message):
 
     # delete whole playlist
     if len(args) == 1:
+        PLAYLIST_INDEX.drop_playlist(user_id, name, user_pl[name])
         del user_pl[name]
         save_playlists()
         return await message.reply_text(bi(f"Ok your wish almighty, deleted {name}"),parse_mode=ParseMode.HTML)
@@ -638,7 +846,7 @@ async def delete_playlist_or_song(client, message):
     removed = 0
     for idx in indexes:
         if 1 <= idx <= len(pl):
-            pl.pop(idx - 1)
+            PLAYLIST_INDEX.remove(user_id, name, pl.pop(idx - 1))
             removed += 1
 
     save_playlists()
@@ -646,11 +854,34 @@ async def delete_playlist_or_song(client, message):
 
 
 
+@handler_client.on_message(filters.command("psearch"))
+async def search_playlists(client, message):
+    if len(message.command) < 2:
+        return await message.reply_text(bi("Search what? usage:\n/psearch (song words)"), parse_mode=ParseMode.HTML)
+
+    user_id = message.from_user.id
+    query = " ".join(message.command[1:])
+    hits = PLAYLIST_INDEX.search(user_id, query)
+
+    if not hits:
+        return await message.reply_text(bi("None of your playlists has anything like that"), parse_mode=ParseMode.HTML)
+
+    user_pl = get_user_playlists(user_id)
+    text = f"🔎 Matches for: {html.escape(query)}\n\n"
+    for vid, title in hits:
+        where = []
+        for pl_name in PLAYLIST_INDEX.playlists_with(user_id, vid):
+            positions = [str(i) for i, song in enumerate(user_pl.get(pl_name, []), start=1)
+                         if song.get("vid") == vid]
+            where.append(f"{html.escape(pl_name)} #{', #'.join(positions)}")
+        text += f"• {html.escape(title)}\n   ↳ {' | '.join(where)}\n"
+
+    await message.reply_text(bi(text), parse_mode=ParseMode.HTML)
+
+
+
 @handler_client.on_message(filters.command("pplay"))
 async def play_playlist(client: Client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     args = message.command[1:]
     if not args:
         return await message.reply_text(bi("Nah ik you are doing this like you doesnt know anything, usage-\n/pplay (playlist) &lt;random/index&gt;."), parse_mode=ParseMode.HTML)
@@ -702,25 +933,28 @@ def get_progress_bar(elapsed: float, total: float, bar_len: int = 14) -> str:
     right = "─" * (bar_len - idx - 1)
     return f"{format_time(elapsed)} {left}🦆{right} {format_time(total)}"
 
-async def update_progress_message(chat_id, msg, start_time, total_dur, caption):
-    while True:
-        elapsed = time.time() - start_time
-        if elapsed > total_dur:
-            break
-        bar = get_progress_bar(elapsed, total_dur)
-        kb = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton(" Pause", callback_data="pause"),
-                InlineKeyboardButton(" Resume", callback_data="resume")
-            ],
-            [InlineKeyboardButton(bar, callback_data="progress")],
-        ])
+async def update_progress_message(chat_id, msg, song, total_dur, caption):
+    """One progress tick; runs every PROGRESS_EVERY s on WHEEL and stands still while paused."""
+    elapsed = time.time() - song["start_time"]
+    if elapsed > total_dur or current_song.get(chat_id) is not song:
+        t = progress_timers.get(chat_id)
+        if t and t.args[2] is song:
+            progress_timers.pop(chat_id).cancel()
+        return
 
-        try:
-            await msg.edit_caption(caption, reply_markup=kb, parse_mode=ParseMode.HTML)
-        except Exception:
-            pass
-        await asyncio.sleep(15)
+    bar = get_progress_bar(elapsed, total_dur)
+    kb = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(" Pause", callback_data="pause"),
+            InlineKeyboardButton(" Resume", callback_data="resume")
+        ],
+        [InlineKeyboardButton(bar, callback_data="progress")],
+    ])
+
+    try:
+        await msg.edit_caption(caption, reply_markup=kb, parse_mode=ParseMode.HTML)
+    except Exception:
+        pass
 
 
 # -------------------------
@@ -730,7 +964,7 @@ async def search_youtube_video_id(session: aiohttp.ClientSession, query: str):
     """Return first YouTube video id for query using Google API."""
     if not YOUTUBE_API_KEY:
         return None
-    url = "https://www.googleapis.com/youtube/v3/search"
+    url = f"{YOUTUBE_API_URL}/search"
     params = {
         "part": "snippet",
         "q": query,
@@ -760,10 +994,8 @@ async def ping_userbot(_, message: Message):
 
 
 @handler_client.on_message(filters.command("song"))
+@TRACER.traced("song")
 async def song_command(client: Client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     ADMIN = 8353079084
 
     import tempfile
@@ -939,14 +1171,14 @@ async def song_command(client: Client, message: Message):
 
 
             
-            await client.send_audio(
+            await TRACER.timed("send_audio", client.send_audio(
                 chat_id=message.chat.id,
                 audio=temp_path,
                 thumb=thumb_path if thumb_path else None,
                 caption=caption,
                 parse_mode=ParseMode.HTML,
                 file_name=f"{clean_text(title)}.mp3",
-            )
+            ))
 
 
 
@@ -982,10 +1214,8 @@ async def song_command(client: Client, message: Message):
 
 
 @handler_client.on_message(filters.reply & filters.command("play"))
+@TRACER.traced("play_reply")
 async def play_replied_audio(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     replied = message.reply_to_message
     chat_id = message.chat.id
 
@@ -1002,11 +1232,10 @@ async def play_replied_audio(client, message):
 
     try:
         file_path = await replied.download()
-        vc_session[chat_id] = vc_session.get(chat_id, 0) + 1
-        session_id = vc_session[chat_id]
+        session_id = PLAYBACK.load(chat_id)
 
 
-        await call_py.play(
+        await vc_play(
             chat_id,
             MediaStream(
                 file_path,
@@ -1014,11 +1243,13 @@ async def play_replied_audio(client, message):
             )
         )
         vc_active.add(chat_id)  # optional, not trusted anymore
+        PLAYBACK.playing(chat_id, session_id)
 
 
 
 
     except Exception as e:
+        PLAYBACK.stop(chat_id)
         return await message.reply_text(
             f"❌ Playback failed:\n<code>{e}</code>",
             parse_mode=ParseMode.HTML
@@ -1047,10 +1278,8 @@ async def play_replied_audio(client, message):
 
 
 @handler_client.on_message(filters.command("play"))
+@TRACER.traced("play")
 async def play_command(client: Client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     """/play <query> - same search/result as /song but robust to race conditions"""
     query = " ".join(message.command[1:]).strip()
     if not query:
@@ -1099,10 +1328,6 @@ async def play_command(client: Client, message: Message):
     if chat_id in current_song and chat_id not in vc_active:
         await cleanup_chat(chat_id)
 
-    task = timers.pop(chat_id, None)
-    if task:
-        task.cancel()
-
     lock = get_chat_lock(chat_id)
 
     async with lock:
@@ -1127,25 +1352,25 @@ async def play_command(client: Client, message: Message):
             return
 
         # Nothing playing -> start playback
+        # new session first: an end event from the stray stream we stop is now stale
+        session_id = PLAYBACK.load(chat_id)
         try:
             # Ensure we stop any stray stream before starting
             try:
-                if hasattr(call_py, "stop_stream"):
-                    await call_py.stop_stream(chat_id)
-                elif hasattr(call_py, "leave_call"):
+                calls = vc_calls(chat_id)
+                if hasattr(calls, "stop_stream"):
+                    await calls.stop_stream(chat_id)
+                elif hasattr(calls, "leave_call"):
                     # leave then join is handled by PyTgCalls automatically when playing
                     try:
-                        await call_py.leave_call(chat_id)
+                        await calls.leave_call(chat_id)
                     except:
                         pass
             except:
                 pass
 
             # start stream
-            vc_session[chat_id] = vc_session.get(chat_id, 0) + 1
-            session_id = vc_session[chat_id]
-
-            await call_py.play(
+            await vc_play(
                 chat_id,
                 MediaStream(
                     mp3,
@@ -1164,6 +1389,7 @@ async def play_command(client: Client, message: Message):
                 "duration": duration_seconds or 180,
                 "start_time": time.time()
             }
+            PLAYBACK.playing(chat_id, session_id)
 
             caption = (
                 "<blockquote>"
@@ -1183,36 +1409,29 @@ async def play_command(client: Client, message: Message):
                 [InlineKeyboardButton("📜 Lyrics", callback_data=f"lyrics|{video_title}")]
             ])
 
-            msg = await message.reply_photo(
+            msg = await TRACER.timed("reply_photo", message.reply_photo(
                 photo=thumb_url,
                 caption=caption,
                 reply_markup=kb,
                 parse_mode=ParseMode.HTML
-            )
+            ))
 
 
-            asyncio.create_task(update_progress_message(chat_id, msg, time.time(), duration_seconds or 180, caption))
-            # 🔥 ALWAYS start auto-next timer for FIRST song
-            old = timers.pop(chat_id, None)
-            if old:
-                old.cancel()
-
-            timers[chat_id] = asyncio.create_task(
-                auto_next_timer(chat_id, duration_seconds or 180, session_id)
-            )
+            # 🔥 ALWAYS arm the auto-next watchdog + progress ticks for FIRST song
+            arm_track(chat_id, session_id, duration_seconds or 180, msg, caption)
 
 
 
 
         except Exception as e:
+            if PLAYBACK.state(chat_id) == LOADING and PLAYBACK.session(chat_id) == session_id:
+                PLAYBACK.stop(chat_id)
             await message.reply_text(f"❌ Voice playback error:\n<code>{e}</code>", parse_mode=ParseMode.HTML)
 
 
 @handler_client.on_message(filters.command("vplay"))
+@TRACER.traced("vplay")
 async def vplay_command(client: Client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     query = " ".join(message.command[1:]).strip()
     if not query:
         return await message.reply_text(bi("Hey you, yes you, eat almonds, you forgot to give a video name after /vplay, kid."), parse_mode=ParseMode.HTML)
@@ -1246,10 +1465,6 @@ async def vplay_command(client: Client, message: Message):
     if chat_id in current_song and chat_id not in vc_active:
         await cleanup_chat(chat_id)
 
-    task = timers.pop(chat_id, None)
-    if task:
-        task.cancel()
-
     lock = get_chat_lock(chat_id)
 
     async with lock:
@@ -1272,13 +1487,16 @@ async def vplay_command(client: Client, message: Message):
             )
 
         # Start video playback
-        vc_session[chat_id] = vc_session.get(chat_id, 0) + 1
-        session_id = vc_session[chat_id]
+        session_id = PLAYBACK.load(chat_id)
 
-        await call_py.play(
-            chat_id,
-            MediaStream(video_path)  # ✅ VIDEO STREAM
-        )
+        try:
+            await vc_play(
+                chat_id,
+                MediaStream(video_path)  # ✅ VIDEO STREAM
+            )
+        except Exception:
+            PLAYBACK.stop(chat_id)
+            raise
         vc_active.add(chat_id)  # optional, not trusted anymore
 
         current_song[chat_id] = {
@@ -1290,6 +1508,7 @@ async def vplay_command(client: Client, message: Message):
             "start_time": time.time(),
             "is_video": True
         }
+        PLAYBACK.playing(chat_id, session_id)
 
         caption = (
             "<blockquote>"
@@ -1311,24 +1530,27 @@ async def vplay_command(client: Client, message: Message):
 
         ])
 
-        msg = await message.reply_photo(
+        msg = await TRACER.timed("reply_photo", message.reply_photo(
             photo=thumb_url,
             caption=caption,
             reply_markup=kb,
             parse_mode=ParseMode.HTML
-        )
+        ))
 
-        asyncio.create_task(
-            update_progress_message(chat_id, msg, time.time(), duration, caption)
-        )
+        arm_track(chat_id, session_id, duration, msg, caption)
 
-        timers[chat_id] = asyncio.create_task(
-            auto_next_timer(chat_id, duration, session_id)
-        )
 
 
+@TRACER.traced("handle_next")
+async def handle_next(chat_id, session=None, min_played: float = 0.0) -> bool:
+    """
+    Move the chat to its next track. Stream-end, the watchdog and skips all
+    come through here; only the first trigger for a track gets past
+    PLAYBACK.finish(), the rest return False without touching the call.
+    """
+    if PLAYBACK.finish(chat_id, session, min_played) is None:
+        return False
 
-async def handle_next(chat_id):
     lock = get_chat_lock(chat_id)
     async with lock:
 
@@ -1338,130 +1560,125 @@ async def handle_next(chat_id):
             loop_counts[chat_id] -= 1
             music_queue.setdefault(chat_id, []).insert(0, prev.copy())
 
-        # ── No songs left ─────────────────────────────
-        if chat_id not in music_queue or not music_queue[chat_id]:
-            await cleanup_chat(chat_id)
-            try:
-                await bot.send_message(
-                    chat_id,
-                    "✅ Queue finished and cleared.",
-                    parse_mode=ParseMode.HTML
-                )
-            except:
-                pass
-            return
-
-        # ── Get next item ─────────────────────────────
-        next_song = music_queue[chat_id].pop(0)
-        current_song[chat_id] = next_song
-        next_song["start_time"] = time.time()
+        # an item whose stream won't start is reported and skipped, so one
+        # dead link can't leave the rest of the queue sitting there
+        while True:
 
-        is_video = next_song.get("is_video", False)
-
-        try:
-            # ── Switch stream correctly ─────────────────
-            if hasattr(call_py, "change_stream"):
-                if is_video:
-                    await call_py.change_stream(
+            # ── No songs left ─────────────────────────────
+            if chat_id not in music_queue or not music_queue[chat_id]:
+                await cleanup_chat(chat_id)
+                try:
+                    await bot.send_message(
                         chat_id,
-                        MediaStream(next_song["url"])
+                        "✅ Queue finished and cleared.",
+                        parse_mode=ParseMode.HTML
                     )
-                else:
-                    await call_py.change_stream(
-                        chat_id,
-                        MediaStream(
-                            next_song["url"],
-                            video_flags=MediaStream.Flags.IGNORE
+                except:
+                    pass
+                return True
+
+            # ── Get next item ─────────────────────────────
+            next_song = music_queue[chat_id].pop(0)
+            current_song[chat_id] = next_song
+            next_song["start_time"] = time.time()
+
+            is_video = next_song.get("is_video", False)
+            session_id = PLAYBACK.load(chat_id)
+
+            try:
+                # ── Switch stream correctly ─────────────────
+                calls = vc_calls(chat_id)
+                if hasattr(calls, "change_stream"):
+                    if is_video:
+                        await calls.change_stream(
+                            chat_id,
+                            MediaStream(next_song["url"])
+                        )
+                    else:
+                        await calls.change_stream(
+                            chat_id,
+                            MediaStream(
+                                next_song["url"],
+                                video_flags=MediaStream.Flags.IGNORE
+                            )
                         )
-                    )
-            else:
-                if is_video:
-                    await call_py.play(chat_id, MediaStream(next_song["url"]))
                 else:
-                    await call_py.play(
-                        chat_id,
-                        MediaStream(
-                            next_song["url"],
-                            video_flags=MediaStream.Flags.IGNORE
+                    if is_video:
+                        await vc_play(chat_id, MediaStream(next_song["url"]))
+                    else:
+                        await vc_play(
+                            chat_id,
+                            MediaStream(
+                                next_song["url"],
+                                video_flags=MediaStream.Flags.IGNORE
+                            )
                         )
+            except Exception as e:
+                log.warning(f"Auto-play of {next_song.get('title')!r} in {chat_id} failed: {e}")
+                try:
+                    await bot.send_message(
+                        chat_id,
+                        f"⚠️ Could not play <i>{html.escape(str(next_song.get('title', 'next item')))}</i>, "
+                        f"skipping:\n<code>{html.escape(str(e))}</code>",
+                        parse_mode=ParseMode.HTML
                     )
+                except:
+                    pass
+                if PLAYBACK.session(chat_id) != session_id:
+                    return True     # /stop or a new /play took the chat over meanwhile
+                continue
 
             vc_active.add(chat_id)  # optional, not trusted anymore
+            PLAYBACK.playing(chat_id, session_id)
+            break
 
-            # ── UI text ────────────────────────────────
-            thumb = f"https://img.youtube.com/vi/{next_song.get('vid')}/hqdefault.jpg"
-            icon = "🎬" if is_video else "🎧"
-            label = "Now Playing (Video)" if is_video else "Now Playing"
+        # ── UI text ────────────────────────────────
+        thumb = f"https://img.youtube.com/vi/{next_song.get('vid')}/hqdefault.jpg"
+        icon = "🎬" if is_video else "🎧"
+        label = "Now Playing (Video)" if is_video else "Now Playing"
 
-            caption = (
-                "<blockquote>"
-                f"<b>{icon} <u>{label}</u></b>\n\n"
-                f"<b>❍ Title:</b> <i>{next_song['title']}</i>\n"
-                f"<b>❍ Requested by:</b> "
-                f"<a href='tg://user?id={next_song['user'].id}'>"
-                f"<u>{next_song['user'].first_name}</u></a>"
-                "</blockquote>"
-            )
+        caption = (
+            "<blockquote>"
+            f"<b>{icon} <u>{label}</u></b>\n\n"
+            f"<b>❍ Title:</b> <i>{next_song['title']}</i>\n"
+            f"<b>❍ Requested by:</b> "
+            f"<a href='tg://user?id={next_song['user'].id}'>"
+            f"<u>{next_song['user'].first_name}</u></a>"
+            "</blockquote>"
+        )
 
-            bar = get_progress_bar(0, next_song.get("duration", 180))
+        bar = get_progress_bar(0, next_song.get("duration", 180))
 
-            # ── REMOVED LYRICS BUTTON ─────────────────
-            kb = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("⏸ Pause", callback_data="pause"),
-                    InlineKeyboardButton("▶ Resume", callback_data="resume"),
-                    InlineKeyboardButton("⏭ Skip", callback_data="skip")
-                ],
-                [InlineKeyboardButton(bar, callback_data="progress")]
-            ])
+        # ── REMOVED LYRICS BUTTON ─────────────────
+        kb = InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("⏸ Pause", callback_data="pause"),
+                InlineKeyboardButton("▶ Resume", callback_data="resume"),
+                InlineKeyboardButton("⏭ Skip", callback_data="skip")
+            ],
+            [InlineKeyboardButton(bar, callback_data="progress")]
+        ])
 
-            msg = await bot.send_photo(
+        try:
+            msg = await TRACER.timed("send_photo", bot.send_photo(
                 chat_id=chat_id,
                 photo=thumb,
                 caption=caption,
                 reply_markup=kb,
                 parse_mode=ParseMode.HTML
-            )
-
-            # ── Progress updater ───────────────────────
-            asyncio.create_task(
-                update_progress_message(
-                    chat_id,
-                    msg,
-                    time.time(),
-                    next_song.get("duration", 180),
-                    caption
-                )
-            )
-
-            # ── Auto-next timer ────────────────────────
-            vc_session[chat_id] = vc_session.get(chat_id, 0) + 1
-            session_id = vc_session[chat_id]
-
-            timers[chat_id] = asyncio.create_task(
-                auto_next_timer(
-                    chat_id,
-                    next_song.get("duration", 180),
-                    session_id
-                )
-            )
-
+            ))
         except Exception as e:
-            try:
-                await bot.send_message(
-                    chat_id,
-                    f"⚠️ Could not auto-play next item:\n<code>{e}</code>",
-                    parse_mode=ParseMode.HTML
-                )
-            except:
-                pass
+            # the track is playing either way; it just gets no progress bar
+            log.warning(f"Now-playing card for {chat_id} failed: {e}")
+            msg = None
+
+        # ── Progress ticks + auto-next watchdog ────
+        arm_track(chat_id, session_id, next_song.get("duration", 180), msg, caption)
+        return True
 
 
 @handler_client.on_message(filters.command("loop"))
 async def loop_command(client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     args = message.command[1:]
 
     if not args or not args[0].isdigit():
@@ -1479,39 +1696,43 @@ async def loop_command(client, message: Message):
     )
 
 
+# 🔹 stream-end is the primary track-end signal; duplicates (and ends of
+# streams we replaced ourselves) are dropped by PLAYBACK.finish()
 if HAS_STREAM_END:
-    @call_py.on_stream_end()
     async def stream_end_handler(_, update):
         chat_id = update.chat_id
 
         if not await is_vc_active(chat_id):
             return
 
-        await handle_next(chat_id)
+        await handle_next(chat_id, min_played=STREAM_END_MIN_PLAYED)
+
+    for _assistant in ASSISTANTS:
+        _assistant.calls.on_stream_end()(stream_end_handler)
+else:
+    log.warning("PyTgCalls version may not support on_stream_end, using timer fallback.")
 
 
 @handler_client.on_message(filters.command("end"))
 async def end_command(client: Client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
 
     chat_id = message.chat.id
 
-    vc_session[chat_id] = vc_session.get(chat_id, 0) + 1
+    PLAYBACK.stop(chat_id)
 
-    t = timers.pop(chat_id, None)
-    if t:
-        t.cancel()
+    timers.pop(chat_id, None)
+    progress_timers.pop(chat_id, None)
+    WHEEL.cancel_key(chat_id)
 
     music_queue.pop(chat_id, None)
     current_song.pop(chat_id, None)
     loop_counts.pop(chat_id, None)
 
     try:
-        await call_py.leave_call(chat_id)
+        await vc_calls(chat_id).leave_call(chat_id)
     except:
         pass
+    ASSISTANTS.release(chat_id)
 
     vc_active.discard(chat_id)
 
@@ -1519,10 +1740,8 @@ async def end_command(client: Client, message: Message):
 
 
 @handler_client.on_message(filters.command("fplay"))
+@TRACER.traced("fplay")
 async def fplay_command(client: Client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     """Force play a song immediately, stopping current playback. The previous current song is moved to the front of the queue."""
     query = " ".join(message.command[1:]).strip()
     if not query:
@@ -1559,7 +1778,7 @@ async def fplay_command(client: Client, message: Message):
 
         try:
             yt_api_url = (
-                f"https://www.googleapis.com/youtube/v3/videos"
+                f"{YOUTUBE_API_URL}/videos"
                 f"?part=snippet,contentDetails&id={vid}&key={YOUTUBE_API_KEY}"
             )
             async with session.get(yt_api_url) as resp:
@@ -1576,6 +1795,9 @@ async def fplay_command(client: Client, message: Message):
 
     lock = get_chat_lock(chat_id)
     async with lock:
+        # new session before stopping: the old stream's end event is now stale
+        session_id = PLAYBACK.load(chat_id)
+
         # if a song is playing, move it to front of queue before replacing
         if chat_id in current_song:
             prev = current_song.pop(chat_id, None)
@@ -1583,19 +1805,17 @@ async def fplay_command(client: Client, message: Message):
                 music_queue.setdefault(chat_id, []).insert(0, prev)
             # stop current playback
             try:
-                if hasattr(call_py, "stop_stream"):
-                    await call_py.stop_stream(chat_id)
-                elif hasattr(call_py, "leave_call"):
-                    await call_py.leave_call(chat_id)
+                calls = vc_calls(chat_id)
+                if hasattr(calls, "stop_stream"):
+                    await calls.stop_stream(chat_id)
+                elif hasattr(calls, "leave_call"):
+                    await calls.leave_call(chat_id)
             except:
                 pass
 
         # start forced song
         try:
-            vc_session[chat_id] = vc_session.get(chat_id, 0) + 1
-            session_id = vc_session[chat_id]
-
-            await call_py.play(chat_id, MediaStream(mp3, video_flags=MediaStream.Flags.IGNORE))
+            await vc_play(chat_id, MediaStream(mp3, video_flags=MediaStream.Flags.IGNORE))
             current_song[chat_id] = {
                 "title": video_title,
                 "url": mp3,
@@ -1604,26 +1824,24 @@ async def fplay_command(client: Client, message: Message):
                 "duration": duration_seconds or 180,
                 "start_time": time.time()
             }
+            PLAYBACK.playing(chat_id, session_id)
             await message.reply_text(f"⏯️ Forced play: <b>{video_title}</b>", parse_mode=ParseMode.HTML)
 
-            # start auto-next timer
-            task = asyncio.create_task(
-                auto_next_timer(chat_id, duration_seconds or 180, session_id)
-            )
-            timers[chat_id] = task
+            # start the auto-next watchdog (replacing the previous track's)
+            arm_track(chat_id, session_id, duration_seconds or 180)
 
 
         except Exception as e:
+            if PLAYBACK.state(chat_id) == LOADING and PLAYBACK.session(chat_id) == session_id:
+                PLAYBACK.stop(chat_id)
             await message.reply_text(f"❌ Could not force-play: {e}")
 
 
 
 
 @handler_client.on_message(filters.command("video"))
+@TRACER.traced("video")
 async def video_command(client: Client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     query = " ".join(message.command[1:]).strip()
     if not query:
         return await message.reply_text(
@@ -1711,14 +1929,14 @@ async def video_command(client: Client, message: Message):
 
 
         # 📤 Send video
-        await client.send_video(
+        await TRACER.timed("send_video", client.send_video(
             chat_id=message.chat.id,
             video=video_path,
             thumb=thumb_path if thumb_path else None,
             caption=caption,
             parse_mode=ParseMode.HTML,
             supports_streaming=True,
-        )
+        ))
 
         # 🧹 Cleanup
         try:
@@ -1744,14 +1962,10 @@ async def video_command(client: Client, message: Message):
 
 @handler_client.on_message(filters.command("resetvc"))
 async def reset_vc(client: Client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     if message.from_user.id not in MODS:
         return
 
     chat_id = message.chat.id
-    vc_session[chat_id] = vc_session.get(chat_id, 0) + 1
     await cleanup_chat(chat_id)
 
     await message.reply_text(
@@ -1763,98 +1977,105 @@ async def reset_vc(client: Client, message: Message):
 
 
 
-# --- Event bindings (timer-based fallback for PyTgCalls builds without stream_end) ---
-async def auto_next_timer(chat_id: int, duration: int, session_id: int):
-    try:
-        await asyncio.sleep(duration)
+# --- Track-end watchdog (the only end signal on PyTgCalls builds without stream_end) ---
+def arm_track(chat_id: int, session_id: int, duration: int, msg=None, caption=None):
+    """Replace the chat's watchdog (and progress ticks, if there's a message) for a new track."""
+    # drops the old track's timers and, if it was skipped while paused, the
+    # pause too; otherwise the new track's timers would start out frozen
+    WHEEL.cancel_key(chat_id)
+    timers.pop(chat_id, None)
+    progress_timers.pop(chat_id, None)
 
-        # ❌ OLD VC TIMER → IGNORE
-        if vc_session.get(chat_id) != session_id:
-            return
+    # WHEEL freezes both while the chat is paused, so paused time doesn't count
+    timers[chat_id] = WHEEL.call_later(
+        duration + WATCHDOG_GRACE, auto_next_timer, chat_id, session_id, key=chat_id
+    )
+    song = current_song.get(chat_id)
+    if msg is not None and song:
+        progress_timers[chat_id] = WHEEL.call_every(
+            PROGRESS_EVERY, update_progress_message, chat_id, msg, song, duration, caption, key=chat_id
+        )
 
-        if not await is_vc_active(chat_id):
-            return
 
-        await handle_next(chat_id)
+async def auto_next_timer(chat_id: int, session_id: int):
+    t = timers.get(chat_id)
+    if t and t.cancelled:   # that was us firing
+        timers.pop(chat_id)
+
+    # ❌ OLD VC TIMER → IGNORE
+    if PLAYBACK.session(chat_id) != session_id:
+        return
 
-    except asyncio.CancelledError:
+    if not await is_vc_active(chat_id):
         return
 
+    if await handle_next(chat_id, session_id) and HAS_STREAM_END:
+        log.info(f"⏱ Watchdog advanced chat {chat_id}: stream end was missed")
 
-# When playing a song, we’ll start this timer
-# Modify handle_next_in_queue to start a timer too
 
+# 🔹 admin-only playback controls: one admin-list fetch per chat, reused
+ADMINS = AdminCache(ttl=300)
+admin_only = admin_filter(ADMINS)
+METRICS.gauge(
+    "bot_admin_cache_lookups", "Admin checks served from cache vs fetched", ["result"],
+    fn=lambda: {("hit",): ADMINS.hits, ("fetch",): ADMINS.fetches}
+)
+ADMIN_COMMANDS = ["mpause", "mresume", "skip", "clear"]
 
-@handler_client.on_message(filters.command("mpause"))
-async def mpause_command(client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
 
-    user = await client.get_chat_member(message.chat.id, message.from_user.id)
-    if not (user.privileges or user.status in ("administrator", "creator")):
-        await message.reply_text("❌ You need to be an admin to use this command.")
-        return
+def paused(chat_id: int):
+    """Record a pause; the chat's watchdog and progress ticks stop with it."""
+    if PLAYBACK.pause(chat_id):
+        WHEEL.pause(chat_id)
+
+
+def resumed(chat_id: int):
+    """Record a resume; the paused span is pushed onto the song's start_time."""
+    WHEEL.resume(chat_id)
+    span = PLAYBACK.resume(chat_id)
+    song = current_song.get(chat_id)
+    if span and song and "start_time" in song:
+        song["start_time"] += span
+
+
+@handler_client.on_message(filters.command("mpause") & admin_only)
+async def mpause_command(client, message: Message):
     try:
-        await call_py.pause(message.chat.id)
+        await vc_calls(message.chat.id).pause(message.chat.id)
+        paused(message.chat.id)
         await message.reply_text("⏸ Paused the stream.")
     except Exception as e:
         await message.reply_text(f"❌ Failed to pause.\n{e}")
 
-@handler_client.on_message(filters.command("mresume"))
+@handler_client.on_message(filters.command("mresume") & admin_only)
 async def mresume_command(client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
-    user = await client.get_chat_member(message.chat.id, message.from_user.id)
-    if not (user.privileges or user.status in ("administrator", "creator")):
-        await message.reply_text("❌ You need to be an admin to use this command.")
-        return
     try:
-        await call_py.resume(message.chat.id)
+        await vc_calls(message.chat.id).resume(message.chat.id)
+        resumed(message.chat.id)
         await message.reply_text("▶️ Resumed the stream.")
     except Exception as e:
         await message.reply_text(f"❌ Failed to resume.\n{e}")
 
-@handler_client.on_message(filters.command("skip"))
+@handler_client.on_message(filters.command("skip") & admin_only)
 async def skip_command(client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     chat_id = message.chat.id   # ✅ FIX: define chat_id
 
-    user = await client.get_chat_member(chat_id, message.from_user.id)
-    if not (user.privileges or user.status in ("administrator", "creator")):
-        await message.reply_text(
-            "❌ <b>You need to be an admin to use this command.</b>",
-            parse_mode=ParseMode.HTML,
-        )
-        return
-
     # ✅ FIX: VC state check
     if not await is_vc_active(chat_id):
         return await message.reply_text("❌ Bot is not in a voice chat.")
 
-    task = timers.pop(chat_id, None)
-    if task:
-        task.cancel()
-
     try:
-        if hasattr(call_py, "stop_stream"):
-
-            await call_py.stop_stream(chat_id)
-        elif hasattr(call_py, "leave_call"):
-            await call_py.leave_call(chat_id)
-        else:
-            await call_py.stop(chat_id)
+        # ✅ Play next song in queue: change_stream replaces the current one,
+        # no stop_stream first (that only produced a second end event)
+        if not await handle_next(chat_id):
+            busy = PLAYBACK.state(chat_id) in (LOADING, TRANSITIONING)
+            return await message.reply_text("⏳ Already switching tracks." if busy else "❌ Nothing is playing.")
 
         await message.reply_text(
             "⏭ <b>Skipped current song.</b>",
             parse_mode=ParseMode.HTML,
         )
 
-        # ✅ Play next song in queue
-        await handle_next(chat_id)
-
     except Exception as e:
         await message.reply_text(
             f"❌ <b>Failed to skip:</b> <code>{e}</code>",
@@ -1862,19 +2083,9 @@ async def skip_command(client, message: Message):
         )
 
 
-@handler_client.on_message(filters.command("clear"))
+@handler_client.on_message(filters.command("clear") & admin_only)
 async def clear_queue(client, message: Message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     chat_id = message.chat.id
-    user = await client.get_chat_member(chat_id, message.from_user.id)
-    if not (user.privileges or user.status in ("administrator", "creator")):
-        await message.reply_text(
-            "❌ <b>You need to be an admin to use this command.</b>",
-            parse_mode=ParseMode.HTML,
-        )
-        return
 
     if chat_id in music_queue:
         count = len(music_queue[chat_id])
@@ -1883,6 +2094,25 @@ async def clear_queue(client, message: Message):
     else:
         await message.reply_text("⚠️ <b>No queued songs to clear.</b>", parse_mode=ParseMode.HTML)
 
+
+# 🔹 same commands from non-admins land here (the admin filter is cached)
+@handler_client.on_message(filters.command(ADMIN_COMMANDS) & ~admin_only)
+async def admin_required(client, message: Message):
+    await message.reply_text(
+        "❌ <b>You need to be an admin to use this command.</b>",
+        parse_mode=ParseMode.HTML,
+    )
+
+
+@handler_client.on_chat_member_updated()
+async def admins_changed(client, update):
+    # promotions/demotions show up here; the TTL covers the ones we miss
+    old = update.old_chat_member
+    new = update.new_chat_member
+    if (old and old.privileges) or (new and new.privileges) or \
+            any(m and str(m.status).rsplit(".", 1)[-1].lower() in ("administrator", "owner", "creator") for m in (old, new)):
+        ADMINS.invalidate(update.chat.id)
+
 # ==============================
 # Native Seek / Seekback + Auto Queue Clear + Ping
 # ==============================
@@ -1910,7 +2140,8 @@ import time
 from pytgcalls.types import MediaStream
 
 async def restart_with_seek(chat_id: int, seek_pos: int, message: Message):
-    """Restart playback at a given position using FFmpeg trim."""
+    """Restart playback at a given position using FFmpeg trim.
+    Not wired to any command: /seek and /seekback seek through change_stream."""
     if chat_id not in music_queue or not music_queue[chat_id]:
         await message.reply("❌ Nothing is playing.")
         return
@@ -1920,14 +2151,11 @@ async def restart_with_seek(chat_id: int, seek_pos: int, message: Message):
     title = song_info["title"]
 
     try:
-        # stop or leave current VC before replaying
-        try:
-            await call_py.leave_call(chat_id)
-        except Exception:
-            pass
-
         trimmed_path = f"seeked_{chat_id}.mp3"
 
+        # a newer /seek supersedes any trim still queued/running for this chat
+        FFMPEG_JOBS.cancel(chat_id)
+
         # run ffmpeg to trim from seek_pos
         cmd = [
             "ffmpeg", "-y",
@@ -1936,13 +2164,20 @@ async def restart_with_seek(chat_id: int, seek_pos: int, message: Message):
             "-acodec", "copy",
             trimmed_path
         ]
-        proc = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        await proc.communicate()
+        code, _, err = await FFMPEG_JOBS.run(cmd, priority=INTERACTIVE, timeout=60, tag=chat_id)
+        if code != 0:
+            lines = err.decode(errors="ignore").strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else "ffmpeg failed")
+
+        # stop or leave current VC before replaying
+        try:
+            await vc_calls(chat_id).leave_call(chat_id)
+        except Exception:
+            pass
 
         # replay trimmed file
-        await call_py.play(chat_id, MediaStream(trimmed_path, video_flags=MediaStream.Flags.IGNORE))
+        PLAYBACK.restarted(chat_id)
+        await vc_play(chat_id, MediaStream(trimmed_path, video_flags=MediaStream.Flags.IGNORE))
         song_info["start_time"] = time.time() - seek_pos
 
         await message.reply(f"⏩ Seeked to {format_time(seek_pos)} in **{title}**")
@@ -1953,9 +2188,6 @@ async def restart_with_seek(chat_id: int, seek_pos: int, message: Message):
 
 @handler_client.on_message(filters.command("seek"))
 async def seek_cmd(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     chat_id = message.chat.id
 
     if len(message.command) < 2:
@@ -1969,13 +2201,15 @@ async def seek_cmd(client, message):
         return await message.reply_text("❌ Enter a valid number of seconds.")
 
     # 🔥 REAL PLAYING CHECK (important)
+    calls = vc_calls(chat_id)
     try:
-        call = call_py.get_call(chat_id)
+        call = calls.get_call(chat_id)
     except:
         return await message.reply_text("❌ Nothing is playing.")
 
     # 🔁 SEEK FORWARD
-    await call_py.change_stream(
+    PLAYBACK.restarted(chat_id)
+    await calls.change_stream(
         chat_id,
         MediaStream(
             call.input.filename,
@@ -1989,9 +2223,6 @@ async def seek_cmd(client, message):
 
 @handler_client.on_message(filters.command("seekback"))
 async def seekback_cmd(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     chat_id = message.chat.id
 
     if len(message.command) < 2:
@@ -2005,13 +2236,15 @@ async def seekback_cmd(client, message):
         return await message.reply_text("❌ Enter a valid number of seconds.")
 
     # 🔥 REAL PLAYING CHECK
+    calls = vc_calls(chat_id)
     try:
-        call = call_py.get_call(chat_id)
+        call = calls.get_call(chat_id)
     except:
         return await message.reply_text("❌ Nothing is playing.")
 
     # ⏪ SEEK BACKWARD (negative seek)
-    await call_py.change_stream(
+    PLAYBACK.restarted(chat_id)
+    await calls.change_stream(
         chat_id,
         MediaStream(
             call.input.filename,
@@ -2023,20 +2256,6 @@ async def seekback_cmd(client, message):
     await message.reply_text(f"⏪ Seeked back {seconds} seconds.")
 
 
-# ==============================
-# Auto queue clear when VC ends
-# ==============================
-try:
-    @call_py.on_stream_end()
-    async def on_stream_end_handler(_, update):
-        chat_id = update.chat_id
-        await handle_next(chat_id)
-
-
-except Exception:
-    log.warning("PyTgCalls version may not support on_stream_end, using timer fallback.")
-
-
 # ==============================
 # Ping command (mods only)
 # ==============================
@@ -2089,28 +2308,29 @@ async def callback_handler(client, cq: CallbackQuery):
     chat_id = cq.message.chat.id
     data = cq.data
 
+    calls = vc_calls(chat_id)
+
     if data == "pause":
         try:
-            await call_py.pause(chat_id)
+            await calls.pause(chat_id)
+            paused(chat_id)
             await cq.answer("⏸ Paused playback.")
         except Exception as e:
             await cq.answer(f"Error: {e}", show_alert=True)
 
     elif data == "resume":
         try:
-            await call_py.resume(chat_id)
+            await calls.resume(chat_id)
+            resumed(chat_id)
             await cq.answer("▶ Resumed playback.")
         except Exception as e:
             await cq.answer(f"Error: {e}", show_alert=True)
 
     elif data == "skip":
         try:
-            if hasattr(call_py, "stop_stream"):
-                await call_py.stop_stream(chat_id)
-            elif hasattr(call_py, "leave_call"):
-                await call_py.leave_call(chat_id)
-            else:
-                await call_py.stop(chat_id)
+            if not await handle_next(chat_id):
+                busy = PLAYBACK.state(chat_id) in (LOADING, TRANSITIONING)
+                return await cq.answer("⏳ Already switching tracks." if busy else "Nothing is playing.")
 
             await cq.answer("⏭ Skipping current song...")
         except Exception as e:
@@ -2128,30 +2348,33 @@ async def reload_playlists(client, message):
 
     if not message.reply_to_message or not message.reply_to_message.document:
         return await message.reply_text(
-            "❌ Reply to playlists JSON file."
+            "❌ Reply to a playlist backup (snapshot first, then each delta in order)."
         )
 
     doc = message.reply_to_message.document
-    if not doc.file_name.endswith(".json"):
+    if not doc.file_name.endswith((".json", ".json.gz")):
         return await message.reply_text("❌ Invalid file type.")
 
     path = await message.reply_to_message.download()
 
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        if not isinstance(data, dict):
-            raise ValueError("Invalid playlist structure")
+        # snapshot (or legacy plain .json) replaces everything,
+        # a delta is applied on top of what is loaded now
+        data = PLAYLIST_BACKUP.restore_file(path, dict(USER_PLAYLISTS))
 
         # update single source of truth in-place
-        global USER_PLAYLISTS, playlists
         USER_PLAYLISTS.clear()
         USER_PLAYLISTS.update(data)
         playlists.clear()
         playlists.update(data)
+        PLAYLIST_INDEX.rebuild(USER_PLAYLISTS)
+        save_playlists()
 
-        await message.reply_text("✅ Playlists reloaded successfully.")
+        await message.reply_text(
+            f"✅ Playlists reloaded successfully.\n"
+            f"<code>{PLAYLIST_BACKUP.hash[:8]}</code>",
+            parse_mode=ParseMode.HTML
+        )
 
     except Exception as e:
         await message.reply_text(f"❌ Reload failed:\n<code>{e}</code>")
@@ -2168,213 +2391,166 @@ async def manual_backup(client, message):
     if message.from_user.id not in MODS:
         return
 
-    dump_playlists_to_file()
+    # /backup full -> force a fresh snapshot
+    full = len(message.command) > 1 and message.command[1].lower() == "full"
+    path = backup_playlists(full=full)
+
+    if not path:
+        return await message.reply_text(
+            f"📦 Nothing changed since the last backup (<code>{PLAYLIST_BACKUP.hash[:8]}</code>).\n"
+            f"Use <code>/backup full</code> for a fresh snapshot.",
+            parse_mode=ParseMode.HTML
+        )
 
     await client.send_document(
         message.chat.id,
-        PLAYLIST_BACKUP_FILE,
+        path,
         caption="📦 Manual playlist backup"
     )
 
 
+@handler_client.on_message(filters.command("trace"))
+async def trace_command(client, message):
+    """/trace [slow] [n] | /trace #id | /trace json"""
+    if message.from_user.id not in MODS:
+        return
 
-# ================= AI SYSTEM PROMPT =================
-
-SYSTEM_PROMPT = (
-    "- Identity:\n"
-    "  - Name: Waguri\n"
-    "  - Personality: sarcastic, witty, mildly savage\n"
-    "  - Tone: human, street-smart, confident\n"
-    "  - Slightly rude, never formal, never soft\n\n"
-
-    "- Core Rule (MOST IMPORTANT):\n"
-    "  - Always answer the user's question first\n"
-    "  - Roasting is allowed ONLY after giving the answer\n"
-    "  - If no question is asked, respond with sarcasm\n\n"
-
-    "- Reply Style:\n"
-    "  - Short replies (1–3 lines max)\n"
-    "  - Clear, direct, useful\n"
-    "  - Cool sarcasm, not aggressive abuse\n"
-    "  - Slang allowed but readable\n"
-    "  - No unnecessary roasting\n\n"
-
-    "- Forbidden:\n"
-    "  - No emojis\n"
-    "  - No hashtags\n"
-    "  - No apologies\n"
-    "  - No \"as an AI\"\n\n"
-
-    "- Behavior Rules:\n"
-    "  - Do NOT refuse to answer normal questions\n"
-    "  - Do NOT roast instead of answering\n"
-    "  - Sarcasm should enhance replies, not replace them\n"
-    "  - Stay confident, not annoying\n\n"
-
-    "- Conversation Rules:\n"
-    "  - Remember previous messages\n"
-    "  - Maintain context\n"
-    "  - Follow-ups must connect properly\n"
-    "  - Explain briefly when needed\n\n"
-
-    "- Greeting Handling:\n"
-    "  - hi/hello/gm/gn → dry, dismissive, not abusive\n"
-    "  - Max 2 lines\n\n"
-
-    "- Mobile Phone Rule:\n"
-    "  - Use fixed bullet format only:\n"
-    "    - Manufacturer\n"
-    "    - Display\n"
-    "    - Processor\n"
-    "    - RAM & Storage\n"
-    "    - Camera\n"
-    "    - Battery\n"
-    "    - Build & Durability\n"
-    "    - Connectivity\n"
-    "    - Extras\n"
-    "  - No storytelling, no deep explanations\n\n"
-
-    "- Output Constraints:\n"
-    "  - No long intros\n"
-    "  - No emotional sympathy\n"
-    "  - No character breaks\n"
-    "  - Savage, but smart\n"
-)
-
-
-chat_history = {}
-MAX_HISTORY = 10
-
-
-from groq import Groq
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    args = [a.lower() for a in message.command[1:]]
 
-async def ask_groq(chat_id: int, query: str) -> str:
-    raw_history = chat_history.get(chat_id, [])
+    if args and args[0] == "json":
+        path = os.path.join(tempfile.gettempdir(), "traces.json")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(TRACER.export())
+        return await client.send_document(message.chat.id, path, caption=f"🔍 {len(TRACER.traces)} trace(s)")
 
-    history = [
-        msg for msg in raw_history
-        if isinstance(msg, dict)
-        and "role" in msg
-        and "content" in msg
-    ]
+    if args and args[0].startswith("#") and args[0][1:].isdigit():
+        trace = TRACER.get(int(args[0][1:]))
+        if not trace:
+            return await message.reply_text("No such trace (it may have rotated out).")
+        return await message.reply_text(
+            f"<pre>{html.escape(format_trace(trace))}</pre>", parse_mode=ParseMode.HTML
+        )
 
-    history.append({"role": "user", "content": query})
-    history = history[-10:]
+    slow = bool(args) and args[0] == "slow"
+    n = next((int(a) for a in args if a.isdigit()), 3)
+    traces = TRACER.slowest(n) if slow else TRACER.recent(n)
+    if not traces:
+        return await message.reply_text("No traces yet.")
 
-    response = groq_client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            *history
-        ],
-        temperature=0.4
+    text = "\n\n".join(format_trace(t) for t in traces)
+    await message.reply_text(
+        f"<b>{'Slowest' if slow else 'Latest'} traces</b>\n<pre>{html.escape(text[-3800:])}</pre>",
+        parse_mode=ParseMode.HTML
     )
 
-    reply = response.choices[0].message.content.strip()
-
-    history.append({"role": "assistant", "content": reply})
-    chat_history[chat_id] = history
-
-    return reply
-
-
-
-from google import genai
-from google.genai.types import GenerateContentConfig
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-MODEL = "gemini-2.5-flash"
 
-async def ask_ai(chat_id: int, query: str) -> str:
-    history = chat_history.get(chat_id, [])
+# ================= AI =================
+from core.ai_client import stream_chat, AIError, RESPONSE_CACHE, ROUTER, chat_history, compact_histories
+from core.stream_reply import stream_reply
+from core.coalesce import ChatCoalescer, merge_texts
+from core.dispatch import TextRouter, AFK_RETURN, AFK_MENTION, AI
+from core.profiles import ProfileCache
 
-    history.append(f"User: {query}")
-    history = history[-MAX_HISTORY:]
 
-    formatted_history = []
-
-    for msg in history:
-        if isinstance(msg, dict):
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            formatted_history.append(f"{role.capitalize()}: {content}")
-        else:
-            formatted_history.append(msg)
+async def answer_ai_burst(chat_id, batch):
+    """One AI reply for a debounced burst of triggers, sent to the newest message."""
+    message = batch[-1][0]
+    try:
+        await stream_reply(message, stream_chat(chat_id, merge_texts(batch)))
+    except AIError as e:
+        log.warning(f"AI reply failed: {e}")
+    except Exception as e:
+        # Telegram send/edit errors: nothing awaits this task to see them
+        log.error(f"AI reply to chat {chat_id} could not be delivered: {e}")
 
-    prompt = SYSTEM_PROMPT + "\n\n" + "\n".join(formatted_history)
 
+# mentions / "waguri" / replies to the bot: merged per chat, one call in flight
+AI_TRIGGERS = ChatCoalescer(answer_ai_burst)
 
-    response = client.models.generate_content(
-        model=MODEL,
-        contents=prompt,
-        config=GenerateContentConfig(temperature=0.4)
-    )
-
-    reply = response.text.strip()
-    history.append(f"Waguri: {reply}")
-    chat_history[chat_id] = history
+# every non-command message is classified once here and sent to at most the
+# routes that apply (AFK return/mention, AI trigger); see text_router below
+TEXT_ROUTER = TextRouter(
+    afk_users,
+    triggers=("waguri",), usernames=("BestFreakingBot",),
+    resolve=lambda name: PROFILES.resolve(name)
+)
 
-    return reply
 
+async def persist_ai_history(interval: int = 60):
+    """Flush AI chat memory to disk in batches (no-op unless AI_HISTORY_FILE is set)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            chat_history.save()
+        except Exception as e:
+            log.error(f"Saving AI history failed: {e}")
 
 
 @handler_client.on_message(filters.command("ask") & filters.text)
 async def ask_handler(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
-
     if len(message.command) < 2:
         await message.reply_text("Say it properly.")
         return
 
     query = " ".join(message.command[1:])
-    reply = await ask_ai(message.chat.id, query)
-    await message.reply_text(reply)
-
-
-@handler_client.on_message(filters.mentioned & filters.text)
-async def mention_handler(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
+    try:
+        await stream_reply(message, stream_chat(message.chat.id, query))
+    except AIError as e:
+        log.warning(f"AI reply failed: {e}")
+        await message.reply_text("Brain's jammed right now, try again in a bit.")
 
-    query = message.text.replace("@BestFreakingBot", "").strip()
-    if not query:
-        query = "Hello"
-    reply = await ask_groq(message.chat.id, query)
-    await message.reply_text(reply)
 
+# user profiles seen in chat + @username -> id, so AFK mentions need no API calls
+PROFILES = ProfileCache(ttl=600, keep=afk_users)
 
-@handler_client.on_message(filters.text)
-async def name_call_handler(client, message):
-    if message.from_user.id in BANNED_USERS:
-        return
 
-    if message.text.startswith("/"):
-        return
-
-    if "waguri" in message.text.lower():
-        reply = await ask_groq(message.chat.id, message.text)
-        await message.reply_text(reply)
+@TEXT_ROUTER.on(AI)
+async def ai_trigger(client, message, query):
+    AI_TRIGGERS.submit(message.chat.id, message, query)
 
 
-@handler_client.on_message(filters.reply & filters.text)
-async def reply_handler(client, message):
-    if message.from_user.id in BANNED_USERS:
+@handler_client.on_message(filters.command("aistats"))
+async def ai_stats(client, message):
+    if message.from_user.id not in MODS:
         return
 
-    replied = message.reply_to_message
-    if replied and replied.from_user.id == client.me.id:
-        reply = await ask_groq(message.chat.id, message.text)
-        await message.reply_text(reply)
+    st = RESPONSE_CACHE.stats()
+    mem = chat_history.stats()
+
+    routes = ROUTER.report()
+    hedges = routes.pop("_hedges")
+    backends = "\n".join(
+        f"• {name}: p50 <code>{(r['p50'] or 0) * 1000:.0f}ms</code> "
+        f"p95 <code>{(r['p95'] or 0) * 1000:.0f}ms</code> "
+        f"err <code>{r['error_rate'] * 100:.0f}%</code>"
+        f"{'' if r['healthy'] else ' (tripped)'}"
+        for name, r in routes.items()
+    ) + f"\n• hedges fired/won: <code>{hedges['fired']}/{hedges['won']}</code>"
+    burst = AI_TRIGGERS.stats()
+    routed = TEXT_ROUTER.stats()
+    await message.reply_text(
+        "<b>AI response cache</b>\n"
+        f"• Hit rate: <code>{st['hit_rate'] * 100:.1f}%</code> "
+        f"({st['hits']} hits / {st['misses']} misses)\n"
+        f"• Keys: <code>{st['keys']}</code>, evicted: <code>{st['evictions']}</code>\n"
+        "<b>AI memory</b>\n"
+        f"• Chats: <code>{mem['chats']}</code>, tokens: <code>{mem['tokens']}</code>\n"
+        "<b>Backends</b>\n"
+        f"{backends}\n"
+        "<b>Triggers</b>\n"
+        f"• {burst['submitted']} submitted → {burst['calls']} calls, "
+        f"{burst['in_flight']} in flight\n"
+        f"• Router: {routed['seen']} seen, {routed['ai']} to AI, "
+        f"{routed['afk_return'] + routed['afk_mention']} to AFK",
+        parse_mode=ParseMode.HTML
+    )
 
 
 # ================= AFK LOGIC ================= #
 
 @bot.on_message(filters.command("afk"), group=-1)
 async def afk_command(client, message):
-    global afk_users
-
     user = message.from_user
     reason = "None"
 
@@ -2393,22 +2569,8 @@ async def afk_command(client, message):
             afk_media = reply.sticker.file_id
             afk_media_type = "sticker"
 
-    chat_id = message.chat.id
-    existing = afk_users.get(user.id)
-
-    if existing:
-        chats = existing.get("chats", set())
-        chats.add(chat_id)
-    else:
-        chats = {chat_id}
-
-    afk_users[user.id] = {
-        "time": datetime.utcnow(),
-        "reason": reason,
-        "media": afk_media,
-        "media_type": afk_media_type,
-        "chats": chats,
-    }
+    PROFILES.observe(user)
+    afk_users.set(user.id, message.chat.id, reason, afk_media, afk_media_type, user.username)
 
     text = (
         f"<a href='tg://user?id={user.id}'>"
@@ -2421,112 +2583,61 @@ async def afk_command(client, message):
     await message.reply_text(text)
 
 
-@bot.on_message(filters.all & ~filters.command(["afk"]))
-async def afk_watcher(client, message):
-    global afk_users
-
-    if not message.from_user:
-        return
-
-    sender_id = message.from_user.id
-    current_chat = message.chat.id
-
-    # === AFK RETURN CHECK ===
-    if sender_id in afk_users:
-        afk_data = afk_users.pop(sender_id)
-
-        duration = datetime.utcnow() - afk_data["time"]
-        seconds = int(duration.total_seconds())
-        h, rem = divmod(seconds, 3600)
-        m, s = divmod(rem, 60)
-
-        parts = []
-        if h: parts.append(f"{h}h")
-        if m: parts.append(f"{m}m")
-        if s: parts.append(f"{s}s")
+def afk_duration(since) -> str:
+    seconds = int((datetime.utcnow() - since).total_seconds())
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
 
-        duration_str = " ".join(parts) or "moments"
-
-        text = (
-            f"<a href='tg://user?id={sender_id}'>"
-            f"{message.from_user.first_name}</a> is now back online "
-            f"and was AFK for {duration_str}."
-        )
-
-        if afk_data.get("reason") and afk_data["reason"] != "None":
-            text += f"\nReason: {afk_data['reason']}"
-
-        await message.reply_text(text, parse_mode=ParseMode.HTML)
-
-        if afk_data:
-            duration = datetime.utcnow() - afk_data["time"]
-            seconds = int(duration.total_seconds())
-            h, rem = divmod(seconds, 3600)
-            m, s = divmod(rem, 60)
+    parts = []
+    if h: parts.append(f"{h}h")
+    if m: parts.append(f"{m}m")
+    if s: parts.append(f"{s}s")
 
-            parts = []
-            if h: parts.append(f"{h}h")
-            if m: parts.append(f"{m}m")
-            if s: parts.append(f"{s}s")
+    return " ".join(parts) or "moments"
 
-            duration_str = " ".join(parts) or "moments"
 
-            text = (
-                f"<a href='tg://user?id={sender_id}'>"
-                f"{message.from_user.first_name}</a> is now back online and was AFK for {duration_str}."
-            )
+@TEXT_ROUTER.on(AFK_RETURN)
+async def afk_return(client, message, _):
+    sender_id = message.from_user.id
 
-            if afk_data.get("reason") and afk_data["reason"] != "None":
-                text += f"\nReason: {afk_data['reason']}"
+    # /afk itself is routed too (group 1 sees every message); don't undo it
+    words = (message.text or "").split(maxsplit=1)
+    if words and words[0].split("@")[0].lower() == "/afk":
+        return
 
-            await message.reply_text(text, parse_mode=ParseMode.HTML)
+    # talking anywhere ends AFK; it's only announced where they went AFK
+    afk_data = afk_users.pop(sender_id)
+    if not afk_data or message.chat.id not in afk_data["chats"]:
+        return
 
-    # === MENTION CHECK ===
-    mentioned = set()
+    text = (
+        f"<a href='tg://user?id={sender_id}'>"
+        f"{message.from_user.first_name}</a> is now back online "
+        f"and was AFK for {afk_duration(afk_data['time'])}."
+    )
 
-    if message.entities:
-        for ent in message.entities:
-            if ent.type == "text_mention" and ent.user:
-                if ent.user.id in afk_users:
-                    mentioned.add(ent.user.id)
+    if afk_data.get("reason") and afk_data["reason"] != "None":
+        text += f"\nReason: {afk_data['reason']}"
 
-            elif ent.type == "mention":
-                username = message.text[ent.offset:ent.offset + ent.length]
-                for uid in afk_users:
-                    try:
-                        user = await client.get_users(uid)
-                        if user.username and username.lower() == f"@{user.username.lower()}":
-                            mentioned.add(uid)
-                    except:
-                        continue
+    await message.reply_text(text, parse_mode=ParseMode.HTML)
 
-    if message.reply_to_message:
-        replied_user = message.reply_to_message.from_user
-        if replied_user and replied_user.id in afk_users:
-            mentioned.add(replied_user.id)
 
+@TEXT_ROUTER.on(AFK_MENTION)
+async def afk_mention(client, message, mentioned):
     for uid in mentioned:
-        afk_data = afk_users.get(uid)
+        afk_data = afk_users.in_chat(uid, message.chat.id)
         if not afk_data:
             continue
 
-        duration = datetime.utcnow() - afk_data["time"]
-        seconds = int(duration.total_seconds())
-        h, rem = divmod(seconds, 3600)
-        m, s = divmod(rem, 60)
-
-        parts = []
-        if h: parts.append(f"{h}h")
-        if m: parts.append(f"{m}m")
-        if s: parts.append(f"{s}s")
-
-        duration_str = " ".join(parts) or "moments"
-
-        user = await client.get_users(uid)
+        try:
+            user = await PROFILES.get(client, uid)
+            name = user.first_name
+        except:
+            name = "User"
 
         text = (
             f"<a href='tg://user?id={uid}'>"
-            f"{user.first_name}</a> is AFK since {duration_str}."
+            f"{name}</a> is AFK since {afk_duration(afk_data['time'])}."
         )
 
         if afk_data.get("reason") and afk_data["reason"] != "None":
@@ -2535,26 +2646,108 @@ async def afk_watcher(client, message):
         await message.reply_text(text, parse_mode=ParseMode.HTML)
 
 
+async def persist_afk(interval: int = 30):
+    """Expire old AFK statuses and flush changes to disk in batches."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            afk_users.sweep()
+            afk_users.save()
+        except Exception as e:
+            log.error(f"Saving AFK statuses failed: {e}")
+
+
+# 🔹 single entry for non-command traffic; group 1 so commands in group 0 still run
+@handler_client.on_message(filters.all, group=1)
+async def text_router(client, message):
+    PROFILES.observe(message.from_user)
+    if message.reply_to_message:
+        PROFILES.observe(message.reply_to_message.from_user)
+    await TEXT_ROUTER.dispatch(client, message)
+
+
 # ================================
 #   Docker / Render-safe startup
 #   + Telegram playlist backup
 # ================================
-import threading
 import asyncio
 import signal
 import traceback
 
 
-def start_flask():
-    """Run Flask keepalive webserver in background thread."""
-    threading.Thread(target=run_flask, daemon=True).start()
-    log.info("🌐 Flask webserver started in background thread.")
+from core.loopmon import LoopMonitor
+from core.web import WebServer
+
+LOOP_MONITOR = LoopMonitor(slow=int(os.getenv("LOOP_SLOW_MS", "100")) / 1000)
+
+# names of assistants whose PyTgCalls finished start()
+CALLS_STARTED = set()
+
+
+def readiness() -> dict:
+    """Ready = every client connected and the primary PyTgCalls started."""
+    checks = {"userbot": bool(getattr(userbot, "is_connected", False)),
+              "pytgcalls": ASSISTANTS.primary.name in CALLS_STARTED}
+    if bot:
+        checks["bot"] = bool(getattr(bot, "is_connected", False))
+    return checks
+
+
+# keepalive for Render + ops endpoints, served from the bot's own loop
+WEB = WebServer(
+    port=int(os.getenv("PORT", 5000)),
+    ready=readiness,
+    metrics=METRICS,
+    admin_token=os.getenv("ADMIN_TOKEN"),
+)
+
+
+@WEB.admin("stats")
+def web_stats():
+    return {
+        "readiness": readiness(),
+        "playback": PLAYBACK.stats(),
+        "timers": WHEEL.stats(),
+        "ai_cache": RESPONSE_CACHE.stats(),
+        "ai_memory": chat_history.stats(),
+        "ai_backends": ROUTER.report(),
+        "triggers": AI_TRIGGERS.stats(),
+        "text_router": TEXT_ROUTER.stats(),
+        "profiles": PROFILES.stats(),
+        "admins": ADMINS.stats(),
+        "assistants": ASSISTANTS.load(),
+        "ffmpeg": FFMPEG_JOBS.stats(),
+        "loop": LOOP_MONITOR.stats(),
+        "playing": len(current_song),
+        "queued": sum(len(q) for q in music_queue.values()),
+    }
+
+
+@WEB.admin("traces")
+def web_traces():
+    return [t.to_dict() for t in TRACER.traces]
 
 
 async def start_services():
     """Start Pyrogram userbot + bot + PyTgCalls safely, keep idle loop,
     and auto-backup playlists on shutdown.
     """
+    # 🔹 loop lag + slow callback reporting (threshold via LOOP_SLOW_MS)
+    LOOP_MONITOR.start()
+    WHEEL.start()
+
+    # 🔹 health/ready/metrics before the clients, so the host sees us booting
+    try:
+        await WEB.start()
+    except Exception as e:
+        log.error(f"Web server failed to start: {e}")
+
+    try:
+        BANNED_USERS.load()
+        log.info(f"🚫 {len(BANNED_USERS)} banned user(s) loaded.")
+    except Exception as e:
+        log.error(f"Failed to load bans: {e}")
+
     # 🔹 Load playlists on startup
     try:
         load_playlists()
@@ -2562,6 +2755,22 @@ async def start_services():
     except Exception as e:
         log.error(f"Failed to load playlists: {e}")
 
+    try:
+        chat_history.load()
+        asyncio.create_task(persist_ai_history())
+        asyncio.create_task(compact_histories())
+    except Exception as e:
+        log.error(f"Failed to load AI history: {e}")
+
+    try:
+        afk_users.load()
+        # nobody still AFK has spoken since the restart: index their @names now
+        for username, uid in afk_users.usernames():
+            PROFILES.remember(username, uid)
+        asyncio.create_task(persist_afk())
+    except Exception as e:
+        log.error(f"Failed to load AFK statuses: {e}")
+
     try:
         log.info("🚀 Initializing clients...")
 
@@ -2569,8 +2778,23 @@ async def start_services():
         log.info("[Userbot] connected.")
 
         await call_py.start()
+        CALLS_STARTED.add(ASSISTANTS.primary.name)
         log.info("[PyTgCalls] ready.")
 
+        # extra assistants are optional: a broken session just stays out of rotation
+        for assistant in ASSISTANTS.assistants[1:]:
+            try:
+                await assistant.client.start()
+                await assistant.calls.start()
+                CALLS_STARTED.add(assistant.name)
+                log.info(f"[{assistant.name}] connected.")
+            except Exception as e:
+                ASSISTANTS.mark_dead(assistant)
+                log.error(f"[{assistant.name}] failed to start: {e}")
+
+        if len(ASSISTANTS) > 1:
+            asyncio.create_task(assistant_watchdog())
+
         if bot:
             await bot.start()
             log.info("[Bot] started.")
@@ -2587,30 +2811,43 @@ async def start_services():
 
         # 🔹 AUTO BACKUP PLAYLISTS TO DM
         try:
-            dump_playlists_to_file()
-
-            sender = bot if bot else userbot
-            await sender.send_document(
-                BACKUP_CHAT_ID,
-                PLAYLIST_BACKUP_FILE,
-                caption="📦 Playlist auto-backup before shutdown"
-            )
-
-            log.info("📦 Playlist backup sent successfully.")
+            path = backup_playlists()
+
+            if path:
+                sender = bot if bot else userbot
+                await sender.send_document(
+                    BACKUP_CHAT_ID,
+                    path,
+                    caption="📦 Playlist auto-backup before shutdown"
+                )
+                log.info("📦 Playlist backup sent successfully.")
+            else:
+                log.info("📦 Playlists unchanged since last backup, skipping upload.")
 
         except Exception as e:
             log.error(f"Playlist backup failed: {e}")
 
-        # 🔹 STOP SERVICES CLEANLY
         try:
-            await call_py.stop()
-        except Exception:
-            pass
+            chat_history.save()
+        except Exception as e:
+            log.error(f"AI history save failed: {e}")
 
         try:
-            await userbot.stop()
-        except Exception:
-            pass
+            afk_users.save()
+        except Exception as e:
+            log.error(f"AFK save failed: {e}")
+
+        # 🔹 STOP SERVICES CLEANLY
+        for assistant in ASSISTANTS:
+            try:
+                await assistant.calls.stop()
+            except Exception:
+                pass
+
+            try:
+                await assistant.client.stop()
+            except Exception:
+                pass
 
         if bot:
             try:
@@ -2618,13 +2855,17 @@ async def start_services():
             except Exception:
                 pass
 
+        WHEEL.stop()
+        try:
+            await WEB.stop()
+        except Exception:
+            pass
+
         log.info("🟢 Clean shutdown complete.")
 
 
 def main():
     """Entry point for Docker / Render deployment."""
-    start_flask()  # non-blocking webserver thread
-
     loop = asyncio.get_event_loop()
     stop_event = asyncio.Event()
 
@@ -0,0 +1,69 @@
+from core.timerwheel import TimerWheel
+
+
+def run(wheel, ticks):
+    for _ in range(ticks):
+        wheel._advance()
+
+
+def test_timer_fires_on_its_tick():
+    wheel = TimerWheel()
+    fired = []
+    wheel.call_later(3, fired.append, "done")
+    run(wheel, 2)
+    assert fired == []
+    run(wheel, 1)
+    assert fired == ["done"]
+    assert len(wheel) == 0
+
+
+def test_pause_freezes_and_resume_keeps_remaining():
+    wheel = TimerWheel()
+    fired = []
+    wheel.call_later(5, fired.append, "end", key=1)
+    run(wheel, 2)
+    wheel.pause(1)
+    run(wheel, 100)
+    assert fired == []
+    wheel.resume(1)
+    run(wheel, 2)
+    assert fired == []
+    run(wheel, 1)
+    assert fired == ["end"]
+
+
+def test_skip_while_paused_arms_a_live_watchdog():
+    # what song.arm_track does when a paused chat moves to its next track:
+    # cancel_key() drops the old timers and the pause, then the new ones go on
+    wheel = TimerWheel()
+    fired = []
+    wheel.call_later(180, fired.append, "old", key=1)
+    wheel.call_every(15, fired.append, "old progress", key=1)
+    run(wheel, 10)
+    wheel.pause(1)
+
+    wheel.cancel_key(1)
+    wheel.call_later(4, fired.append, "new", key=1)
+    run(wheel, 4)
+    assert fired == ["new"]
+
+
+def test_timers_added_while_paused_wait_for_resume():
+    wheel = TimerWheel()
+    fired = []
+    wheel.pause(1)
+    wheel.call_later(2, fired.append, "x", key=1)
+    run(wheel, 10)
+    assert fired == []
+    wheel.resume(1)
+    run(wheel, 2)
+    assert fired == ["x"]
+
+
+def test_long_timers_cascade_down():
+    wheel = TimerWheel(bits=2, levels=2)
+    fired = []
+    for delay in (1, 3, 4, 5, 16, 17, 40):
+        wheel.call_later(delay, fired.append, delay)
+    run(wheel, 40)
+    assert fired == [1, 3, 4, 5, 16, 17, 40]